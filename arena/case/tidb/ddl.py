@@ -0,0 +1,30 @@
+import unittest
+
+from arena.tidb.table import Table, TableForker
+from arena.tidb.testkit import *
+
+
+def _expected_row(table: Table):
+    return tuple(1 if c.type == 'int' else '1' for c in table.columns.columns)
+
+
+class TableTest(unittest.TestCase):
+    @fork_test(debug=True)
+    def test_create_table(self):
+        tk = tidb_testkit()
+        table: Table = yield TableForker()
+
+        conn: TidbConnection = tk.connect(host='127.0.0.1', port=4000, user='root')
+        # the branches after the first one of a schema get its table back emptied instead of creating it again
+        table = conn.create_table(table, pooled=True)
+        conn.query(f'select * from {table.name}').check([])
+
+        row = _expected_row(table)
+        conn.exec_sql('begin')
+        conn.exec_sql(f'insert into {table.name} values (1, 1)')
+        conn.query(f'select * from {table.name}').check([row])
+        conn.exec_sql('commit')
+        if table.temp_type and table.temp_type.commit:
+            conn.query(f'select * from {table.name}').check([])
+        else:
+            conn.query(f'select * from {table.name}').check([row])
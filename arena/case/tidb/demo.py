@@ -19,9 +19,11 @@ class SimpleTxnTestState(EventDrivenState):
 
     def setup(self):
         self.conn = self.connect()
-        self.conn.exec_sql('use test')
-        self.conn.exec_sql('drop table if exists t')
-        self.conn.exec_sql('create table t(id int primary key)')
+        self.conn.exec_batch([
+            'use test',
+            'drop table if exists t',
+            'create table t(id int primary key)',
+        ])
 
     def close(self):
         self.conn.exec_sql('drop table if exists t')
@@ -51,20 +51,16 @@ class TxnTest(BaseTxnTest):
         conn: TidbConnection = tk.connect(user='root', port=4001)
         conn2: TidbConnection = tk.connect(user='root', port=4001)
 
-        if read_committed:
-            conn.exec_sql("set tx_isolation = 'READ-COMMITTED'")
-
-        conn.exec_sql('set autocommit=1')
-        conn.exec_sql('drop table if exists t1')
-        conn.exec_sql('create table t1 (id int primary key, v int)')
         tk.defer(conn.exec_sql, 'drop table if exists t1')
-        conn.exec_sql('insert into t1 values(1, 10)')
-        if sys_var_name == 'tidb_read_staleness':
-            conn.exec_sql('do sleep(1.2)')
-        else:
-            conn.exec_sql('do sleep(0.1)')
-        conn.exec_sql('set @a=now(6)')
-        conn.exec_sql('do sleep(0.1)')
+        conn.exec_batch([
+            *(["set tx_isolation = 'READ-COMMITTED'"] if read_committed else []),
+            'set autocommit=1',
+            'drop table if exists t1',
+            'create table t1 (id int primary key, v int)',
+            'insert into t1 values(1, 10)',
+        ])
+        point = conn.as_of_point(staleness=1 if sys_var_name == 'tidb_read_staleness' else 0)
+        conn.exec_sql(f"set @a='{point}'")
         conn.exec_sql('update t1 set v=20 where id=1')
 
         # test one statement
@@ -5,6 +5,7 @@ import mysql.connector
 
 from arena.core.event_driven import *
 from arena.core.fork import *
+from arena.core.testkit import unique_name
 from arena.tidb.testkit import *
 
 
@@ -42,12 +43,13 @@ class StaleReadEnv:
 
 SYS_VAR_TX_READ_TS = 'tx_read_ts'
 SYS_VAR_TIDB_READ_STALENESS = 'tidb_read_staleness'
+MAX_ACTIONS = 10
 
 
 class StaleReadState(EventDrivenState):
     def __init__(self, *, db=None, table=None, conn: TidbConnection = None, ut: unittest.TestCase = None):
         self.db_name = db or 'test'
-        self.table_name = table or 'stale_t1'
+        self.table_name = table or unique_name('stale_t1')
 
         # key states
         self.env = None
@@ -68,6 +70,12 @@ class StaleReadState(EventDrivenState):
         self.current_data = None
         self.prepared_stmt = None
 
+    def __copy__(self):
+        # the key states are replaced rather than changed in place, and the offline states have no runtime states
+        state = self.__class__.__new__(self.__class__)
+        state.__dict__.update(self.__dict__)
+        return state
+
     def re_execute_online(self, *, conn, ut):
         state = StaleReadState(conn=conn, ut=ut)
         state.should_sleep_second_when_setup = self.should_sleep_second_when_setup
@@ -90,12 +98,17 @@ class StaleReadState(EventDrivenState):
             self.is_prepared_stale,
         )
 
+    def enablement_key(self):
+        return self.signature(), len(self.action_records) < MAX_ACTIONS
+
     def setup(self):
         if self.online:
-            self.conn.exec_sql(f'use {self.db_name}')
-            self.conn.exec_sql(f'drop table if exists {self.table_name}')
-            self.conn.exec_sql(f'create table if not exists {self.table_name} (id int primary key, v int)')
-            self.conn.exec_sql(f'insert into {self.table_name} values(1, 100)')
+            self.conn.exec_batch([
+                f'use {self.db_name}',
+                f'drop table if exists {self.table_name}',
+                f'create table if not exists {self.table_name} (id int primary key, v int)',
+                f'insert into {self.table_name} values(1, 100)',
+            ])
 
     def close(self):
         if self.online:
@@ -111,7 +124,7 @@ class StaleReadState(EventDrivenState):
 
     @cond
     def running(self):
-        return self.env and len(self.action_records) < 10
+        return self.env and len(self.action_records) < MAX_ACTIONS
 
     @cond
     def prepared(self):
@@ -127,27 +140,26 @@ class StaleReadState(EventDrivenState):
         if not self.online:
             return
 
-        self.conn.exec_sql(f'set @@autocommit={1 if env.autocommit else 0}')
-        self.conn.exec_sql(f"set @@tidb_txn_mode = '{'pessimistic' if env.txn_pessimistic else 'optimistic'}'")
-        if env.rc:
-            self.conn.exec_sql(f"set tx_isolation = 'READ-COMMITTED'")
+        self.conn.exec_batch([
+            f'set @@autocommit={1 if env.autocommit else 0}',
+            f"set @@tidb_txn_mode = '{'pessimistic' if env.txn_pessimistic else 'optimistic'}'",
+            *([f"set tx_isolation = 'READ-COMMITTED'"] if env.rc else []),
+        ])
 
         self.stale_point = {
             'data': [(1, 100)],
         }
 
-        self.conn.exec_sql('do sleep(0.1)')
+        # tidb_read_staleness=-1 reads one second before the statement, which must still be after the setup
+        ts = self.conn.as_of_point(staleness=1 if self.should_sleep_second_when_setup else 0)
         if env.use_variable:
-            self.conn.exec_sql(f'set @a=now(6)')
+            self.conn.exec_sql(f'set @a="{ts}"')
             as_of_time = '@a'
         else:
-            ts = self.conn.query('select now(6)').rows[0][0]
             as_of_time = f'"{ts}"'
 
         self.stale_point['ts'] = as_of_time
         self.stale_point['as_of'] = 'as of timestamp ' + as_of_time
-        if self.should_sleep_second_when_setup:
-            self.conn.exec_sql('do sleep(1.2)')
         self.conn.exec_sql(f'alter table {self.table_name} add column v2 int default 0')
         self.conn.exec_sql(f'update {self.table_name} set v=v+1 where id=1')
         self.conn.exec_sql('commit')
@@ -189,7 +201,7 @@ class StaleReadState(EventDrivenState):
         sql = self.build_sql(as_of)
         try:
             if binary:
-                self.prepared_stmt = self.conn.prepare(sql)
+                self.prepared_stmt = self.conn.prepare(sql, cached=False)
             else:
                 self.conn.exec_sql(f"prepare s from '{sql}'")
             self.ut.assertTrue(will_success, "query should fail")
@@ -334,5 +346,5 @@ class StaleReadTest(unittest.TestCase):
 
         cases = [case for i, case in enumerate(StaleReadState.run())if _filter_cases(i)]
         case: StaleReadState = yield tk.pick(FlatForker(cases))
-        conn = tk.connect(host='127.0.0.1', port=4001, user='root')
+        conn = tk.connect(host='127.0.0.1', port=4001, user='root', pooled=True)
         case.re_execute_online(conn=conn, ut=self)
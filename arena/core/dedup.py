@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import abc
+import hashlib
+import math
+import multiprocessing
+import sys
+
+__all__ = ['TransitionSet', 'ExactTransitionSet', 'FingerprintTable', 'SharedFingerprintTable', 'BloomFilter']
+
+_ATOMS = frozenset([type(None), bool, int, float, complex, str, bytes])
+
+
+def _encode(sig):
+    """
+    :return: a string equal for the equal signatures, which unlike `hash` tells -1 from -2 and 1 from 1.0 and True.
+             The objects of other types than the atoms, tuples and frozensets are encoded by their `hash`, their
+             `repr` may differ for equal objects.
+    """
+    t = type(sig)
+    if t in _ATOMS or t is tuple and _plain(sig):
+        return repr(sig)
+    if t is tuple:
+        return '(' + ','.join([_encode(v) for v in sig]) + ')'
+    if t is frozenset:
+        return '{' + ','.join(sorted([_encode(v) for v in sig])) + '}'
+    return f'{t.__module__}.{t.__qualname__}#{hash(sig)}'
+
+
+def _plain(sig):
+    """
+    :return: whether `sig` is made of atoms and tuples only, whose `repr` is already an exact encoding
+    """
+    for v in sig:
+        t = type(v)
+        if t not in _ATOMS and (t is not tuple or not _plain(v)):
+            return False
+    return True
+
+
+class TransitionSet(abc.ABC):
+    """
+    The transitions explored by `StateDriver`, i.e. the pairs of a state signature and an action name
+    """
+
+    @abc.abstractmethod
+    def add(self, sig, action_name):
+        """
+        :return: whether the transition is new, the sets that cannot tell return None
+        """
+
+    @abc.abstractmethod
+    def contains(self, sig, action_name) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def clear(self):
+        pass
+
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+    @abc.abstractmethod
+    def memory(self) -> int:
+        """
+        :return: the bytes held by the set
+        """
+
+    def intern(self, action_names):
+        """
+        Called by the driver with the names of all the actions before the exploration
+        """
+
+    def bytes_per_transition(self):
+        return self.memory() / len(self) if len(self) else 0.0
+
+    def report(self):
+        return f'{type(self).__name__}: {len(self)} transitions, {self.memory()} bytes, ' \
+               f'{self.bytes_per_transition():.1f} bytes per transition'
+
+
+class ExactTransitionSet(TransitionSet):
+    """
+    A `set` of `(signature, action name)`, exact but it holds the signatures
+    """
+
+    def __init__(self):
+        self._set = set()
+
+    def add(self, sig, action_name):
+        self._set.add((sig, action_name))
+
+    def contains(self, sig, action_name):
+        return (sig, action_name) in self._set
+
+    def clear(self):
+        self._set = set()
+
+    def __len__(self):
+        return len(self._set)
+
+    def memory(self):
+        # the action names are shared with the actions
+        return sys.getsizeof(self._set) + sum(sys.getsizeof(entry) + _deep_size(entry[0]) for entry in self._set)
+
+
+def _deep_size(obj):
+    if obj is None or isinstance(obj, bool):
+        return 0
+    if isinstance(obj, (tuple, list, frozenset)):
+        return sys.getsizeof(obj) + sum(_deep_size(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+class _Fingerprints(TransitionSet, abc.ABC):
+    """
+    Keeps a 64-bit fingerprint of every transition instead of the transition, a blake2b digest of the signature
+    encoded by `_encode` and the action name interned to a small int. The signatures made of None, bools, numbers,
+    strings, bytes, tuples and frozensets get uniformly distributed fingerprints, the other objects in a signature are
+    encoded by their `hash`, so two of them with the same hash make two transitions collide. The fingerprints only
+    compare in the same process and in the processes forked from it, which share the seed of the string hashes.
+    """
+
+    def __init__(self):
+        self._action_ids = {}
+
+    def intern(self, action_names):
+        # the processes that share the fingerprints must intern the names before they are forked
+        for name in action_names:
+            self._action_ids.setdefault(name, len(self._action_ids) + 1)
+
+    def fingerprint(self, sig, action_name):
+        action_id = self._action_ids.get(action_name)
+        if action_id is None:
+            action_id = self._action_ids.setdefault(action_name, len(self._action_ids) + 1)
+        digest = hashlib.blake2b(f'{action_id}:{_encode(sig)}'.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def add(self, sig, action_name):
+        return self.add_fingerprint(self.fingerprint(sig, action_name))
+
+    def contains(self, sig, action_name):
+        return self.contains_fingerprint(self.fingerprint(sig, action_name))
+
+    @abc.abstractmethod
+    def add_fingerprint(self, fp) -> bool:
+        """
+        :return: whether the fingerprint is new
+        """
+
+    @abc.abstractmethod
+    def contains_fingerprint(self, fp) -> bool:
+        pass
+
+
+class FingerprintTable(_Fingerprints):
+    """
+    An open-addressing hash table with linear probing over an array of 64-bit fingerprints, 8 bytes a slot, it doubles
+    when it is more than `max_load` full. Two transitions are taken as the same one when their fingerprints collide,
+    for a million transitions that happens with a chance of about 1 in 3.6e7 when their signatures only hold the types
+    encoded exactly, see `_Fingerprints`.
+    """
+
+    def __init__(self, *, capacity=1024, max_load=0.7):
+        super().__init__()
+        if not 0 < max_load < 1:
+            raise ValueError('max_load must be in (0, 1)')
+        self._max_load = max_load
+        self._count = 0
+        self._slots = self._new_slots(self._round_capacity(capacity))
+
+    def add_fingerprint(self, fp):
+        fp = fp or 1  # 0 marks an empty slot
+        if (self._count + 1) > len(self._slots) * self._max_load:
+            self._grow()
+        if self._insert(self._slots, fp):
+            self._count += 1
+            return True
+        return False
+
+    def contains_fingerprint(self, fp):
+        fp = fp or 1
+        slots = self._slots
+        mask = len(slots) - 1
+        i = fp & mask
+        while True:
+            slot = slots[i]
+            if slot == fp:
+                return True
+            if slot == 0:
+                return False
+            i = (i + 1) & mask
+
+    def clear(self):
+        self._count = 0
+        self._slots = self._new_slots(len(self._slots))
+
+    def __len__(self):
+        return self._count
+
+    def memory(self):
+        return self._slots.nbytes
+
+    @staticmethod
+    def _insert(slots, fp):
+        mask = len(slots) - 1
+        i = fp & mask
+        while True:
+            slot = slots[i]
+            if slot == fp:
+                return False
+            if slot == 0:
+                slots[i] = fp
+                return True
+            i = (i + 1) & mask
+
+    def _grow(self):
+        slots = self._new_slots(len(self._slots) * 2)
+        for fp in self._slots:
+            if fp:
+                self._insert(slots, fp)
+        self._slots = slots
+
+    @staticmethod
+    def _round_capacity(capacity):
+        return 1 << max(3, (capacity - 1).bit_length())
+
+    @staticmethod
+    def _new_slots(size):
+        return memoryview(bytearray(size * 8)).cast('Q')
+
+
+class SharedFingerprintTable(FingerprintTable):
+    """
+    A `FingerprintTable` in shared memory for the processes forked after it is created, `add` is atomic so only one of
+    the processes claims a transition. It cannot grow, adding past `max_load` of `capacity` raises a RuntimeError.
+    """
+
+    def __init__(self, *, capacity=1 << 22, max_load=0.7, ctx=None):
+        self._ctx = ctx or multiprocessing.get_context('fork')
+        self._lock = self._ctx.Lock()
+        self._shared_count = self._ctx.RawValue('q', 0)
+        super().__init__(capacity=capacity, max_load=max_load)
+
+    def add_fingerprint(self, fp):
+        fp = fp or 1
+        with self._lock:
+            if (self._shared_count.value + 1) > len(self._slots) * self._max_load:
+                raise RuntimeError(f'shared fingerprint table is full, {self._shared_count.value} transitions, '
+                                   f'create it with a larger capacity')
+            if self._insert(self._slots, fp):
+                self._shared_count.value += 1
+                return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._slots.cast('B')[:] = bytes(self._slots.nbytes)
+            self._shared_count.value = 0
+
+    def __len__(self):
+        return self._shared_count.value
+
+    def _new_slots(self, size):
+        return memoryview(self._ctx.RawArray('Q', size)).cast('B').cast('Q')
+
+
+class BloomFilter(_Fingerprints):
+    """
+    A Bloom filter of the fingerprints sized for `capacity` transitions at the false positive rate `error_rate`, with
+    the bit positions derived from the fingerprint by double hashing. A false positive makes the driver skip a
+    transition it has not explored, so the exploration is no longer exhaustive, in return it takes about
+    1.44 * log2(1 / error_rate) bits a transition, e.g. 1.8 bytes at 1e-3. Past `capacity` the rate goes up.
+    """
+
+    def __init__(self, *, capacity=1 << 20, error_rate=1e-3):
+        super().__init__()
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be in (0, 1)')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        bits = max(64, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._bits = bytearray((bits + 7) // 8)
+        self._size = len(self._bits) * 8
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._count = 0
+
+    def add_fingerprint(self, fp):
+        new = False
+        for pos in self._positions(fp):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self._bits[byte] & bit:
+                self._bits[byte] |= bit
+                new = True
+        if new:
+            self._count += 1
+        return new
+
+    def contains_fingerprint(self, fp):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fp))
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+        self._count = 0
+
+    def __len__(self):
+        """
+        :return: the transitions added that were not taken as present, it is lower than the transitions added by the
+                 false positives
+        """
+        return self._count
+
+    def memory(self):
+        return len(self._bits)
+
+    def _positions(self, fp):
+        h1 = fp & 0xffffffff
+        h2 = (fp >> 32) | 1
+        size = self._size
+        return [(h1 + i * h2) % size for i in range(self._hashes)]
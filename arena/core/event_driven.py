@@ -1,15 +1,26 @@
 from __future__ import annotations
 
 import collections
+import copy
+import heapq
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import traceback
 
 import typing
 
 import abc
 from dataclasses import dataclass
 
+from .dedup import *
 from .fork import *
 
-__all__ = ['EventDrivenState', 'cond', 'action', 'current_action_index']
+__all__ = ['EventDrivenState', 'cond', 'action', 'current_action_index', 'Budget', 'Strategy', 'DepthFirst',
+           'BreadthFirst', 'BestFirst', 'IterativeDeepening', 'ParallelSearch', 'TransitionSet', 'ExactTransitionSet', 'FingerprintTable',
+           'SharedFingerprintTable', 'BloomFilter']
 
 
 class _Cond:
@@ -191,19 +202,121 @@ def action(func=None, *, name=None, cond=None, args=None, generate=None):
     return _wrapper
 
 
+_UNSET = object()
+
+
+class EnablementIndex:
+    """
+    Tells the actions enabled in a state. The conditions of all the actions are compiled into one function, where every
+    atomic condition, e.g. a function decorated by `cond`, is evaluated at most once per state however many actions
+    share it, and `&`, `|` and `~` become Python's `and`, `or` and `not` over their values, short-circuiting in the same
+    order as `_Cond`. The enabled actions of a state are a bitmask over the actions, cached by
+    `EventDrivenState.enablement_key` when the state has one, so the states of a known key take a dict lookup.
+    """
+
+    def __init__(self, actions):
+        self._actions = list(actions)
+        self._atoms = []
+        self.atom_names = []
+        atom_ids = {}
+        exprs = [self._compile(act.cond, atom_ids) for act in self._actions]
+        lines = ['def enabled_mask(state, atoms, evaluate):', f'    v = [_UNSET] * {len(self._atoms)}', '    m = 0']
+        for i, expr in enumerate(exprs):
+            lines.append(f'    if {expr}:')
+            lines.append(f'        m |= {1 << i}')
+        lines.append('    return m')
+        namespace = {'_UNSET': _UNSET}
+        exec(compile('\n'.join(lines), '<enablement index>', 'exec'), namespace)
+        self._enabled_mask = namespace['enabled_mask']
+
+        self._masks = {}
+        self._enabled = {}
+        self.hits = 0
+        self.misses = 0
+
+    def enabled(self, state) -> typing.List[Action]:
+        """
+        :return: the actions enabled in `state`, in the order of the actions
+        """
+        key = state.enablement_key()
+        if key is None:
+            mask = self._enabled_mask(state, self._atoms, self._evaluate)
+        else:
+            mask = self._masks.get(key)
+            if mask is None:
+                self.misses += 1
+                mask = self._masks[key] = self._enabled_mask(state, self._atoms, self._evaluate)
+            else:
+                self.hits += 1
+
+        enabled = self._enabled.get(mask)
+        if enabled is None:
+            enabled = self._enabled[mask] = [act for i, act in enumerate(self._actions) if mask >> i & 1]
+        return enabled
+
+    def clear(self):
+        self._masks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._masks)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        return f'{type(self).__name__}: {len(self._atoms)} conditions, {len(self)} keys, {self.hits} hits, ' \
+               f'{self.misses} misses, {self.hit_rate():.1%} hit rate'
+
+    def _compile(self, cond, atom_ids):
+        if isinstance(cond, _Cond):
+            if cond._op == 'match' and not isinstance(cond._conditions[0], _Cond):
+                return self._atom(cond._conditions[0], cond._name, atom_ids)
+            exprs = [self._compile(c, atom_ids) for c in cond._conditions]
+            if cond._op == 'match':
+                return exprs[0]
+            if cond._op == 'not':
+                return f'not {exprs[0]}'
+            return '(' + f' {cond._op} '.join(exprs) + ')'
+        return self._atom(cond, None, atom_ids)
+
+    def _atom(self, func, name, atom_ids):
+        if not callable(func):
+            # `_Cond` takes a condition that is not callable as the truth of the state
+            func = bool
+        i = atom_ids.get(id(func))
+        if i is None:
+            i = atom_ids[id(func)] = len(self._atoms)
+            self._atoms.append(func)
+            self.atom_names.append(name or getattr(func, '__name__', repr(func)))
+        return f'(v[{i}] if v[{i}] is not _UNSET else evaluate(v, {i}, atoms, state))'
+
+    @staticmethod
+    def _evaluate(values, i, atoms, state):
+        value = values[i] = bool(atoms[i](state))
+        return value
+
+
 class EventDrivenStateMeta(abc.ABCMeta):
     def __new__(mcs, name, bases, attrs):
         new_attrs = attrs.copy()
         actions = collections.OrderedDict()
-        for name, attr in attrs.items():
+        for attr in attrs.values():
             acts = Action.get_attached(attr)
             if acts:
-                for name, act in acts.items():
-                    if name in actions:
-                        raise ValueError('duplicated action name: ' + name)
-                    actions[name] = act
-
-        mcs.ACTIONS: typing.Dict[Action] = actions
+                for act_name, act in acts.items():
+                    if act_name in actions:
+                        raise ValueError('duplicated action name: ' + act_name)
+                    actions[act_name] = act
+
+        # every class has its own actions, the ones of a subclass override the inherited ones of the same name
+        inherited = collections.OrderedDict()
+        for base in bases:
+            inherited.update(getattr(base, 'ACTIONS', {}))
+        inherited.update(actions)
+        new_attrs['ACTIONS'] = inherited
         return type.__new__(mcs, name, bases, new_attrs)
 
 
@@ -214,6 +327,14 @@ class EventDrivenState(metaclass=EventDrivenStateMeta):
         :return: the signature for the state to dedup
         """
 
+    def enablement_key(self):
+        """
+        :return: a key that decides which actions are enabled in the state, the driver evaluates the conditions once
+                 for every key, or None to evaluate them for every state. It is usually the signature, with what the
+                 conditions read beyond it, e.g. whether the number of the actions is below a limit.
+        """
+        return None
+
     def setup(self):
         pass
 
@@ -225,15 +346,310 @@ class EventDrivenState(metaclass=EventDrivenStateMeta):
         return getattr(self, '_action_records', [])
 
     @classmethod
-    def run(cls, *args, **kwargs):
-        yield from StateDriver(cls).run(*args, **kwargs)
+    def supports_copy(cls):
+        """
+        A state class can define `__copy__` to return an independent state equal to this one, the driver then copies
+        the state at every choice point and applies only the new action to the copy, instead of building every branch
+        from `cls(*args)` and `setup()` and replaying its earlier actions. The action records are copied by the driver.
+        """
+        return getattr(cls, '__copy__', None) is not None
+
+    @classmethod
+    def run(cls, *args, strategy: Strategy = None, budget: Budget = None, dedup: TransitionSet = None, **kwargs):
+        """
+        Explores the states from `cls(*args, **kwargs)` and yields the final ones, each with the actions that lead to
+        it in `action_records`
+
+        :param strategy: the order to explore the states in, `DepthFirst()` by default
+        :param budget: the limits of the exploration, unlimited by default
+        :param dedup: the set of the explored transitions, an `ExactTransitionSet` by default, a `FingerprintTable` for
+                      the models with millions of transitions or a `BloomFilter` when it need not be exhaustive.
+                      `ParallelSearch` only accepts a `SharedFingerprintTable` and creates one by default
+        """
+        yield from StateDriver(cls, dedup=dedup).run(*args, strategy=strategy, budget=budget, **kwargs)
+
+
+@dataclass
+class Budget:
+    """
+    The limits of an exploration. A state at `max_depth` actions is not explored further and is yielded as a final
+    state. Once `max_states` states are created no more are, the ones created but not explored yet are yielded as
+    final states.
+    """
+    max_depth: typing.Optional[int] = None
+    max_states: typing.Optional[int] = None
+
+
+class Strategy(abc.ABC):
+    """
+    The order `StateDriver` explores the states in. Every strategy explores a transition, i.e. an action enabled in a
+    state of some signature, only once, and yields the states that have no transition left to explore.
+    """
+
+    @abc.abstractmethod
+    def explore(self, driver: StateDriver, budget: Budget):
+        pass
+
+
+class DepthFirst(Strategy):
+    """
+    Explores the actions in the order of `ACTIONS` depth first, the states that do not support copying are driven by
+    `GeneratorForker` and replay their actions from a new state for every branch
+    """
+
+    def explore(self, driver: StateDriver, budget: Budget):
+        if driver.state_class.supports_copy():
+            for state, _ in driver.depth_first(budget, max_depth=budget.max_depth):
+                yield state
+            return
+
+        yield from driver.replay(budget)
+
+
+class BreadthFirst(Strategy):
+    """
+    Explores the states level by level, the final states come in the order of the number of their actions
+    """
+
+    def explore(self, driver: StateDriver, budget: Budget):
+        frontier = collections.deque([driver.new_state()])
+        while frontier:
+            state = frontier.popleft()
+            children = driver.expand(state, budget)
+            if not children:
+                yield state
+            frontier.extend(children)
+
+
+class BestFirst(Strategy):
+    """
+    Explores the state with the lowest score first, among the states of the same score the one created first
+
+    :param score: returns the score of a state, e.g. a distance to the states of interest
+    """
+
+    def __init__(self, score: typing.Callable[[EventDrivenState], typing.Any]):
+        self._score = score
+
+    def explore(self, driver: StateDriver, budget: Budget):
+        counter = itertools.count()
+        root = driver.new_state()
+        frontier = [(self._score(root), next(counter), root)]
+        while frontier:
+            _, _, state = heapq.heappop(frontier)
+            children = driver.expand(state, budget)
+            if not children:
+                yield state
+            for child in children:
+                heapq.heappush(frontier, (self._score(child), next(counter), child))
+
+
+class IterativeDeepening(Strategy):
+    """
+    Explores depth first with a depth limit growing by `step` until no state is cut by the limit or the limit reaches
+    `Budget.max_depth`. Every round starts with an empty dedup set. The states without an enabled action are yielded as
+    soon as a round finds them and come first, much like in `BreadthFirst`, while only one branch is held at a time.
+    The other final states are only final because the rest of the round explored their transitions, a deeper round
+    may explore them from there instead, so they are held back until the last round ends. A final state is not yielded
+    when a state with the same actions or with more actions after them was yielded before.
+    """
+
+    def __init__(self, *, step=1):
+        if step < 1:
+            raise ValueError('step must be a positive integer')
+        self._step = step
+
+    def explore(self, driver: StateDriver, budget: Budget):
+        # the traces of the yielded states and all their prefixes
+        yielded = set()
+        limit = 0
+        while True:
+            limit += self._step
+            last = budget.max_depth is not None and limit >= budget.max_depth
+            if last:
+                limit = budget.max_depth
+
+            driver.reset_dedup()
+            cut = False
+            held = []
+            for state, truncated in driver.depth_first(budget, max_depth=limit):
+                if truncated and not last and not driver.exhausted(budget):
+                    cut = True
+                    continue
+
+                if driver.enabled_actions(state):
+                    held.append(state)
+                else:
+                    yield from self._yield_new(state, yielded)
+
+            if last or not cut or driver.exhausted(budget):
+                for state in held:
+                    yield from self._yield_new(state, yielded)
+                return
+
+    @staticmethod
+    def _yield_new(state, yielded):
+        trace = tuple(act.name for act in state.action_records)
+        if trace not in yielded:
+            yielded.update(trace[:i] for i in range(len(trace) + 1))
+            yield state
+
+
+class ParallelSearch(Strategy):
+    """
+    Explores with `workers` processes forked from the driver, they share a `SharedFingerprintTable` of the explored
+    transitions, the one given to the driver as `dedup` or a new one. A task is the trace of a state, i.e. the names of
+    its actions, the worker that takes it rebuilds the state and explores below it depth first, claiming the
+    transitions of a state one at a time like `DepthFirst`, and hands the shallowest states on its stack back as new
+    tasks while other workers are idle. The final states come back in batches, as their traces with their pickled attributes, the
+    ones that cannot be pickled are rebuilt from the trace.
+
+    Every transition is explored once as in the other strategies, but which state claims it, and so the final states
+    and their order, depend on the timing of the workers. The speedup comes from the actions and the conditions being
+    run in parallel, it pays off when they take much longer than passing a task between processes.
+    """
+
+    def __init__(self, workers=None, *, capacity=1 << 22, batch=64):
+        """
+        :param capacity: the slots of the shared table, it cannot grow
+        :param batch: the final states sent back to the driver at a time
+        """
+        self._workers = workers or os.cpu_count() or 1
+        self._capacity = capacity
+        self._batch = batch
+
+    def explore(self, driver: StateDriver, budget: Budget):
+        ctx = multiprocessing.get_context('fork')
+        if not isinstance(driver.dedup, SharedFingerprintTable):
+            if driver.dedup_given:
+                raise ValueError(f'the workers cannot share a {type(driver.dedup).__name__}, '
+                                 f'give a SharedFingerprintTable as dedup')
+            driver.dedup = SharedFingerprintTable(capacity=self._capacity, ctx=ctx)
+            driver.dedup.intern(driver.state_class.ACTIONS.keys())
+
+        tasks = ctx.Queue()
+        results = ctx.Queue()
+        outstanding = ctx.Value('q', 1)
+        idle = ctx.Value('q', 0)
+        states = ctx.Value('q', 1)
+        tasks.put(((), True))
+        processes = [
+            ctx.Process(target=self._work, args=(driver, budget, tasks, results, outstanding, idle, states),
+                        daemon=True)
+            for _ in range(self._workers)
+        ]
+        for p in processes:
+            p.start()
+
+        try:
+            exited = 0
+            stopping = False
+            while exited < len(processes):
+                if not stopping and outstanding.value == 0:
+                    stopping = True
+                    for _ in processes:
+                        tasks.put(None)
+
+                try:
+                    kind, payload = results.get(timeout=0.05)
+                except queue.Empty:
+                    if any(p.exitcode not in (None, 0) for p in processes):
+                        raise RuntimeError('a worker of the parallel search exited unexpectedly')
+                    continue
+
+                if kind == 'leaves':
+                    for trace, attrs in payload:
+                        yield driver.restore_state(trace, attrs)
+                elif kind == 'error':
+                    raise payload
+                else:
+                    exited += 1
+        finally:
+            for p in processes:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+            driver.states = states.value
+
+    def _work(self, driver: StateDriver, budget: Budget, tasks, results, outstanding, idle, states):
+        try:
+            while True:
+                with idle.get_lock():
+                    idle.value += 1
+                task = tasks.get()
+                with idle.get_lock():
+                    idle.value -= 1
+                if task is None:
+                    break
+
+                self._explore_task(driver, budget, task, tasks, results, outstanding, idle, states)
+                with outstanding.get_lock():
+                    outstanding.value -= 1
+        except BaseException as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+            results.put(('error', e))
+        finally:
+            results.put(('exit', None))
+            results.close()
+            results.join_thread()
+
+    def _explore_task(self, driver: StateDriver, budget: Budget, task, tasks, results, outstanding, idle, states):
+        trace, empty = task
+        state, sig, actions, _ = driver._expand_lazily(driver.state_from_trace(trace), budget.max_depth)
+        # a state handed over keeps whether it has claimed a transition, it is not a final state then
+        stack = [(state, sig, actions, empty)]
+        leaves = []
+        while stack:
+            spare = min(idle.value, len(stack) - 1)
+            if spare > 0:
+                with outstanding.get_lock():
+                    outstanding.value += spare
+                for state, _, _, empty in stack[:spare]:
+                    tasks.put((tuple(act.name for act in state.action_records), empty))
+                del stack[:spare]
+
+            state, sig, actions, empty = stack[-1]
+            next_action = None
+            if actions is not None:
+                for act in actions:
+                    if budget.max_states is not None and states.value >= budget.max_states:
+                        break
+                    # the transitions are claimed one at a time, the ones left stay open to the other workers
+                    if driver.dedup.add(sig, act.name):
+                        next_action = act
+                        break
+
+            if next_action is None:
+                stack.pop()
+                if empty:
+                    leaves.append(driver.leaf_payload(state))
+                    if len(leaves) >= self._batch:
+                        results.put(('leaves', leaves))
+                        leaves = []
+                continue
+
+            with states.get_lock():
+                states.value += 1
+            stack[-1] = (state, sig, actions, False)
+            stack.append(driver._expand_lazily(driver.child(state, next_action), budget.max_depth))
+
+        if leaves:
+            results.put(('leaves', leaves))
 
 
 class StateDriver:
     class _DedupForker(Forker):
-        def __init__(self, driver: StateDriver, state):
+        def __init__(self, driver: StateDriver, state, budget: Budget):
+            self._driver = driver
+            self._budget = budget
             self._dedup = driver._dedup
-            self._actions = [act for act in driver._actions if act.cond(state)]
+            if budget.max_depth is not None and len(state.action_records) >= budget.max_depth:
+                self._actions = []
+            else:
+                self._actions = driver.enabled_actions(state)
             self._state_sig = state.signature()
 
         def do_fork(self, context: ForkContext) -> ForkResult[Action]:
@@ -242,38 +658,201 @@ class StateDriver:
         def _generator(self):
             empty = True
             for act in self._actions:
-                sig = (self._state_sig, act.name)
-                if sig not in self._dedup:
+                if self._driver.exhausted(self._budget):
+                    break
+
+                if not self._dedup.contains(self._state_sig, act.name):
                     empty = False
                     yield act
 
             if empty:
                 yield None
 
-    def __init__(self, cls):
-        self._dedup = set()
+    def __init__(self, cls, *, dedup: TransitionSet = None):
+        self._dedup = ExactTransitionSet() if dedup is None else dedup
+        self._dedup_given = dedup is not None
+        self._dedup.intern(cls.ACTIONS.keys())
         self._actions = cls.ACTIONS.values()
+        self._enablement = EnablementIndex(self._actions)
         self._cls = cls
+        self._args = ()
+        self._kwargs = {}
+        self.states = 0
 
-    def run(self, *args, **kwargs):
-        forker = GeneratorForker(self._run, args=args, kwargs=kwargs)
+    @property
+    def state_class(self):
+        return self._cls
+
+    @property
+    def dedup(self) -> TransitionSet:
+        return self._dedup
+
+    @dedup.setter
+    def dedup(self, dedup: TransitionSet):
+        self._dedup = dedup
+        self._dedup_given = True
+
+    @property
+    def dedup_given(self):
+        """
+        Whether `dedup` was given to the driver rather than created by it
+        """
+        return self._dedup_given
+
+    @property
+    def actions(self) -> typing.List[Action]:
+        return list(self._actions)
+
+    @property
+    def enablement(self) -> EnablementIndex:
+        return self._enablement
+
+    def enabled_actions(self, state) -> typing.List[Action]:
+        return self._enablement.enabled(state)
+
+    def run(self, *args, strategy: Strategy = None, budget: Budget = None, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        yield from (strategy or DepthFirst()).explore(self, budget or Budget())
+
+    def new_state(self):
+        state = self._cls(*self._args, **self._kwargs)
+        state.setup()
+        self.states += 1
+        return state
+
+    def exhausted(self, budget: Budget):
+        return budget.max_states is not None and self.states >= budget.max_states
+
+    def reset_dedup(self):
+        self._dedup.clear()
+
+    def expand(self, state, budget: Budget):
+        """
+        :return: the states of the transitions of `state` not explored yet, empty when `state` is a final state
+        """
+        if budget.max_depth is not None and len(state.action_records) >= budget.max_depth:
+            return []
+
+        sig = state.signature()
+        children = []
+        for act in self.enabled_actions(state):
+            if self.exhausted(budget):
+                break
+            if not self._dedup.contains(sig, act.name):
+                self._dedup.add(sig, act.name)
+                children.append(self.child(state, act))
+        return children
+
+    def depth_first(self, budget: Budget, *, max_depth=None):
+        """
+        Explores the same branches in the same order as `replay`, depth first with the actions of a state checked
+        against the dedup set only when the branches before them are explored
+
+        :return: the final states, each with whether it is cut by `max_depth` while it has actions left to explore
+        """
+        stack = [self._expand_lazily(self.new_state(), max_depth)]
+        while stack:
+            state, sig, actions, empty = stack[-1]
+            next_action = None
+            if actions is not None and not self.exhausted(budget):
+                next_action = next((act for act in actions if not self._dedup.contains(sig, act.name)), None)
+
+            if next_action is None:
+                stack.pop()
+                if empty:
+                    truncated = actions is None and any(
+                        not self._dedup.contains(sig, act.name) for act in self.enabled_actions(state))
+                    yield state, truncated
+                continue
+
+            stack[-1] = (state, sig, actions, False)
+            self._dedup.add(sig, next_action.name)
+            stack.append(self._expand_lazily(self.child(state, next_action), max_depth))
+
+    def replay(self, budget: Budget):
+        # every branch builds its states again, the states count the root and a new one for every transition
+        self.states = 1
+        forker = GeneratorForker(self._run, args=(budget,))
         for finalState in forker:
             yield finalState
 
-    def _pick(self, state):
-        next_action = yield self._DedupForker(self, state)
+    def _expand_lazily(self, state, max_depth):
+        if max_depth is not None and len(state.action_records) >= max_depth:
+            # None for the actions cut by the depth limit
+            return state, state.signature(), None, True
+        return state, state.signature(), iter(self.enabled_actions(state)), True
+
+    def state_from_trace(self, trace):
+        """
+        :return: a new state with the actions of the names in `trace` applied
+        """
+        state = self.new_state()
+        for i, name in enumerate(trace):
+            act = self._cls.ACTIONS[name]
+            self._record_action(state, act)
+            act(state, index=i)
+        return state
+
+    @staticmethod
+    def leaf_payload(state):
+        """
+        :return: the trace of `state` and its attributes pickled, or None when they cannot be pickled
+        """
+        trace = tuple(act.name for act in state.action_records)
+        attrs = {k: v for k, v in state.__dict__.items() if k != '_action_records'}
+        try:
+            return trace, pickle.dumps(attrs)
+        except Exception:
+            return trace, None
+
+    def restore_state(self, trace, attrs):
+        """
+        Builds the state of a `leaf_payload` again
+        """
+        if attrs is None:
+            return self.state_from_trace(trace)
+
+        state = self._cls.__new__(self._cls)
+        state.__dict__.update(pickle.loads(attrs))
+        setattr(state, '_action_records', [self._cls.ACTIONS[name] for name in trace])
+        return state
+
+    def child(self, state, act):
+        """
+        :return: a new state with the actions of `state` and then `act` applied, a copy of `state` when it supports it
+        """
+        if self._cls.supports_copy():
+            child = copy.copy(state)
+            setattr(child, '_action_records', list(state.action_records))
+            self.states += 1
+        else:
+            child = self.new_state()
+            for i, record in enumerate(state.action_records):
+                self._record_action(child, record)
+                record(child, index=i)
+
+        self._record_action(child, act)
+        act(child, index=len(child.action_records) - 1)
+        return child
+
+    def _pick(self, state, budget):
+        next_action = yield self._DedupForker(self, state, budget)
         return next_action
 
-    def _run(self, *args, **kwargs):
-        state = self._cls(*args, **kwargs)
+    def _run(self, budget):
+        state = self._cls(*self._args, **self._kwargs)
         state.setup()
         while True:
-            next_action = yield from self._pick(state)
+            next_action = yield from self._pick(state, budget)
             if next_action is None:
                 return state
 
-            sig = (state.signature(), next_action.name)
-            self._dedup.add(sig)
+            sig = state.signature()
+            if not self._dedup.contains(sig, next_action.name):
+                # the actions replayed for the branch are in the set already
+                self._dedup.add(sig, next_action.name)
+                self.states += 1
             self._record_action(state, next_action)
             next_action(state, index=len(state.action_records) - 1)
 
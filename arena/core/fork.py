@@ -1,19 +1,26 @@
 from __future__ import annotations
 
 import inspect
+import os
+import pickle
+import sys
 import threading
-from collections import Iterator, Iterable
+import traceback
+from collections import Iterator, Iterable, Sequence
 from dataclasses import dataclass
 
 import abc
+import asyncio
+import collections
 import itertools
-from typing import TypeVar, Generic, Dict, Callable
+import random
+from typing import TypeVar, Generic, Dict, Callable, Optional
 
 from arena.core.reflect import BUILTIN_OPS
 
 T = TypeVar('T')
 
-__all__ = ['ForkContext', 'ForkItem', 'ForkResult', 'Forker', 'TransformForker', 'FlatForker', 'SingleValueForker',
+__all__ = ['ForkContext', 'ForkItem', 'ForkResult', 'ForkSize', 'Forker', 'TransformForker', 'FlatForker', 'SingleValueForker',
            'RangeForker',
            'ConcatForker',
            'ContainerForker',
@@ -22,29 +29,179 @@ __all__ = ['ForkContext', 'ForkItem', 'ForkResult', 'Forker', 'TransformForker',
            'ContextRecordForker',
            'ChainForker',
            'IfConditionForker',
-           'GeneratorForker']
+           'SliceForker',
+           'ShardForker',
+           'SampleForker',
+           'CachedForker',
+           'GeneratorForker',
+           'AsyncGeneratorExplorer']
+
+
+_TRIE_BITS = 5
+_TRIE_MASK = (1 << _TRIE_BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+# a node is a tuple of 32 slots, each None, an entry, a collision or a child node
+_EMPTY_NODE = (None,) * (1 << _TRIE_BITS)
+
+
+class _Entry:
+    __slots__ = ('hash', 'key', 'value', 'seq')
+
+    def __init__(self, h, key, value, seq):
+        self.hash = h
+        self.key = key
+        self.value = value
+        # the order of the first set of the key, for `ForkContext.vars` to keep the order of a dict
+        self.seq = seq
+
+
+class _Collision:
+    """
+    The entries of the keys with the same 64-bit hash
+    """
+    __slots__ = ('hash', 'entries')
+
+    def __init__(self, h, entries):
+        self.hash = h
+        self.entries = entries
+
+
+def _hash(key):
+    return hash(key) & _HASH_MASK
+
+
+def _trie_get(node, h, key):
+    shift = 0
+    while True:
+        slot = node[(h >> shift) & _TRIE_MASK]
+        if slot is None:
+            return None
+        if isinstance(slot, tuple):
+            node = slot
+            shift += _TRIE_BITS
+            continue
+        if slot.hash != h:
+            return None
+        if isinstance(slot, _Entry):
+            return slot if slot.key == key else None
+        return next((e for e in slot.entries if e.key == key), None)
+
+
+def _trie_set(node, shift, h, key, value, seq):
+    """
+    :return: the node with `key` set, sharing the unchanged slots with `node`, and whether `key` is new
+    """
+    i = (h >> shift) & _TRIE_MASK
+    slot = node[i]
+    added = True
+    if slot is None:
+        slot = _Entry(h, key, value, seq)
+    elif isinstance(slot, tuple):
+        slot, added = _trie_set(slot, shift + _TRIE_BITS, h, key, value, seq)
+    elif slot.hash != h:
+        slot = _trie_split(shift + _TRIE_BITS, slot, _Entry(h, key, value, seq))
+    elif isinstance(slot, _Entry):
+        if slot.key == key:
+            slot, added = _Entry(h, key, value, slot.seq), False
+        else:
+            slot = _Collision(h, (slot, _Entry(h, key, value, seq)))
+    else:
+        entries = slot.entries
+        for j, e in enumerate(entries):
+            if e.key == key:
+                slot, added = _Collision(h, entries[:j] + (_Entry(h, key, value, e.seq),) + entries[j + 1:]), False
+                break
+        else:
+            slot = _Collision(h, entries + (_Entry(h, key, value, seq),))
+    return node[:i] + (slot,) + node[i + 1:], added
+
+
+def _trie_split(shift, a, b):
+    # the hashes of `a` and `b` differ in some of the bits from `shift`
+    slots = list(_EMPTY_NODE)
+    i, j = (a.hash >> shift) & _TRIE_MASK, (b.hash >> shift) & _TRIE_MASK
+    if i == j:
+        slots[i] = _trie_split(shift + _TRIE_BITS, a, b)
+    else:
+        slots[i], slots[j] = a, b
+    return tuple(slots)
+
+
+def _trie_entries(node):
+    for slot in node:
+        if slot is None:
+            continue
+        if isinstance(slot, tuple):
+            yield from _trie_entries(slot)
+        elif isinstance(slot, _Entry):
+            yield slot
+        else:
+            yield from slot.entries
 
 
 class ForkContext:
+    """
+    An immutable set of variables. Up to `_MAX_DICT` variables are held in a dict that `set_var` copies, which is the
+    fastest for the few variables of most cases. Beyond that they are held in a persistent hash trie of 32-way nodes,
+    `set_var` copies only the O(log n) nodes on the path to the variable and shares the others with the parent context,
+    and `get_var` walks that path. `vars` of a trie builds the dict once for the context.
+
+    The small contexts copy their dict on purpose, even though a copy is O(n): copying a dict of 32 variables takes
+    about 0.6us against 1.6us for a path of the trie, and the copy only gets slower than the trie at about 300
+    variables, see `benchmarks/bench_fork_context.py`.
+    """
+    _MAX_DICT = 256
+
+    __slots__ = ('_vars', '_trie', '_size')
+
     def __init__(self, *, variables: Dict = None):
         self._vars = variables.copy() if variables else {}
+        self._trie = None
+        self._size = len(self._vars)
+
+    @classmethod
+    def _new(cls, variables, trie, size) -> ForkContext:
+        context = cls.__new__(cls)
+        context._vars = variables
+        context._trie = trie
+        context._size = size
+        return context
 
     @property
     def vars(self):
+        if self._vars is None:
+            entries = sorted(_trie_entries(self._trie), key=lambda e: e.seq)
+            self._vars = {e.key: e.value for e in entries}
         return self._vars
 
     def set_var(self, name, value) -> ForkContext:
-        new_vars = self._vars.copy()
-        new_vars[name] = value
-        return ForkContext(variables=new_vars)
+        if self._trie is None:
+            if self._size < self._MAX_DICT or name in self._vars:
+                new_vars = self._vars.copy()
+                new_vars[name] = value
+                return self._new(new_vars, None, len(new_vars))
+
+            trie = _EMPTY_NODE
+            for seq, (k, v) in enumerate(self._vars.items()):
+                trie, _ = _trie_set(trie, 0, _hash(k), k, v, seq)
+        else:
+            trie = self._trie
+
+        trie, added = _trie_set(trie, 0, _hash(name), name, value, self._size)
+        return self._new(None, trie, self._size + added)
 
     def get_var(self, name: str, *, default=None):
-        if name in self._vars:
-            return self._vars[name]
-        return default
+        if self._trie is None:
+            if name in self._vars:
+                return self._vars[name]
+            return default
+        entry = _trie_get(self._trie, _hash(name), name)
+        return default if entry is None else entry.value
 
     def has_var(self, name: str):
-        return name in self._vars
+        if self._trie is None:
+            return name in self._vars
+        return _trie_get(self._trie, _hash(name), name) is not None
 
     def new_item(self, value: T) -> ForkItem[T]:
         return ForkItem.new(self, value)
@@ -138,6 +295,49 @@ class ForkResult(Generic[T], Iterator[ForkItem[T]]):
         ))
 
 
+@dataclass(frozen=True)
+class ForkSize:
+    """
+    The bounds of the number of items a forker produces, `upper` is None when it is unbounded or unknown.
+    """
+    lower: int
+    upper: Optional[int]
+
+    @classmethod
+    def exact(cls, n) -> ForkSize:
+        return cls(n, n)
+
+    @classmethod
+    def unknown(cls) -> ForkSize:
+        return cls(0, None)
+
+    @property
+    def is_exact(self):
+        return self.lower == self.upper
+
+    def filtered(self) -> ForkSize:
+        return ForkSize(0, self.upper)
+
+    def at_least_one(self) -> ForkSize:
+        return ForkSize(max(1, self.lower), None if self.upper is None else max(1, self.upper))
+
+    def union(self, other: ForkSize) -> ForkSize:
+        upper = None if self.upper is None or other.upper is None else max(self.upper, other.upper)
+        return ForkSize(min(self.lower, other.lower), upper)
+
+    def __add__(self, other: ForkSize) -> ForkSize:
+        upper = None if self.upper is None or other.upper is None else self.upper + other.upper
+        return ForkSize(self.lower + other.lower, upper)
+
+    def __mul__(self, other: ForkSize) -> ForkSize:
+        if self.upper == 0 or other.upper == 0:
+            return ForkSize.exact(0)
+        upper = None if self.upper is None or other.upper is None else self.upper * other.upper
+        return ForkSize(self.lower * other.lower, upper)
+
+
+_END = object()
+
 _RECORD_INDEX = 0
 _LOCK = threading.Lock()
 
@@ -155,6 +355,10 @@ def decorate_forker(cls):
     return cls
 
 
+def _same_size(size: ForkSize) -> ForkSize:
+    return size
+
+
 @decorate_forker
 class Forker(abc.ABC, Generic[T], Iterable[T]):
     @abc.abstractmethod
@@ -165,21 +369,100 @@ class Forker(abc.ABC, Generic[T], Iterable[T]):
         it = self.do_fork(context=ForkContext())
         return map(lambda item: item.value, it)
 
+    def estimate(self) -> ForkSize:
+        """
+        :return: the bounds of the number of items `do_fork` produces, computed without enumerating them
+        """
+        return ForkSize.unknown()
+
+    def count(self) -> int:
+        size = self.estimate()
+        if not size.is_exact:
+            raise ValueError(f'cannot count {self} exactly, estimated: [{size.lower}, {size.upper}]')
+        return size.lower
+
+    def nth(self, index: int) -> T:
+        return self.nth_item(ForkContext(), index).value
+
+    def nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        """
+        :return: the item at `index` of `do_fork(context)`, decoded directly instead of enumerating the items before
+                 it. Only forkers with an exact `count()` whose children are independent support it, others raise
+                 ValueError.
+        """
+        count = self.count()
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(f'fork index out of range: {index}')
+        return self._nth_item(context, index)
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        raise ValueError(f'{self} does not support random access')
+
+    def supports_nth(self) -> bool:
+        """
+        :return: whether `nth_item` decodes every index, decided from the structure of the forker and its children
+                 without decoding any item. The forkers overriding `_nth_item` override it too.
+        """
+        return False
+
+    def _random_access_count(self, context: ForkContext) -> Optional[int]:
+        """
+        :return: the count if the forker supports random access, otherwise None
+        """
+        if not self.supports_nth():
+            return None
+        size = self.estimate()
+        return size.lower if size.is_exact else None
+
+    def sample(self, n: int, *, seed=None) -> Forker[T]:
+        """
+        :return: a forker producing n items drawn uniformly without replacement, the same seed draws the same items
+        """
+        return SampleForker(self, n, seed=seed)
+
+    def cached(self, *, maxsize=128) -> Forker[T]:
+        """
+        :return: a forker replaying the items recorded the last time the context variables this forker read had the
+                 same values, only for forkers whose items depend on nothing but those variables
+        """
+        return CachedForker(self, maxsize=maxsize)
+
+    def shard(self, index: int, total: int) -> Forker[T]:
+        """
+        :return: a forker producing the index-th of `total` disjoint and balanced parts of the items, the parts of all
+                 the indexes cover all the items and are the same on every machine
+        """
+        return ShardForker(self, index, total)
+
+    def slice(self, start: int, stop: int = None) -> Forker[T]:
+        """
+        :return: a forker producing the items in [start, stop) by random access, `forker[a:b]` is not used for this
+                 because `__getitem__` is forwarded to the values
+        """
+        return SliceForker(self, start, stop)
+
     def concat(self, forker) -> Forker[T]:
         if isinstance(self, ConcatForker):
             return self.add_forker(forker)
         return ConcatForker((self, forker))
 
-    def transform_result(self, func) -> Forker[T]:
+    def transform_result(self, func, *, estimate=None, stage=None) -> Forker[T]:
+        """
+        :param estimate: maps the `ForkSize` of the input to the `ForkSize` of the output, unknown if not given
+        :param stage: (kind, item_func) when `func` is element-wise, kind is one of `TransformForker.STAGE_KINDS`.
+                      Consecutive element-wise stages are fused into one loop instead of nesting an iterator per stage
+        """
         if isinstance(self, TransformForker):
-            return self.add_func(func)
-        return TransformForker(self, [func])
+            return self.add_func(func, estimate=estimate, stage=stage)
+        return TransformForker(self, [func], estimates=[estimate], stages=[stage])
 
     def map(self, func):
-        return self.transform_result(lambda r: r.map(func))
+        return self.transform_result(lambda r: r.map(func), estimate=_same_size, stage=('map', func))
 
     def map_value(self, func):
-        return self.transform_result(lambda r: r.map_value(func))
+        return self.transform_result(lambda r: r.map_value(func), estimate=_same_size, stage=('map_value', func))
 
     def flat_map(self, func):
         return self.transform_result(lambda r: r.flat_map(func))
@@ -188,13 +471,17 @@ class Forker(abc.ABC, Generic[T], Iterable[T]):
         return self.transform_result(lambda r: r.flat_map_value(func))
 
     def foreach(self, func):
-        return self.transform_result(lambda r: r.foreach(func))
+        return self.transform_result(lambda r: r.foreach(func), estimate=_same_size, stage=('foreach', func))
 
     def filter(self, func):
-        return self.transform_result(lambda r: r.filter(func))
+        return self.transform_result(lambda r: r.filter(func), estimate=ForkSize.filtered, stage=('filter', func))
 
     def filter_value(self, func):
-        return self.transform_result(lambda r: r.filter_value(func))
+        return self.transform_result(
+            lambda r: r.filter_value(func),
+            estimate=ForkSize.filtered,
+            stage=('filter_value', func)
+        )
 
     def record(self, *, key=None, key_prefix=None):
         if key is None:
@@ -238,23 +525,129 @@ class Forker(abc.ABC, Generic[T], Iterable[T]):
 class ContainerForker(Forker):
     _NONE = object()
 
-    def __init__(self, obj):
+    def __init__(self, obj, *, strength=None, include=None):
+        """
+        :param strength: when set, only a t-wise covering array of the members is produced instead of their full
+                         product, every combination of the values of any `strength` members still appears in a result
+        :param include: combinations forced into the covering array, each is a dict from the keys (or the indexes for
+                        a tuple or list) to the forked values, the members not in it are filled to cover more
+        """
         if not isinstance(obj, (tuple, list, dict)):
             raise ValueError('obj must be a type with tuple, list or dict')
+        if strength is not None and strength < 1:
+            raise ValueError('strength must be positive')
+        if include and strength is None:
+            raise ValueError('include can only be used with strength')
+
         self._obj = obj
+        self._strength = strength
+        self._include = list(include or [])
+        self._forker = None
+        self._member_forkers = None
+        self._rows = None
+        self._items = None
 
     def do_fork(self, context: ForkContext) -> ForkResult:
         if not self._obj:
             return context.new_fork_result([self._obj])
+        if self._strength is not None:
+            return ForkResult(map(lambda row: self._covering_item(context, row), self._covering_rows(context)))
+        return self._get_forker().do_fork(context)
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem:
+        if not self._obj:
+            return context.new_item(self._obj)
+        if self._strength is not None:
+            return self._covering_item(context, self._covering_rows(context)[index])
+        return self._get_forker().nth_item(context, index)
+
+    def supports_nth(self) -> bool:
+        if not self._obj or self._strength is not None:
+            return True
+        return self._get_forker().supports_nth()
+
+    def _members(self):
+        if self._member_forkers is None:
+            if isinstance(self._obj, dict):
+                self._member_forkers = [self._dict_item_forker(k, v) for k, v in self._obj.items()]
+            else:
+                self._member_forkers = [v if isinstance(v, Forker) else SingleValueForker(v) for v in self._obj]
+            self._items = [None] * len(self._member_forkers)
+        return self._member_forkers
+
+    def _member_items(self, pos, context: ForkContext):
+        """
+        :return: the items of the member at `pos` forked with `context`. Only the items of the last context are kept,
+                 which is the same for every row unless the members before set variables.
+        """
+        members = self._members()
+        cached = self._items[pos]
+        if cached is None or cached[0] is not context:
+            cached = self._items[pos] = (context, list(members[pos].do_fork(context)))
+        return cached[1]
+
+    def _covering_rows(self, context: ForkContext):
+        """
+        :return: the rows of the covering array, built once since the values of the members are the same in any
+                 context
+        """
+        if self._rows is None:
+            self._rows = self._build_covering_rows(context)
+        return self._rows
+
+    def _build_covering_rows(self, context: ForkContext):
+        values = [[item.value for item in self._member_items(pos, context)] for pos in range(len(self._members()))]
+        if not isinstance(self._obj, dict) and not all(values):
+            raise ValueError('empty')
+
+        include = []
+        for combination in self._include:
+            row = {}
+            for key, value in combination.items():
+                pos = list(self._obj.keys()).index(key) if isinstance(self._obj, dict) else key
+                expected = (key, value) if isinstance(self._obj, dict) else value
+                if expected not in values[pos]:
+                    raise ValueError(f'value {value} of {key} in include is not forked')
+                row[pos] = values[pos].index(expected)
+            include.append(row)
+
+        return _covering_array([len(v) for v in values], self._strength, include)
+
+    def _covering_item(self, context: ForkContext, row) -> ForkItem:
+        values = []
+        for pos, index in enumerate(row):
+            item = self._member_items(pos, context)[index]
+            values.append(item.value)
+            context = item.context
 
         if isinstance(self._obj, dict):
-            return self._fork_dict(context, self._obj)
-        return self._fork_tuple_or_list(context, self._obj)
+            return context.new_item({k: v for k, v in values if v != self._NONE})
+        return context.new_item(tuple(values) if isinstance(self._obj, tuple) else values)
+
+    def _get_forker(self) -> Forker:
+        if self._forker is None:
+            if isinstance(self._obj, dict):
+                self._forker = self._dict_forker(self._obj)
+            else:
+                self._forker = self._tuple_or_list_forker(self._obj)
+        return self._forker
+
+    def estimate(self) -> ForkSize:
+        if self._obj and self._strength is not None:
+            return ForkSize.exact(len(self._covering_rows(ForkContext())))
+
+        size = ForkSize.exact(1)
+        values = self._obj.values() if isinstance(self._obj, dict) else self._obj
+        for v in values:
+            if isinstance(v, Forker):
+                v_size = v.estimate()
+                size *= v_size.at_least_one() if isinstance(self._obj, dict) else v_size
+        return size
 
     @classmethod
-    def _fork_dict(cls, context: ForkContext, obj) -> ForkResult:
+    def _dict_forker(cls, obj) -> Forker:
         forkers = [cls._dict_item_forker(k, v) for k, v in obj.items()]
-        return cls._fork_tuple_or_list(context, forkers).map_value(lambda l: {k: v for k, v in l if v != cls._NONE})
+        return cls._tuple_or_list_forker(forkers).map_value(lambda l: {k: v for k, v in l if v != cls._NONE})
 
     @classmethod
     def _dict_item_forker(cls, k, v) -> Forker:
@@ -264,7 +657,7 @@ class ContainerForker(Forker):
             return SingleValueForker((k, v))
 
     @classmethod
-    def _fork_tuple_or_list(cls, context: ForkContext, obj) -> ForkResult:
+    def _tuple_or_list_forker(cls, obj) -> Forker:
         def _check(item):
             if item.value == cls._NONE:
                 raise ValueError('empty')
@@ -273,8 +666,68 @@ class ContainerForker(Forker):
         seed = ChainForker([v if isinstance(v, Forker) else SingleValueForker(v) for v in obj])
         return DefaultValueForker(ReactionForker(seed), default=cls._NONE) \
             .foreach(_check) \
-            .map_value(lambda v: tuple(v) if is_tuple else list(v)) \
-            .do_fork(context)
+            .map_value(lambda v: tuple(v) if is_tuple else list(v))
+
+
+def _covering_array(sizes, strength, include=()):
+    """
+    Builds a t-wise covering array greedily: each new row starts from the first uncovered combination (or a forced
+    one) and fills the other columns with the value covering the most uncovered combinations.
+
+    :param sizes: the number of values of each column
+    :param include: rows forced into the array, each is a dict from the column to the value index
+    :return: the rows as lists of value indexes
+    """
+    columns = [i for i, size in enumerate(sizes) if size > 1]
+    t = min(strength, len(columns))
+    uncovered = set()
+    for combination in itertools.combinations(columns, t):
+        for values in itertools.product(*[range(sizes[c]) for c in combination]):
+            uncovered.add((combination, values))
+
+    combinations_of = {c: [comb for comb in itertools.combinations(columns, t) if c in comb] for c in columns}
+
+    def _cover(row):
+        for combination in itertools.combinations(columns, t):
+            uncovered.discard((combination, tuple(row[c] for c in combination)))
+
+    def _fill(row):
+        for c in columns:
+            if row[c] is not None:
+                continue
+
+            best, best_covered = 0, -1
+            for v in range(sizes[c]):
+                row[c] = v
+                covered = 0
+                for combination in combinations_of[c]:
+                    if all(row[other] is not None for other in combination):
+                        if (combination, tuple(row[other] for other in combination)) in uncovered:
+                            covered += 1
+                if covered > best_covered:
+                    best, best_covered = v, covered
+            row[c] = best
+        return row
+
+    rows = []
+    for forced in include:
+        row = [None if size > 1 else 0 for size in sizes]
+        for c, v in forced.items():
+            row[c] = v
+        rows.append(_fill(row))
+        _cover(row)
+
+    while uncovered:
+        combination, values = min(uncovered)
+        row = [None if size > 1 else 0 for size in sizes]
+        for c, v in zip(combination, values):
+            row[c] = v
+        rows.append(_fill(row))
+        _cover(row)
+
+    if not rows:
+        rows.append([0] * len(sizes))
+    return rows
 
 
 class ContextRecordForker(Forker[T]):
@@ -288,22 +741,123 @@ class ContextRecordForker(Forker[T]):
     def do_fork(self, context: ForkContext) -> ForkResult[T]:
         return context.new_fork_result([context.get_var(self._key)])
 
+    def estimate(self) -> ForkSize:
+        return ForkSize.exact(1)
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        return context.new_item(context.get_var(self._key))
+
+    def supports_nth(self) -> bool:
+        return True
+
 
 class TransformForker(Forker[T]):
-    def __init__(self, forker, funcs, *, name=None):
+    STAGE_KINDS = ('map', 'map_value', 'foreach', 'filter', 'filter_value')
+
+    def __init__(self, forker, funcs, *, name=None, estimates=None, stages=None):
         self._forker = forker
         self._funcs = tuple(funcs)
+        self._estimates = tuple(estimates) if estimates is not None else (None,) * len(self._funcs)
+        self._stages = tuple(stages) if stages is not None else (None,) * len(self._funcs)
         self._name = name
+        self._pipeline = None
 
-    def add_func(self, func):
-        return TransformForker(self._forker, self._funcs + (func,), name=self._name)
+    def add_func(self, func, *, estimate=None, stage=None):
+        return TransformForker(
+            self._forker,
+            self._funcs + (func,),
+            name=self._name,
+            estimates=self._estimates + (estimate,),
+            stages=self._stages + (stage,),
+        )
 
     def do_fork(self, context: ForkContext) -> ForkResult[T]:
-        result = self._forker.do_fork(context=context)
-        for func in self._funcs:
+        return self._apply(self._forker.do_fork(context=context))
+
+    def _apply(self, result: ForkResult[T]) -> ForkResult[T]:
+        if self._pipeline is None:
+            self._pipeline = self._compile()
+
+        for func in self._pipeline:
             result = func(result)
         return result
 
+    def _compile(self):
+        """
+        :return: the funcs to apply in order, each run of element-wise stages is replaced by one generated loop
+        """
+        pipeline = []
+        run = []
+        for func, stage in zip(self._funcs, self._stages):
+            if stage is not None and stage[0] in self.STAGE_KINDS:
+                run.append(stage)
+                continue
+
+            if run:
+                pipeline.append(self._fuse(run))
+                run = []
+            pipeline.append(func)
+
+        if run:
+            pipeline.append(self._fuse(run))
+        return pipeline
+
+    @classmethod
+    def _fuse(cls, stages):
+        """
+        Generates one loop for the stages. The value is kept in a local and a new `ForkItem` is only built when a
+        stage needs the item or at the end, so consecutive value stages do not allocate intermediate items.
+        """
+        namespace = {'_new_item': ForkItem}
+        lines = ['def _fused(items):', '    for item in items:', '        value = item.value']
+        stale = False
+        for i, (kind, func) in enumerate(stages):
+            name = f'_f{i}'
+            namespace[name] = func
+            if kind == 'map_value':
+                lines.append(f'        value = {name}(value)')
+                stale = True
+                continue
+            if kind == 'filter_value':
+                lines.append(f'        if not {name}(value):')
+                lines.append('            continue')
+                continue
+
+            if stale:
+                lines.append('        item = _new_item(item.context, value)')
+                stale = False
+            if kind == 'map':
+                lines.append(f'        item = {name}(item)')
+                lines.append('        value = item.value')
+            elif kind == 'foreach':
+                lines.append(f'        {name}(item)')
+            else:
+                lines.append(f'        if not {name}(item):')
+                lines.append('            continue')
+
+        if stale:
+            lines.append('        item = _new_item(item.context, value)')
+        lines.append('        yield item')
+        exec(compile('\n'.join(lines), '<fused transform>', 'exec'), namespace)
+
+        fused = namespace['_fused']
+        return lambda result: ForkResult(fused(result))
+
+    def estimate(self) -> ForkSize:
+        size = self._forker.estimate()
+        for estimate in self._estimates:
+            size = estimate(size) if estimate else ForkSize.unknown()
+        return size
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        if any(estimate is not _same_size for estimate in self._estimates):
+            raise ValueError(f'{self} does not support random access, only element-wise transforms do')
+
+        return next(self._apply(ForkResult([self._forker.nth_item(context, index)])))
+
+    def supports_nth(self) -> bool:
+        return all(estimate is _same_size for estimate in self._estimates) and self._forker.supports_nth()
+
     def __str__(self):
         return self._name or f'Transform({self._forker})'
 
@@ -316,6 +870,20 @@ class FlatForker(Forker[T]):
     def do_fork(self, context: ForkContext) -> ForkResult[T]:
         return context.new_fork_result(self._values)
 
+    def estimate(self) -> ForkSize:
+        try:
+            return ForkSize.exact(len(self._values))
+        except TypeError:
+            return ForkSize.unknown()
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        if not isinstance(self._values, Sequence):
+            raise ValueError(f'{self} does not support random access, values are not a sequence')
+        return context.new_item(self._values[index])
+
+    def supports_nth(self) -> bool:
+        return isinstance(self._values, Sequence)
+
     def __str__(self):
         return self._name or f'FlatForker({str(self._values)})'
 
@@ -353,6 +921,17 @@ class DefaultValueForker(Forker[T]):
 
         return ForkResult(_generator())
 
+    def estimate(self) -> ForkSize:
+        return self._forker.estimate().at_least_one()
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        if self._forker.count() == 0:
+            return context.new_item(self._default)
+        return self._forker.nth_item(context, index)
+
+    def supports_nth(self) -> bool:
+        return self._forker.supports_nth()
+
 
 class ConcatForker(Forker[T]):
     def __init__(self, forkers=None, *, name=None):
@@ -366,6 +945,23 @@ class ConcatForker(Forker[T]):
     def add_forker(self, forker):
         return ConcatForker(tuple(self._forkers) + (forker,), name=self._name)
 
+    def estimate(self) -> ForkSize:
+        size = ForkSize.exact(0)
+        for forker in self._forkers:
+            size += forker.estimate()
+        return size
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        for forker in self._forkers:
+            count = forker.count()
+            if index < count:
+                return forker.nth_item(context, index)
+            index -= count
+        raise IndexError(f'fork index out of range: {index}')
+
+    def supports_nth(self) -> bool:
+        return all(forker.supports_nth() for forker in self._forkers)
+
     def __str__(self):
         return self._name or f'ConcatForker({", ".join([str(forker) for forker in self._forkers])})'
 
@@ -374,6 +970,7 @@ class ReactionForker(Forker[T]):
     def __init__(self, seed: Forker, *, name=None, stop: Callable[[ForkItem], bool] = None):
         self._seed = seed
         self._name = name
+        self._has_stop = stop is not None
         self._stop = stop or (lambda _: False)
 
     def do_fork(self, context: ForkContext) -> ForkResult[T]:
@@ -381,14 +978,44 @@ class ReactionForker(Forker[T]):
         return ForkResult(items)
 
     def _generate(self, context: ForkContext):
-        for item in self._seed.do_fork(context):
+        """
+        Expands the items depth-first with an explicit stack of iterators instead of nesting a generator per level.
+        Without a stop predicate a `ChainForker` is enumerated by `ChainForker.iter_reaction`, which never builds the
+        intermediate chains.
+        """
+        stack = [self._expand(self._seed, context)]
+        while stack:
+            item = next(stack[-1], _END)
+            if item is _END:
+                stack.pop()
+                continue
+
             if self._stop(item) or not isinstance(item.value, Forker):
                 yield item
                 continue
 
-            next_forker = ReactionForker(item.value, stop=self._stop)
-            for new_item in next_forker.do_fork(item.context):
-                yield new_item
+            stack.append(self._expand(item.value, item.context))
+
+    def _expand(self, forker: Forker, context: ForkContext):
+        if not self._has_stop and isinstance(forker, ChainForker):
+            return forker.iter_reaction(context)
+        return iter(forker.do_fork(context))
+
+    def estimate(self) -> ForkSize:
+        if isinstance(self._seed, ChainForker) and not self._has_stop:
+            return self._seed.estimate_reaction()
+
+        if self._seed.estimate().upper == 0:
+            return ForkSize.exact(0)
+        return ForkSize.unknown()
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        if not isinstance(self._seed, ChainForker) or self._has_stop:
+            raise ValueError(f'{self} does not support random access, only a reaction of ChainForker does')
+        return self._seed.nth_reaction_item(context, index)
+
+    def supports_nth(self) -> bool:
+        return isinstance(self._seed, ChainForker) and not self._has_stop and self._seed.supports_nth_reaction()
 
     def __str__(self):
         return self._name or f'{self.__class__.__name__}#{id(self)}'
@@ -404,10 +1031,7 @@ class ChainForker(Forker):
         if not self._forkers:
             return context.new_fork_result([self._state])
 
-        forker = self._forkers[0]
-        if callable(forker) and not isinstance(forker, Forker):
-            forker = forker(self._state)
-
+        forker = self._child_forker(self._forkers[0], self._state)
         next_forkers = self._forkers[1:]
 
         def _map_to_forker(value):
@@ -420,6 +1044,86 @@ class ChainForker(Forker):
 
         return forker.do_fork(context).map_value(_map_to_forker)
 
+    def iter_reaction(self, context: ForkContext):
+        """
+        Enumerates the final states of `self.reaction()` with an explicit stack of (depth, state, iterator), so the
+        overhead per leaf does not grow with the number of children and deep chains do not hit the recursion limit.
+        """
+        forkers = self._forkers
+        if not forkers:
+            yield context.new_item(self._state)
+            return
+
+        last = len(forkers) - 1
+        stack = [(0, self._state, iter(self._child_forker(forkers[0], self._state).do_fork(context)))]
+        while stack:
+            depth, state, items = stack[-1]
+            item = next(items, _END)
+            if item is _END:
+                stack.pop()
+                continue
+
+            next_state = self._reduce(state, item.value)
+            if depth == last:
+                yield item.context.new_item(next_state)
+                continue
+
+            forker = self._child_forker(forkers[depth + 1], next_state)
+            stack.append((depth + 1, next_state, iter(forker.do_fork(item.context))))
+
+    @staticmethod
+    def _child_forker(forker, state) -> Forker:
+        if callable(forker) and not isinstance(forker, Forker):
+            return forker(state)
+        return forker
+
+    def estimate(self) -> ForkSize:
+        if not self._forkers:
+            return ForkSize.exact(1)
+        return self._estimate_child(self._forkers[0])
+
+    def estimate_reaction(self) -> ForkSize:
+        """
+        :return: the size of `self.reaction()`, it is exact when all the children are forkers with exact sizes, while
+                 a callable child depends on the values before it, so its size is unknown
+        """
+        size = ForkSize.exact(1)
+        for forker in self._forkers:
+            size *= self._estimate_child(forker)
+        return size
+
+    def nth_reaction_item(self, context: ForkContext, index: int) -> ForkItem:
+        """
+        :return: the item at `index` of `self.reaction()`, the children form a product so the index is decoded to one
+                 index per child by mixed-radix arithmetic
+        """
+        for forker in self._forkers:
+            if callable(forker) and not isinstance(forker, Forker):
+                raise ValueError(f'{self} does not support random access, it has callable children')
+
+        counts = [forker.count() for forker in self._forkers]
+        indexes = []
+        for count in reversed(counts):
+            index, child_index = divmod(index, count)
+            indexes.append(child_index)
+        indexes.reverse()
+
+        state = self._state
+        for forker, child_index in zip(self._forkers, indexes):
+            item = forker.nth_item(context, child_index)
+            state = self._reduce(state, item.value)
+            context = item.context
+        return context.new_item(state)
+
+    def supports_nth_reaction(self) -> bool:
+        return all(isinstance(forker, Forker) and forker.supports_nth() for forker in self._forkers)
+
+    @staticmethod
+    def _estimate_child(forker) -> ForkSize:
+        if callable(forker) and not isinstance(forker, Forker):
+            return ForkSize.unknown()
+        return forker.estimate()
+
     def reaction(self, **kwargs):
         return ReactionForker(seed=self, **kwargs)
 
@@ -488,16 +1192,315 @@ class IfConditionForker(Forker[T]):
 
         return self._cond.do_fork(context).flat_map(_flat_map)
 
+    def estimate(self) -> ForkSize:
+        if not isinstance(self._cond, Forker):
+            return (self._then if self._cond else self._else_then).estimate()
+        return self._cond.estimate() * self._then.estimate().union(self._else_then.estimate())
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        if isinstance(self._cond, Forker):
+            raise ValueError(f'{self} does not support random access, the condition is a forker')
+        return (self._then if self._cond else self._else_then).nth_item(context, index)
+
+    def supports_nth(self) -> bool:
+        return not isinstance(self._cond, Forker) and (self._then if self._cond else self._else_then).supports_nth()
+
     @classmethod
     def builder(cls):
         return cls._Builder()
 
 
+class SliceForker(Forker[T]):
+    def __init__(self, forker: Forker[T], start: int, stop: int = None):
+        self._forker = forker
+        self._start = start
+        self._stop = stop
+
+    def do_fork(self, context: ForkContext) -> ForkResult[T]:
+        forker = self._forker
+        return ForkResult(map(lambda i: forker.nth_item(context, i), self._range()))
+
+    def estimate(self) -> ForkSize:
+        return ForkSize.exact(len(self._range()))
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        return self._forker.nth_item(context, self._range()[index])
+
+    def supports_nth(self) -> bool:
+        return self._forker.supports_nth()
+
+    def _range(self):
+        return range(self._forker.count())[self._start:self._stop]
+
+    def __str__(self):
+        return f'{self._forker}[{self._start}:{"" if self._stop is None else self._stop}]'
+
+
+_READ_ALL = object()
+
+
+class _ReadTrackingContext(ForkContext):
+    """
+    Records the names of the variables read through it or any context derived from it by `set_var`, and the variables
+    set since it wraps the context.
+    """
+    __slots__ = ('_reads', '_log')
+
+    @classmethod
+    def wrap(cls, context: ForkContext, reads: set) -> _ReadTrackingContext:
+        tracking = cls._new(context._vars, context._trie, context._size)
+        tracking._reads = reads
+        tracking._log = None
+        return tracking
+
+    def set_var(self, name, value) -> ForkContext:
+        context = super().set_var(name, value)
+        context._reads = self._reads
+        context._log = (name, value, self._log)
+        return context
+
+    def get_var(self, name: str, *, default=None):
+        self._reads.add(name)
+        return super().get_var(name, default=default)
+
+    def has_var(self, name: str):
+        self._reads.add(name)
+        return super().has_var(name)
+
+    @property
+    def vars(self):
+        self._reads.add(_READ_ALL)
+        return super().vars
+
+    def delta(self):
+        """
+        :return: the variables set since the wrapped context, in the order they are set
+        """
+        delta = []
+        log = self._log
+        while log is not None:
+            delta.append((log[0], log[1]))
+            log = log[2]
+        delta.reverse()
+        return delta
+
+
+class CachedForker(Forker[T]):
+    """
+    Caches the items of a forker in a LRU keyed by the variables it read and their values. Each item is stored with
+    the variables it set on top of the input context, so a replay rebuilds its context from any input context with
+    the same values of those variables.
+    """
+
+    def __init__(self, forker: Forker[T], *, maxsize=128):
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self._forker = forker
+        self._maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self._read_sets = []
+        self.hits = 0
+        self.misses = 0
+
+    def do_fork(self, context: ForkContext) -> ForkResult[T]:
+        entry = self._lookup(context)
+        if entry is None:
+            self.misses += 1
+            entry = self._record(context)
+        else:
+            self.hits += 1
+        return ForkResult(map(lambda e: self._replay(context, e), entry))
+
+    def estimate(self) -> ForkSize:
+        return self._forker.estimate()
+
+    def _nth_item(self, context: ForkContext, index: int) -> ForkItem[T]:
+        return self._forker.nth_item(context, index)
+
+    def supports_nth(self) -> bool:
+        return self._forker.supports_nth()
+
+    def _lookup(self, context: ForkContext):
+        for names in self._read_sets:
+            key = self._key(context, names)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _record(self, context: ForkContext):
+        reads = set()
+        tracking = _ReadTrackingContext.wrap(context, reads)
+        entry = [self._delta(tracking, item) for item in self._forker.do_fork(tracking)]
+
+        if _READ_ALL in reads:
+            return entry
+
+        names = tuple(sorted(reads, key=repr))
+        key = self._key(context, names)
+        try:
+            hash(key)
+        except TypeError:
+            return entry
+
+        if names not in self._read_sets:
+            self._read_sets.append(names)
+        self._cache[key] = entry
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _key(context: ForkContext, names):
+        return names, tuple(context.get_var(name, default=_END) for name in names)
+
+    @staticmethod
+    def _delta(tracking: _ReadTrackingContext, item: ForkItem):
+        out = item.context
+        if not isinstance(out, _ReadTrackingContext) or out._reads is not tracking._reads:
+            return out, None, item.value
+        return None, out.delta(), item.value
+
+    @staticmethod
+    def _replay(context: ForkContext, entry):
+        out, delta, value = entry
+        if out is None:
+            out = context
+            for name, v in delta:
+                out = out.set_var(name, v)
+        return out.new_item(value)
+
+    def __str__(self):
+        return f'Cached({self._forker})'
+
+
+class ShardForker(Forker[T]):
+    """
+    Takes a contiguous range of the items when the forker supports random access, so no item out of the shard is
+    enumerated, otherwise it enumerates all the items and takes every `total`-th of them.
+    """
+
+    def __init__(self, forker: Forker[T], index: int, total: int):
+        _Shard.check(index, total)
+        self._forker = forker
+        self._index = index
+        self._total = total
+
+    def do_fork(self, context: ForkContext) -> ForkResult[T]:
+        count = self._forker._random_access_count(context)
+        if count is None:
+            items = self._forker.do_fork(context)
+            return ForkResult(item for i, item in enumerate(items) if i % self._total == self._index)
+
+        start, stop = self._index * count // self._total, (self._index + 1) * count // self._total
+        return self._forker.slice(start, stop).do_fork(context)
+
+    def estimate(self) -> ForkSize:
+        size = self._forker.estimate()
+        if size.is_exact:
+            count = size.lower
+            return ForkSize.exact((self._index + 1) * count // self._total - self._index * count // self._total)
+        return size.filtered()
+
+    def __str__(self):
+        return f'{self._forker}#shard({self._index}/{self._total})'
+
+
+class SampleForker(Forker[T]):
+    """
+    Draws the indexes directly when the forker supports random access, otherwise it enumerates all the items with
+    reservoir sampling. The sampled items keep their original order.
+    """
+
+    def __init__(self, forker: Forker[T], n: int, *, seed=None):
+        if n < 0:
+            raise ValueError(f'invalid sample size: {n}')
+        self._forker = forker
+        self._n = n
+        self._seed = seed
+
+    def do_fork(self, context: ForkContext) -> ForkResult[T]:
+        rng = random.Random(self._seed)
+        count = self._forker._random_access_count(context)
+        if count is None:
+            return ForkResult(self._reservoir(context, rng))
+
+        indexes = sorted(rng.sample(range(count), min(self._n, count)))
+        forker = self._forker
+        return ForkResult(map(lambda i: forker.nth_item(context, i), indexes))
+
+    def _reservoir(self, context: ForkContext, rng: random.Random):
+        reservoir = []
+        for i, item in enumerate(self._forker.do_fork(context)):
+            if i < self._n:
+                reservoir.append((i, item))
+                continue
+
+            j = rng.randint(0, i)
+            if j < self._n:
+                reservoir[j] = (i, item)
+
+        reservoir.sort(key=lambda e: e[0])
+        return (item for _, item in reservoir)
+
+    def estimate(self) -> ForkSize:
+        size = self._forker.estimate()
+        upper = self._n if size.upper is None else min(self._n, size.upper)
+        return ForkSize(min(self._n, size.lower), upper)
+
+    def __str__(self):
+        return f'{self._forker}#sample({self._n})'
+
+
+class _Shard:
+    """
+    Shards the leaves of a generator tree. Each path keeps its position as an index in the product of the fan-outs
+    of the yields on it, once that product reaches `total` the path is assigned to a shard in balanced contiguous
+    blocks, so the yield where it happens is the only level enumerated by all the shards. A leaf reached before that
+    is assigned by its position too.
+    """
+    ROOT = (0, 1, False)
+
+    def __init__(self, index: int, total: int):
+        self.check(index, total)
+        self.index = index
+        self.total = total
+
+    @staticmethod
+    def check(index: int, total: int):
+        if total <= 0 or not 0 <= index < total:
+            raise ValueError(f'invalid shard: {index}/{total}')
+
+    def split(self, pos, forker: Forker, context: ForkContext):
+        prefix, radix, decided = pos
+        items = forker.do_fork(context)
+        if decided:
+            yield from ((item, pos) for item in items)
+            return
+
+        size = forker.estimate()
+        if not size.is_exact:
+            items = list(items)
+        n = size.lower if size.is_exact else len(items)
+        for j, item in enumerate(items):
+            index, sub_radix = prefix * n + j, radix * n
+            if sub_radix < self.total:
+                yield item, (index, sub_radix, False)
+            elif index * self.total // sub_radix == self.index:
+                yield item, (index, sub_radix, True)
+
+    def accept_leaf(self, pos):
+        prefix, radix, decided = pos
+        return decided or prefix * self.total // radix == self.index
+
+
 class GeneratorForker(Forker):
     class _State(Forker):
-        def __init__(self, func):
+        def __init__(self, func, *, shard: _Shard = None, shard_pos=_Shard.ROOT):
             self._func = func
             self._values = []
+            self._shard = shard
+            self._shard_pos = shard_pos
 
             self._generator = None
             self._next_value_forker = None
@@ -511,25 +1514,37 @@ class GeneratorForker(Forker):
                 try:
                     value_forker: Forker = self._replay()
                 except StopIteration as e:
-                    yield context.new_item(e.value)
+                    if self._accept_leaf(self._shard_pos):
+                        yield context.new_item(e.value)
                     return
 
             values = self._values.copy()
-            for i, item in enumerate(value_forker.do_fork(context)):
+            if self._shard:
+                items = self._shard.split(self._shard_pos, value_forker, context)
+            else:
+                items = ((item, None) for item in value_forker.do_fork(context))
+
+            for i, (item, pos) in enumerate(items):
                 if i == 0:
                     self._values.append(item.value)
+                    self._shard_pos = pos
                     try:
                         self._next_value_forker = self._generator.send(item.value)
                         next_value = self
                     except StopIteration as e:
+                        if not self._accept_leaf(pos):
+                            continue
                         next_value = e.value
                 else:
-                    next_value = self.__class__(self._func)
+                    next_value = self.__class__(self._func, shard=self._shard, shard_pos=pos)
                     next_value._values.extend(values)
                     next_value._values.append(item.value)
 
                 yield item.context.new_item(next_value)
 
+        def _accept_leaf(self, pos):
+            return self._shard is None or self._shard.accept_leaf(pos)
+
         def _replay(self):
             self._generator = self._func()
             next_forker = next(self._generator)
@@ -537,15 +1552,224 @@ class GeneratorForker(Forker):
                 next_forker = self._generator.send(v)
             return next_forker
 
-    def __init__(self, func, *, args=None, kwargs=None):
+    class _ForkFailure:
+        def __init__(self, error):
+            self.error = error
+
+        @classmethod
+        def of(cls, error):
+            try:
+                pickle.dumps(error)
+            except Exception:
+                error = RuntimeError(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+            return cls(error)
+
+    class _ForkExplorer(Forker):
+        """
+        Explores the generator without replay. At every `yield` the process forks once for each value except the last
+        one, the child sends its value to the generator and goes on exploring while the parent waits and relays the
+        leaves the child writes back through a pipe. The parent itself takes the last value, so the code before a
+        `yield` runs exactly once per tree node. The leaves must be picklable.
+        """
+
+        def __init__(self, func, *, shard: _Shard = None):
+            self._func = func
+            self._shard = shard
+
+        def do_fork(self, context: ForkContext) -> ForkResult:
+            return ForkResult(self._explore_root(context))
+
+        def _explore_root(self, context: ForkContext):
+            generator = self._func()
+            try:
+                forker = next(generator)
+            except StopIteration as e:
+                if self._accept_leaf(_Shard.ROOT):
+                    yield context.new_item(e.value)
+                return
+
+            yield from self._explore(generator, forker, context, _Shard.ROOT)
+
+        def _explore(self, generator, forker, context, pos):
+            while True:
+                if self._shard:
+                    items = self._shard.split(pos, forker, context)
+                else:
+                    items = ((item, None) for item in forker.do_fork(context))
+
+                branch = next(items, None)
+                if branch is None:
+                    return
+
+                for next_branch in items:
+                    yield from self._fork_branch(generator, branch)
+                    branch = next_branch
+
+                item, pos = branch
+                try:
+                    forker = generator.send(item.value)
+                except StopIteration as e:
+                    if self._accept_leaf(pos):
+                        yield item.context.new_item(e.value)
+                    return
+                context = item.context
+
+        def _accept_leaf(self, pos):
+            return self._shard is None or self._shard.accept_leaf(pos)
+
+        def _fork_branch(self, generator, branch):
+            r, w = os.pipe()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                self._run_child(generator, branch, w)
+
+            os.close(w)
+            try:
+                with os.fdopen(r, 'rb') as reader:
+                    while True:
+                        try:
+                            leaf = pickle.load(reader)
+                        except EOFError:
+                            break
+
+                        if isinstance(leaf, GeneratorForker._ForkFailure):
+                            raise leaf.error
+                        yield leaf
+            finally:
+                os.waitpid(pid, 0)
+
+        def _run_child(self, generator, branch, w):
+            code = 0
+            try:
+                with os.fdopen(w, 'wb') as writer:
+                    try:
+                        item, pos = branch
+                        try:
+                            forker = generator.send(item.value)
+                            leaves = self._explore(generator, forker, item.context, pos)
+                        except StopIteration as e:
+                            leaves = [item.context.new_item(e.value)] if self._accept_leaf(pos) else []
+
+                        for leaf in leaves:
+                            pickle.dump(leaf, writer)
+                            writer.flush()
+                    except Exception as e:
+                        pickle.dump(GeneratorForker._ForkFailure.of(e), writer)
+            except BaseException:
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+    class _Sampler(Forker):
+        """
+        Samples the leaves of the generator by random walks from the root, each walk runs the generator once and
+        never enters a subtree whose leaves are all sampled, so no leaf is produced twice. The leaves of the generator
+        cannot be counted without running it, so a leaf is drawn uniformly only when the tree is balanced, otherwise
+        the leaves in the smaller subtrees are more likely to be drawn.
+        """
+
+        class _Node:
+            def __init__(self, size):
+                self.size = size
+                self.children = {}
+                self.exhausted = set()
+
+        def __init__(self, func, n: int, *, seed=None):
+            if n < 0:
+                raise ValueError(f'invalid sample size: {n}')
+            self._func = func
+            self._n = n
+            self._seed = seed
+
+        def do_fork(self, context: ForkContext) -> ForkResult:
+            return ForkResult(self._sample(context))
+
+        def _sample(self, context: ForkContext):
+            rng = random.Random(self._seed)
+            root = self._Node(1)
+            sampled = 0
+            while sampled < self._n and not root.exhausted:
+                leaf = self._walk(root, context, rng)
+                if leaf is not None:
+                    sampled += 1
+                    yield leaf
+
+        def _walk(self, root, context: ForkContext, rng: random.Random):
+            path = [(root, 0)]
+            node = root.children.setdefault(0, self._Node(1))
+            generator = self._func()
+            try:
+                forker = next(generator)
+                while True:
+                    items = list(forker.do_fork(context))
+                    node.size = len(items)
+                    candidates = [j for j in range(node.size) if j not in node.exhausted]
+                    if not candidates:
+                        self._exhaust(path)
+                        return None
+
+                    j = rng.choice(candidates)
+                    path.append((node, j))
+                    node = node.children.setdefault(j, self._Node(1))
+                    item = items[j]
+                    context = item.context
+                    forker = generator.send(item.value)
+            except StopIteration as e:
+                self._exhaust(path)
+                return context.new_item(e.value)
+
+        @staticmethod
+        def _exhaust(path):
+            for node, j in reversed(path):
+                node.exhausted.add(j)
+                if len(node.exhausted) < node.size:
+                    break
+
+    MODES = ('replay', 'fork')
+
+    def __init__(self, func, *, args=None, kwargs=None, mode='replay', shard=None):
+        if mode not in self.MODES:
+            raise ValueError('invalid mode: ' + str(mode))
+
         self._func = func
         self._args = args
         self._kwargs = kwargs
+        self._mode = mode
+        self._shard = _Shard(*shard) if shard else None
 
     def do_fork(self, context: ForkContext) -> ForkResult:
-        state = self._State(self._create_generator_func())
+        if self._mode == 'fork' and self.fork_supported():
+            explorer = self._ForkExplorer(self._create_generator_func(), shard=self._shard)
+            return ReactionForker(explorer).do_fork(context)
+
+        state = self._State(self._create_generator_func(), shard=self._shard)
         return ReactionForker(state).do_fork(context)
 
+    def sample(self, n: int, *, seed=None) -> Forker:
+        """
+        Samples by random walks instead of enumerating all the leaves, see `_Sampler`.
+        """
+        return self._Sampler(self._create_generator_func(), n, seed=seed)
+
+    def shard(self, index: int, total: int) -> Forker:
+        """
+        Splits at the yields instead of enumerating all the leaves, see `_Shard`.
+        """
+        return GeneratorForker(self._func, args=self._args, kwargs=self._kwargs, mode=self._mode, shard=(index, total))
+
+    @staticmethod
+    def fork_supported():
+        """
+        :return: whether 'fork' mode can be used, forking is not available on all platforms and is unsafe once the
+                 process has started other threads, 'replay' mode is used instead in those cases
+        """
+        return hasattr(os, 'fork') and threading.active_count() == 1
+
     def _create_generator_func(self):
         def _func():
             forked_func = self._func if not isinstance(self._func, Forker) else (yield self._func)
@@ -566,3 +1790,93 @@ class GeneratorForker(Forker):
             return result
 
         return _func
+
+
+class AsyncGeneratorExplorer:
+    """
+    Explores an async generator like `GeneratorForker` does in 'replay' mode, except that the branches run as
+    concurrent tasks of the running event loop. At every `yield` of a `Forker` the current task goes on with the first
+    value and a new task replays the generator from the start for each of the others. Async generators cannot return
+    a value, so a branch ends with the first value it yields that is not a `Forker`, or None when the generator
+    finishes. The leaves are produced in the order the branches end.
+    """
+
+    def __init__(self, func, *, concurrency=None):
+        """
+        :param func: returns a new async generator every time it is called
+        :param concurrency: the maximum number of branches running at the same time, unbounded when None
+        """
+        if concurrency is not None and concurrency < 1:
+            raise ValueError('concurrency should be positive: ' + str(concurrency))
+        self._func = func
+        self._concurrency = concurrency
+
+    async def explore(self, context: ForkContext = None):
+        results = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self._concurrency) if self._concurrency else None
+        tasks = set()
+        # a branch spawns its siblings before it reports its own end, so no branch is missed when this drops to 0
+        pending = 0
+
+        def _spawn(values, branch_context):
+            nonlocal pending
+            pending += 1
+            task = asyncio.ensure_future(self._run_branch(values, branch_context, _spawn, semaphore, results))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        _spawn([], context or ForkContext())
+        try:
+            while pending:
+                leaf, error = await results.get()
+                pending -= 1
+                if error is not None:
+                    raise error
+                if leaf is not None:
+                    yield leaf
+        finally:
+            remaining = list(tasks)
+            for task in remaining:
+                task.cancel()
+            if remaining:
+                await asyncio.gather(*remaining, return_exceptions=True)
+
+    async def _run_branch(self, values, context, spawn, semaphore, results):
+        try:
+            if semaphore:
+                async with semaphore:
+                    leaf = await self._walk(values, context, spawn)
+            else:
+                leaf = await self._walk(values, context, spawn)
+        except Exception as e:
+            results.put_nowait((None, e))
+        else:
+            results.put_nowait((leaf, None))
+
+    async def _walk(self, values, context, spawn):
+        generator = self._func()
+        try:
+            value = await generator.__anext__()
+            depth = 0
+            while isinstance(value, Forker):
+                if depth < len(values):
+                    sent = values[depth]
+                else:
+                    items = iter(value.do_fork(context))
+                    first = next(items, None)
+                    if first is None:
+                        return None
+
+                    for item in items:
+                        spawn(values + [item.value], item.context)
+                    values = values + [first.value]
+                    sent, context = first.value, first.context
+
+                depth += 1
+                value = await generator.asend(sent)
+        except StopAsyncIteration:
+            value = None
+        finally:
+            await generator.aclose()
+
+        return context.new_item(value)
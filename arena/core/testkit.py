@@ -1,28 +1,94 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import functools
+import inspect
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import queue
+import random
 import threading
+import traceback
+import typing
 import unittest
+from dataclasses import dataclass
 
 from arena.core.fork import *
 
-__all__ = ['testkit', 'fork_test', 'TestKit']
+__all__ = ['testkit', 'fork_test', 'async_fork_test', 'TestKit', 'SharedState', 'SHARD_ENV', 'worker_id', 'unique_name']
+
+SHARD_ENV = 'ARENA_FORK_SHARD'
 
 g = threading.local()
 
+# a context variable rather than a thread local, so every task of `async_fork_test` sees its own testkit
+_current_tk = contextvars.ContextVar('arena_testkit', default=None)
+
+_worker_id = None
+
 
 def testkit() -> TestKit:
-    return g.tk
+    return _current_tk.get()
+
+
+def worker_id() -> typing.Optional[int]:
+    """
+    :return: the index of the `fork_test` worker running in this process or thread, or None outside of a worker
+    """
+    return getattr(g, 'worker_id', _worker_id)
+
+
+def unique_name(name):
+    """
+    :return: `name` suffixed by the worker index, so the tables and databases created by the concurrent workers of a
+             `fork_test` do not collide. `name` is returned as it is outside of a worker.
+    """
+    worker = worker_id()
+    if worker is None:
+        return name
+    return f'{name}_w{worker}'
+
+
+class SharedState:
+    """
+    The state shared by the branches that one runner executes one after another, for the resources that outlive a
+    branch. The functions passed to `defer` run when the runner ends.
+    """
+
+    def __init__(self):
+        self._state = {}
+        self._defers = []
+
+    @property
+    def state(self):
+        return self._state
+
+    def defer(self, func, *args, **kwargs):
+        self._defers.append((func, args, kwargs))
+
+    def close(self):
+        self._defers.reverse()
+        defers = self._defers
+        self._defers = []
+        for func, args, kwargs in defers:
+            func(*args, **kwargs)
 
 
 class TestKit:
-    def __init__(self, name, *, ut):
+    def __init__(self, name, *, ut, shared: SharedState = None):
         self._name = name
         self._ut = ut
         self._path = []
         self._defers = []
         self._debug = False
         self._state = {}
+        self._owns_shared = shared is None
+        self._shared = SharedState() if shared is None else shared
+        self._picks = []
+        self._pick_listeners = []
 
     @property
     def path(self):
@@ -40,6 +106,66 @@ class TestKit:
     def state(self):
         return self._state
 
+    @property
+    def shared(self) -> SharedState:
+        """
+        The state shared with the previous branches run by the same runner, only the branches of 'replay' mode run one
+        after another in the same process, in the other modes every branch gets a new one.
+        """
+        return self._shared
+
+    @property
+    def sequential(self):
+        """
+        Whether `shared` is shared with the branches run before and after this one
+        """
+        return not self._owns_shared
+
+    @property
+    def picks(self):
+        """
+        The values picked so far by the branch, one for every `yield`
+        """
+        return self._picks
+
+    def add_pick_listener(self, func):
+        """
+        :param func: called with the index and the value of every following pick of the branch
+        """
+        self._pick_listeners.append(func)
+
+    def drive(self, generator):
+        """
+        Runs the generator of a case like `yield from` does, recording the picked values and notifying the listeners.
+        The exceptions thrown in and `close` are forwarded to the generator too, so its `finally` blocks run when a
+        branch is aborted.
+        """
+        try:
+            value = next(generator)
+        except StopIteration as e:
+            return e.value
+
+        while True:
+            try:
+                picked = yield value
+            except GeneratorExit:
+                generator.close()
+                raise
+            except BaseException as e:
+                try:
+                    value = generator.throw(e)
+                except StopIteration as stop:
+                    return stop.value
+                continue
+
+            self._picks.append(picked)
+            for func in list(self._pick_listeners):
+                func(len(self._picks) - 1, picked)
+            try:
+                value = generator.send(picked)
+            except StopIteration as e:
+                return e.value
+
     def debug(self, debug=True):
         self._debug = debug
 
@@ -52,18 +178,37 @@ class TestKit:
         self._defers.append((func, args, kwargs))
 
     def __enter__(self):
-        g.tk = self
+        _current_tk.set(self)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
-            self._defers.reverse()
-            defers = self._defers
-            self._defers = []
-            for func, args, kwargs in defers:
+            for func, args, kwargs in self._pop_defers():
                 func(*args, **kwargs)
+            if self._owns_shared:
+                self._shared.close()
+        finally:
+            _current_tk.set(None)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            for func, args, kwargs in self._pop_defers():
+                result = func(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+            if self._owns_shared:
+                self._shared.close()
         finally:
-            g.tk = None
+            _current_tk.set(None)
+
+    def _pop_defers(self):
+        self._defers.reverse()
+        defers = self._defers
+        self._defers = []
+        return defers
 
     @classmethod
     def pick(cls, v):
@@ -82,13 +227,20 @@ class TestKit:
         return cls.pick_enum(False, True)
 
 
+@dataclass
+class CaseOutcome:
+    error: typing.Optional[Exception]
+    path: typing.List
+
+
 class CaseExecutor:
-    def __init__(self, func, *, ut: unittest.TestCase, index, debug):
+    def __init__(self, func, *, ut: unittest.TestCase, index, debug, shared: SharedState = None):
         self._func = func
         self._ut = ut
         self._index = index
         self._name = f'[{index}]'
         self._debug = debug
+        self._shared = shared
 
     def run(self):
         with self._ut.subTest(self._name):
@@ -103,20 +255,70 @@ class CaseExecutor:
                     print('\n    FAILED')
                 raise
 
+    def run_isolated(self):
+        """
+        Runs the case without reporting it, the returned `CaseOutcome` is picklable so it can be reported by `report`
+        in another process.
+        """
+        tk = TestKit(self._name, ut=self._ut, shared=self._shared)
+        try:
+            with tk:
+                tk.debug(self._debug)
+                yield from tk.drive(self._func(self._ut))
+                tk.log_path('OK', 'test ok, do some clear works later ...')
+        except Exception as e:
+            return CaseOutcome(error=self._picklable_error(e), path=list(tk.path))
+        return CaseOutcome(error=None, path=list(tk.path))
+
+    async def run_isolated_async(self):
+        """
+        The async counterpart of `run_isolated` for `async def` cases, async generators cannot return a value so the
+        `CaseOutcome` is yielded as the last value instead, see `AsyncGeneratorExplorer`.
+        """
+        tk = TestKit(self._name, ut=self._ut)
+        error = None
+        try:
+            async with tk:
+                tk.debug(self._debug)
+                generator = self._func(self._ut)
+                try:
+                    value = await generator.__anext__()
+                    while True:
+                        value = await generator.asend((yield value))
+                except StopAsyncIteration:
+                    pass
+                tk.log_path('OK', 'test ok, do some clear works later ...')
+        except Exception as e:
+            error = e
+        yield CaseOutcome(error=error, path=list(tk.path))
+
+    def report(self, outcome: CaseOutcome):
+        with self._ut.subTest(self._name):
+            if self._debug:
+                print(f'\n--> {self._name}')
+                print('\n    FAILED' if outcome.error else '\n    SUCCEED')
+
+            if outcome.error:
+                raise self._decorate_error(outcome.path, outcome.error)
+
     def _run(self):
-        with TestKit(self._name, ut=self._ut) as tk:
+        with TestKit(self._name, ut=self._ut, shared=self._shared) as tk:
             try:
                 tk.debug(self._debug)
-                yield from self._func(self._ut)
+                yield from tk.drive(self._func(self._ut))
                 tk.log_path('OK', 'test ok, do some clear works later ...')
-            except AssertionError as e:
-                raise self._handle_assertion_error(tk, e)
             except Exception as e:
-                path_msg = self._fork_path_detail_message(tk.path)
-                raise RuntimeError(str(e) + '\n\n' + path_msg)
+                raise self._decorate_error(tk.path, e)
+
+    def _decorate_error(self, path, e):
+        if isinstance(e, AssertionError):
+            return self._handle_assertion_error(path, e)
+
+        path_msg = self._fork_path_detail_message(path)
+        return RuntimeError(str(e) + '\n\n' + path_msg)
 
-    def _handle_assertion_error(self, tk, e):
-        path_msg = self._fork_path_detail_message(tk.path)
+    def _handle_assertion_error(self, path, e):
+        path_msg = self._fork_path_detail_message(path)
         if e.args[0]:
             parts = e.args[0].split('\n', 1)
             detail = parts[1] if len(parts) > 1 else ''
@@ -135,24 +337,116 @@ class CaseExecutor:
         msgs = [fmt.format('[' + tp + ']', msg) for tp, msg in path]
         return f'{self._name}\n' + '\n'.join(msgs)
 
+    @staticmethod
+    def _picklable_error(e):
+        try:
+            pickle.dumps(e)
+            return e
+        except Exception:
+            detail = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            if isinstance(e, AssertionError):
+                return AssertionError(detail)
+            return RuntimeError(detail)
+
+
+def fork_test(func=None, *, debug=False, mode='replay', shard=None, sample=None, seed=None, workers=None,
+              threads=None):
+    """
+    :param threads: run the branches in this many threads of the current process, they are split between them like
+                    `workers` does and the outcomes are reported by the calling thread in subTests named with the
+                    thread and branch index. Every branch still gets its own `TestKit` (and so its own
+                    `TidbTestKit` and connections) because the current testkit is thread local, so this suits
+                    branches that mostly wait on IO without paying the start-up and pickling costs of `workers`.
+                    `unique_name` gives per-thread names like it does for the workers. The branches must not share
+                    other mutable state, and 'fork' mode falls back to 'replay' in the threads. With `failfast` no
+                    new branch is started after the first failure.
+    :param workers: run the branches in this many worker processes, the branches are split between them like
+                    `shard` does and every outcome is reported back to the parent in its own `subTest`, with the
+                    worker and branch index as the name. With `failfast` the workers are terminated on the first
+                    failure. The workers must not share external resources, use `unique_name` (or the tables
+                    created by `TableForker` which already use it) to name databases and tables. It falls back to
+                    run in the current process when `GeneratorForker.fork_supported()` is false.
+    :param sample: only run this many branches drawn by `GeneratorForker.sample`, the seed is printed when `seed` is
+                   not given so a failing run can be replayed with it. It cannot be used with `shard`, `workers`,
+                   `threads` or 'fork' mode, and the `ARENA_FORK_SHARD` environment variable is ignored when it is set.
+    :param shard: (index, total) to only run the index-th of `total` disjoint parts of the branches, see
+                  `GeneratorForker.shard`. When it is None, the environment variable `ARENA_FORK_SHARD` in the format
+                  'index/total' is used if set.
+    :param mode: 'replay' re-executes the test from the start for every branch, 'fork' snapshots the process with
+                 `os.fork()` at every `yield` so the code before it runs only once per tree node. In 'fork' mode every
+                 branch runs in its own process, so the test must not share connections or other external resources
+                 between branches, and only the outcome of the branch is reported back to the parent. It falls back to
+                 'replay' when `GeneratorForker.fork_supported()` is false.
+    """
+    if mode not in GeneratorForker.MODES:
+        raise ValueError('invalid mode: ' + str(mode))
+
+    if sample is not None and shard:
+        raise ValueError('sample is mutually exclusive with shard')
+    if sample is not None and mode == 'fork':
+        raise ValueError("sample is mutually exclusive with 'fork' mode")
+
+    if workers is not None:
+        if workers < 1:
+            raise ValueError('workers should be positive: ' + str(workers))
+        if sample is not None:
+            raise ValueError('sample is mutually exclusive with workers')
+
+    if threads is not None:
+        if threads < 1:
+            raise ValueError('threads should be positive: ' + str(threads))
+        if sample is not None:
+            raise ValueError('sample is mutually exclusive with threads')
+        if workers is not None:
+            raise ValueError('threads is mutually exclusive with workers')
 
-def fork_test(func=None, *, debug=False):
     def _wrapper(_func):
         @functools.wraps(_func)
         def _test_func(self):
+            test_shard = None if sample is not None else shard or _shard_from_env()
+            test_seed = seed
+            if sample is not None and test_seed is None:
+                test_seed = random.randrange(1 << 32)
+                print(f'\n*** Sample {sample} branches of {_func.__name__} with seed: {test_seed} ***')
+
             if debug:
-                print(f'\n*** Start fork test: {_func.__name__} ***')
+                shard_msg = f' (shard {test_shard[0]}/{test_shard[1]})' if test_shard else ''
+                print(f'\n*** Start fork test: {_func.__name__}{shard_msg} ***')
+
+            def _new_forker(generate, forker_mode, forker_shard=test_shard):
+                forker = GeneratorForker(generate, mode=forker_mode, shard=forker_shard)
+                if sample is not None:
+                    forker = forker.sample(sample, seed=test_seed)
+                return forker
+
+            if workers is not None and workers > 1 and GeneratorForker.fork_supported():
+                _run_worker_cases(
+                    self, _func, debug=debug, mode=mode, shard=test_shard, workers=workers, forker_factory=_new_forker)
+                return
+
+            if threads is not None and threads > 1:
+                _run_thread_cases(
+                    self, _func, debug=debug, shard=test_shard, threads=threads, forker_factory=_new_forker)
+                return
+
+            if mode == 'fork':
+                _run_isolated_cases(self, _func, debug=debug, forker_factory=_new_forker)
+                return
 
             index = 0
+            shared = SharedState()
 
             def _generate():
                 nonlocal index
                 index += 1
-                executor = CaseExecutor(_func, ut=self, debug=debug, index=index)
+                executor = CaseExecutor(_func, ut=self, debug=debug, index=index, shared=shared)
                 yield from executor.run()
 
-            for _ in GeneratorForker(_generate):
-                pass
+            try:
+                for _ in _new_forker(_generate, 'replay'):
+                    pass
+            finally:
+                shared.close()
 
         return _test_func
 
@@ -160,3 +454,192 @@ def fork_test(func=None, *, debug=False):
         return _wrapper(func)
 
     return _wrapper
+
+
+def async_fork_test(func=None, *, debug=False, concurrency=None):
+    """
+    The asyncio counterpart of `fork_test` for `async def` test bodies, which `yield` forkers like the generators of
+    `fork_test` do and can `await` async connections such as `TidbTestKit.connect_async`. The branches are explored
+    by `AsyncGeneratorExplorer` on a new event loop, so a single thread overlaps the IO of many branches. Every branch
+    gets its own `TestKit` and the outcomes are reported in subTests in the order the branches end. Awaitables
+    returned by the functions passed to `TestKit.defer` are awaited.
+
+    :param concurrency: the maximum number of branches running at the same time, unbounded when None
+    """
+    if concurrency is not None and concurrency < 1:
+        raise ValueError('concurrency should be positive: ' + str(concurrency))
+
+    def _wrapper(_func):
+        @functools.wraps(_func)
+        def _test_func(self):
+            if debug:
+                print(f'\n*** Start async fork test: {_func.__name__} ***')
+            asyncio.run(_run_async_cases(self, _func, debug=debug, concurrency=concurrency))
+
+        return _test_func
+
+    if func:
+        return _wrapper(func)
+
+    return _wrapper
+
+
+async def _run_async_cases(ut, func, *, debug, concurrency):
+    def _generate():
+        return CaseExecutor(func, ut=ut, debug=debug, index='?').run_isolated_async()
+
+    leaves = AsyncGeneratorExplorer(_generate, concurrency=concurrency).explore()
+    try:
+        index = 0
+        async for leaf in leaves:
+            index += 1
+            CaseExecutor(func, ut=ut, debug=debug, index=index).report(leaf.value)
+    finally:
+        await leaves.aclose()
+
+
+def _run_isolated_cases(ut, func, *, debug, forker_factory):
+    def _generate():
+        executor = CaseExecutor(func, ut=ut, debug=debug, index='?')
+        return (yield from executor.run_isolated())
+
+    for index, outcome in enumerate(forker_factory(_generate, 'fork'), 1):
+        CaseExecutor(func, ut=ut, debug=debug, index=index).report(outcome)
+
+
+def _worker_shard(shard, worker, workers):
+    # the parts of `GeneratorForker.shard` are contiguous ranges of the branches, so splitting every part of `total`
+    # into `workers` parts gives the same branches as the part itself
+    index, total = shard or (0, 1)
+    return index * workers + worker, total * workers
+
+
+def _run_worker_cases(ut, func, *, debug, mode, shard, workers, forker_factory):
+    ctx = multiprocessing.get_context('fork')
+    # a pipe per worker rather than a Queue, whose feeder thread would be running in the worker when it forks the
+    # branches of 'fork' mode
+    pipes = [ctx.Pipe(duplex=False) for _ in range(workers)]
+
+    def _work(worker):
+        global _worker_id
+        _worker_id = worker
+        writer = pipes[worker][1]
+        # the branches of 'fork' mode run in processes forked by the worker, they cannot share anything
+        shared = SharedState() if mode == 'replay' else None
+
+        def _generate():
+            executor = CaseExecutor(func, ut=ut, debug=debug, index='?', shared=shared)
+            return (yield from executor.run_isolated())
+
+        try:
+            forker = forker_factory(_generate, mode, _worker_shard(shard, worker, workers))
+            for index, outcome in enumerate(forker, 1):
+                writer.send(('outcome', index, outcome))
+            if shared:
+                shared.close()
+        except BaseException as e:
+            writer.send(('error', None, CaseExecutor._picklable_error(e)))
+        finally:
+            writer.send(('done', None, None))
+
+    processes = [ctx.Process(target=_work, args=(worker,), daemon=True) for worker in range(workers)]
+    for p in processes:
+        p.start()
+    for _, writer in pipes:
+        writer.close()
+
+    readers = {pipes[worker][0]: worker for worker in range(workers)}
+    try:
+        running = set(range(workers))
+        while running:
+            sentinels = {processes[worker].sentinel: worker for worker in running}
+            ready = multiprocessing.connection.wait(list(readers) + list(sentinels))
+            for reader in [r for r in ready if r in readers]:
+                worker = readers[reader]
+                try:
+                    kind, index, value = reader.recv()
+                except EOFError:
+                    del readers[reader]
+                    continue
+
+                if kind == 'outcome':
+                    CaseExecutor(func, ut=ut, debug=debug, index=f'w{worker}-{index}').report(value)
+                elif kind == 'error':
+                    with ut.subTest(f'[w{worker}]'):
+                        raise value
+                else:
+                    running.discard(worker)
+
+            for sentinel in [s for s in ready if s in sentinels]:
+                worker = sentinels[sentinel]
+                reader = pipes[worker][0]
+                if worker in running and not (reader in readers and reader.poll()):
+                    running.discard(worker)
+                    with ut.subTest(f'[w{worker}]'):
+                        raise RuntimeError(f'worker {worker} exited with code {processes[worker].exitcode}')
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        for reader, _ in pipes:
+            reader.close()
+
+
+def _run_thread_cases(ut, func, *, debug, shard, threads, forker_factory):
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def _work(thread):
+        g.worker_id = thread
+        shared = SharedState()
+
+        def _generate():
+            executor = CaseExecutor(func, ut=ut, debug=debug, index='?', shared=shared)
+            return (yield from executor.run_isolated())
+
+        try:
+            try:
+                forker = forker_factory(_generate, 'replay', _worker_shard(shard, thread, threads))
+                for index, outcome in enumerate(forker, 1):
+                    results.put(('outcome', thread, index, outcome))
+                    if stop.is_set():
+                        break
+            finally:
+                shared.close()
+        except BaseException as e:
+            results.put(('error', thread, None, e))
+        finally:
+            results.put(('done', thread, None, None))
+
+    workers = [threading.Thread(target=_work, args=(thread,), daemon=True) for thread in range(threads)]
+    for t in workers:
+        t.start()
+
+    try:
+        running = set(range(threads))
+        while running:
+            kind, thread, index, value = results.get()
+            if kind == 'outcome':
+                CaseExecutor(func, ut=ut, debug=debug, index=f't{thread}-{index}').report(value)
+            elif kind == 'error':
+                with ut.subTest(f'[t{thread}]'):
+                    raise value
+            else:
+                running.discard(thread)
+    finally:
+        stop.set()
+        for t in workers:
+            t.join()
+
+
+def _shard_from_env():
+    value = os.environ.get(SHARD_ENV)
+    if not value:
+        return None
+
+    try:
+        index, total = value.split('/')
+        return int(index), int(total)
+    except ValueError:
+        raise ValueError(f"invalid {SHARD_ENV}: '{value}', it should be in the format 'index/total'")
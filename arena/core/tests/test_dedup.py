@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import unittest
+
+from arena.core.dedup import *
+
+
+class TestTransitionSet(unittest.TestCase):
+    def _check_exact(self, transitions: TransitionSet):
+        for i in range(5000):
+            transitions.add((i % 100, (i // 100, 'x')), f'act{i % 7}')
+        self.assertEqual(len(transitions), len({(i % 100, i // 100, i % 7) for i in range(5000)}))
+        self.assertTrue(transitions.contains((3, (0, 'x')), 'act3'))
+        self.assertFalse(transitions.contains((3, (0, 'x')), 'act4'))
+        self.assertFalse(transitions.contains((3, (0, 'y')), 'act3'))
+        self.assertGreater(transitions.bytes_per_transition(), 0)
+        self.assertIn('bytes per transition', transitions.report())
+
+        transitions.clear()
+        self.assertEqual(len(transitions), 0)
+        self.assertFalse(transitions.contains((3, (0, 'x')), 'act3'))
+
+    def test_exact(self):
+        self._check_exact(ExactTransitionSet())
+
+    def test_fingerprint_table(self):
+        table = FingerprintTable(capacity=8)
+        self._check_exact(table)
+
+        for i in range(10000):
+            table.add(i, 'a')
+        self.assertEqual(len(table), 10000)
+        self.assertTrue(all(table.contains(i, 'a') for i in range(10000)))
+        self.assertFalse(any(table.contains(i, 'b') for i in range(10000)))
+        self.assertLessEqual(table.bytes_per_transition(), 8 / 0.7 * 2)
+        self.assertTrue(table.add_fingerprint(0))
+        self.assertFalse(table.add_fingerprint(0))
+
+        with self.assertRaises(ValueError):
+            FingerprintTable(max_load=1)
+
+    def test_fingerprint(self):
+        table = FingerprintTable()
+        # they have the same hash()
+        for sigs in ([-1, -2], [1, 1.0, True], [(1, -1), (1, -2)], [(0, (1,)), (0, (True,)), (False, (1,))],
+                     [frozenset([-1]), frozenset([-2])]):
+            self.assertEqual(len({table.fingerprint(sig, 'a') for sig in sigs}), len(sigs), sigs)
+
+        # equal signatures have equal fingerprints, whatever the order their frozensets were built in
+        self.assertEqual(table.fingerprint(frozenset(['x', (1, 'y'), 3]), 'a'),
+                         table.fingerprint(frozenset([3, 'x', (1, 'y')]), 'a'))
+        self.assertNotEqual(table.fingerprint(1, 'a'), table.fingerprint(1, 'b'))
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(i, 'a')
+        self.assertTrue(all(bloom.contains(i, 'a') for i in range(10000)))
+        false_positives = sum(bloom.contains(i, 'b') for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertLess(bloom.bytes_per_transition(), 1.5)
+
+        bloom.clear()
+        self.assertFalse(bloom.contains(1, 'a'))
+
+        with self.assertRaises(ValueError):
+            BloomFilter(error_rate=0)
+
+    def test_shared_fingerprint_table(self):
+        table = SharedFingerprintTable(capacity=1 << 12)
+        table.intern(['a', 'b'])
+        ctx = multiprocessing.get_context('fork')
+
+        def _add(start):
+            claimed = sum(1 for i in range(start, start + 1000) if table.add(i, 'a'))
+            os._exit(0 if claimed else 1)
+
+        processes = [ctx.Process(target=_add, args=(start,)) for start in (0, 500)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertEqual(0, p.exitcode)
+        self.assertEqual(len(table), 1500)
+        self.assertTrue(table.contains(1499, 'a'))
+        self.assertFalse(table.add(0, 'a'))
+
+        table.clear()
+        self.assertEqual(len(table), 0)
+        with self.assertRaises(RuntimeError):
+            for i in range(1 << 12):
+                table.add(i, 'b')
@@ -1,6 +1,7 @@
 import operator
 import unittest
 from arena.core.event_driven import *
+from arena.core.event_driven import Action, EnablementIndex, StateDriver
 
 
 class TestEventDriven(unittest.TestCase):
@@ -122,3 +123,254 @@ class TestEventDriven(unittest.TestCase):
                 expected_covers.add((pos, move))
 
         self.assertEqual(expected_covers, covers)
+
+    def test_copied_state(self):
+        setups = []
+
+        class State(EventDrivenState):
+            def __init__(self):
+                self.pos = 0
+                self.path = []
+                setups.append(self)
+
+            def signature(self):
+                return self.pos
+
+            @cond
+            def not_end(self):
+                return self.pos < 6
+
+            @action(name='move2', cond=not_end, args=2)
+            @action(name='move1', cond=not_end, args=1)
+            def move(self, v):
+                self.pos += v
+                self.path.append(v)
+
+        class CopiedState(State):
+            def __copy__(self):
+                state = CopiedState.__new__(CopiedState)
+                state.pos = self.pos
+                state.path = self.path.copy()
+                return state
+
+        self.assertFalse(State.supports_copy())
+        self.assertTrue(CopiedState.supports_copy())
+
+        replayed = [(s.path, [a.name for a in s.action_records]) for s in State.run()]
+        replay_setups = len(setups)
+        setups.clear()
+        copied = [(s.path, [a.name for a in s.action_records]) for s in CopiedState.run()]
+        self.assertListEqual(replayed, copied)
+        self.assertGreater(replay_setups, 1)
+        self.assertEqual(len(setups), 1)
+
+    def test_strategies(self):
+        class State(EventDrivenState):
+            def __init__(self):
+                self.pos = 0
+
+            def signature(self):
+                return self.pos
+
+            @cond
+            def not_end(self):
+                return self.pos < 5
+
+            @action(name='move2', cond=not_end, args=2)
+            @action(name='move1', cond=not_end, args=1)
+            def move(self, v):
+                self.pos += v
+
+        def traces(states):
+            return [tuple(a.name for a in s.action_records) for s in states]
+
+        def covers(states):
+            covered = set()
+            for trace in traces(states):
+                pos = 0
+                for name in trace:
+                    covered.add((pos, name))
+                    pos += int(name[-1])
+            return covered
+
+        expected = {(pos, name) for pos in range(5) for name in ('move1', 'move2')}
+        for strategy in (None, DepthFirst(), BreadthFirst(), IterativeDeepening(), BestFirst(lambda s: -s.pos)):
+            self.assertSetEqual(expected, covers(State.run(strategy=strategy)))
+
+        # no final state is a prefix of another, even when a shallow round of IterativeDeepening found it final
+        for strategy in (None, BreadthFirst(), IterativeDeepening(), IterativeDeepening(step=2)):
+            for budget in (None, Budget(max_depth=3)):
+                found = traces(State.run(strategy=strategy, budget=budget))
+                self.assertFalse([t for t in found for other in found if len(other) > len(t) and other[:len(t)] == t])
+
+        lengths = [len(t) for t in traces(State.run(strategy=BreadthFirst()))]
+        self.assertListEqual(sorted(lengths), lengths)
+
+        # the deepest state first
+        self.assertEqual(('move2', 'move2', 'move2'), traces(State.run(strategy=BestFirst(lambda s: -s.pos)))[0])
+
+        for strategy in (None, BreadthFirst(), IterativeDeepening()):
+            states = list(State.run(strategy=strategy, budget=Budget(max_depth=2)))
+            self.assertTrue(states)
+            self.assertLessEqual(max(len(s.action_records) for s in states), 2)
+
+            driver = StateDriver(State)
+            states = list(driver.run(strategy=strategy, budget=Budget(max_states=4)))
+            self.assertTrue(states)
+            self.assertLessEqual(driver.states, 4)
+
+    def test_dedup(self):
+        class State(EventDrivenState):
+            def __init__(self):
+                self.pos = 0
+
+            def signature(self):
+                return self.pos, ('pos', self.pos % 3)
+
+            @cond
+            def not_end(self):
+                return self.pos < 8
+
+            @action(name='move2', cond=not_end, args=2)
+            @action(name='move1', cond=not_end, args=1)
+            def move(self, v):
+                self.pos += v
+
+        def traces(**kwargs):
+            return [tuple(a.name for a in s.action_records) for s in State.run(**kwargs)]
+
+        expected = traces()
+        self.assertListEqual(expected, traces(dedup=FingerprintTable()))
+        self.assertListEqual(expected, traces(dedup=BloomFilter(capacity=1000, error_rate=1e-6)))
+
+    def test_parallel_search(self):
+        class State(EventDrivenState):
+            def __init__(self):
+                self.pos = 0
+
+            def signature(self):
+                return self.pos
+
+            @cond
+            def not_end(self):
+                return self.pos < 20
+
+            @action(name='move3', cond=not_end, args=3)
+            @action(name='move2', cond=not_end, args=2)
+            @action(name='move1', cond=not_end, args=1)
+            def move(self, v):
+                self.pos += v
+
+        def transitions(states):
+            covered = set()
+            for s in states:
+                pos = 0
+                for act in s.action_records:
+                    covered.add((pos, act.name))
+                    pos += act.args
+                self.assertEqual(pos, s.pos)
+            return covered
+
+        expected = transitions(State.run())
+        driver = StateDriver(State)
+        states = list(driver.run(strategy=ParallelSearch(workers=3)))
+        self.assertSetEqual(expected, transitions(states))
+        self.assertEqual(len(driver.dedup), len(expected))
+        self.assertEqual(driver.states, len(expected) + 1)
+
+        states = list(State.run(strategy=ParallelSearch(workers=2), budget=Budget(max_depth=3)))
+        self.assertTrue(states)
+        self.assertLessEqual(max(len(s.action_records) for s in states), 3)
+
+        # a single worker claims the transitions as lazily as DepthFirst, which matters when a state reaches the
+        # signature of a state above it
+        class CyclicState(State):
+            def signature(self):
+                return self.pos % 4
+
+        self.assertListEqual([s.action_records for s in CyclicState.run()],
+                             [s.action_records for s in CyclicState.run(strategy=ParallelSearch(workers=1))])
+
+        table = SharedFingerprintTable(capacity=1 << 12)
+        driver = StateDriver(State, dedup=table)
+        self.assertSetEqual(expected, transitions(driver.run(strategy=ParallelSearch(workers=2))))
+        self.assertIs(driver.dedup, table)
+        self.assertEqual(len(table), len(expected))
+        with self.assertRaises(ValueError):
+            list(State.run(strategy=ParallelSearch(workers=2), dedup=BloomFilter(capacity=1000)))
+
+    def test_enablement_index(self):
+        calls = []
+
+        def atom(name, func):
+            def _func(v):
+                calls.append(name)
+                return func(v)
+
+            _func.__name__ = name
+            return cond(_func)
+
+        zero = atom('zero', lambda v: v == 0)
+        positive = atom('positive', lambda v: v > 0)
+        odd = atom('odd', lambda v: v % 2 == 1)
+
+        class Value(int):
+            def enablement_key(self):
+                return None
+
+        conds = [zero, ~zero, positive & odd, positive | odd, ~(zero | odd) & positive, zero & ~positive | odd]
+        index = EnablementIndex([Action(name=str(i), func=None, cond=c, args=None) for i, c in enumerate(conds)])
+        self.assertListEqual(['zero', 'positive', 'odd'], index.atom_names)
+        for v in range(-3, 4):
+            expected = [str(i) for i, c in enumerate(conds) if c(v)]
+            calls.clear()
+            self.assertListEqual(expected, [act.name for act in index.enabled(Value(v))])
+            # every atom at most once
+            self.assertEqual(len(calls), len(set(calls)))
+
+        # short-circuits like `_Cond`
+        index = EnablementIndex([Action(name='a', func=None, cond=zero & positive, args=None)])
+        calls.clear()
+        index.enabled(Value(1))
+        self.assertListEqual(['zero'], calls)
+
+    def test_enablement_cache(self):
+        class State(EventDrivenState):
+            def __init__(self):
+                self.pos = 0
+
+            def signature(self):
+                return self.pos % 4
+
+            def enablement_key(self):
+                return self.pos % 4, len(self.action_records) < 6
+
+            @cond
+            def not_end(self):
+                return len(self.action_records) < 6
+
+            @cond
+            def even(self):
+                return self.pos % 2 == 0
+
+            @action(name='move2', cond=not_end & even, args=2)
+            @action(name='move1', cond=not_end, args=1)
+            def move(self, v):
+                self.pos += v
+
+        class UncachedState(State):
+            def enablement_key(self):
+                return None
+
+        def traces(cls, **kwargs):
+            driver = StateDriver(cls)
+            return [tuple(a.name for a in s.action_records) for s in driver.run(**kwargs)], driver.enablement
+
+        for strategy in (None, BreadthFirst(), IterativeDeepening()):
+            expected, uncached = traces(UncachedState, strategy=strategy)
+            actual, enablement = traces(State, strategy=strategy)
+            self.assertListEqual(expected, actual)
+            self.assertEqual(0, uncached.hits + uncached.misses)
+            self.assertLessEqual(enablement.misses, 8)
+            self.assertGreater(enablement.hits, 0)
+            self.assertEqual(enablement.hits / (enablement.hits + enablement.misses), enablement.hit_rate())
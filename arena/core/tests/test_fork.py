@@ -1,3 +1,8 @@
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
 import unittest
 from collections import OrderedDict
 
@@ -21,6 +26,60 @@ class TestForkContext(unittest.TestCase):
                 self.assertIs(ele.context, ctx)
                 self.assertIs(ele.value, objs[i])
 
+    def test_set_var(self):
+        ctx = ForkContext(variables={'a': 1})
+        ctx2 = ctx.set_var('b', 2)
+        ctx3 = ctx2.set_var('a', 3)
+        self.assertDictEqual(ctx.vars, {'a': 1})
+        self.assertDictEqual(ctx2.vars, {'a': 1, 'b': 2})
+        self.assertDictEqual(ctx3.vars, {'a': 3, 'b': 2})
+        self.assertFalse(ctx.has_var('b'))
+        self.assertTrue(ctx2.has_var('b'))
+        self.assertIsNone(ctx.get_var('b'))
+        self.assertEqual(ctx.get_var('b', default=5), 5)
+
+        ctx = ForkContext()
+        expected = {}
+        for i in range(2000):
+            ctx = ctx.set_var(f'k{i}', i)
+            expected[f'k{i}'] = i
+        self.assertDictEqual(ctx.vars, expected)
+        for i in range(2000):
+            self.assertEqual(ctx.get_var(f'k{i}'), i)
+        ctx = ctx.set_var('k0', -1)
+        self.assertEqual(ctx.get_var('k0'), -1)
+        self.assertEqual(ctx.vars['k0'], -1)
+        self.assertEqual(list(expected), list(ctx.vars))
+
+    def test_set_var_shares_parent(self):
+        class Key:
+            # keys of the same hash
+            def __init__(self, name):
+                self.name = name
+
+            def __hash__(self):
+                return 7
+
+            def __eq__(self, other):
+                return isinstance(other, Key) and other.name == self.name
+
+        keys = [f'k{i}' for i in range(600)] + [Key(i) for i in range(5)]
+        contexts = [ForkContext()]
+        for i, key in enumerate(keys):
+            contexts.append(contexts[-1].set_var(key, i))
+        for n, ctx in enumerate(contexts):
+            for i, key in enumerate(keys):
+                self.assertEqual(i if i < n else None, ctx.get_var(key))
+                self.assertEqual(i < n, ctx.has_var(key))
+            self.assertEqual(n, len(ctx.vars))
+
+        ctx = contexts[-1].set_var(Key(2), 'x').set_var('k1', 'y')
+        self.assertEqual('x', ctx.get_var(Key(2)))
+        self.assertEqual('y', ctx.get_var('k1'))
+        self.assertEqual(len(keys), len(ctx.vars))
+        self.assertEqual(len(keys) - 3, contexts[-1].get_var(Key(2)))
+        self.assertEqual(1, contexts[-1].get_var('k1'))
+
 
 class TestForkItem(unittest.TestCase):
     def test_equal(self):
@@ -106,6 +165,35 @@ class TestForker(unittest.TestCase):
             list(ctx.new_fork_result([3, 4])),
         )
 
+    def test_fused_transform(self):
+        ctx = ForkContext()
+        seen = []
+        forker = FlatForker([1, 2, 3, 4]) \
+            .map_value(lambda v: v * 10) \
+            .filter_value(lambda v: v != 20) \
+            .foreach(lambda item: seen.append(item.value)) \
+            .flat_map_value(lambda v: [v, v + 1]) \
+            .filter(lambda item: item.value % 2 == 0) \
+            .map(lambda item: item.set_var('v', item.value))
+        unfused = TransformForker(FlatForker([1, 2, 3, 4]), [
+            lambda r: r.map_value(lambda v: v * 10),
+            lambda r: r.filter_value(lambda v: v != 20),
+            lambda r: r.foreach(lambda item: seen.append(item.value)),
+            lambda r: r.flat_map_value(lambda v: [v, v + 1]),
+            lambda r: r.filter(lambda item: item.value % 2 == 0),
+            lambda r: r.map(lambda item: item.set_var('v', item.value)),
+        ])
+
+        items = list(forker.do_fork(ctx))
+        self.assertListEqual(seen, [10, 30, 40])
+        seen.clear()
+        unfused_items = list(unfused.do_fork(ctx))
+        self.assertListEqual(seen, [10, 30, 40])
+        self.assertListEqual([item.value for item in items], [10, 30, 40])
+        self.assertListEqual([item.value for item in items], [item.value for item in unfused_items])
+        for item in items:
+            self.assertEqual(item.get_var('v'), item.value)
+
     def test_map(self):
         ctx = ForkContext()
         ctx2 = ForkContext()
@@ -253,6 +341,31 @@ class TestChainReactionForker(unittest.TestCase):
                 expected_dict[str(value)] = expected_dict.get(str(value), 0) + 1
             self.assertDictEqual(item.context.vars, expected_dict)
 
+    def test_deep_chain(self):
+        depth = sys.getrecursionlimit() * 2
+        forker = ReactionForker(ChainForker(
+            [FlatForker([1, 2])] + [FlatForker([0])] * depth,
+            reduce=lambda state, v: (state or 0) + v,
+        ))
+        self.assertListEqual(list(forker), [1, 2])
+
+    def test_callable_and_stop(self):
+        forker = ChainForker([
+            FlatForker([1, 2]),
+            lambda s: FlatForker([s[0] * 10, s[0] * 10 + 1]),
+            lambda s: FlatForker([sum(s)]),
+        ])
+        self.assertListEqual(list(ReactionForker(forker)), [
+            (1, 10, 11), (1, 11, 12), (2, 20, 22), (2, 21, 23),
+        ])
+
+        stopped = list(ReactionForker(forker, stop=lambda item: isinstance(item.value, ChainForker)))
+        self.assertEqual(len(stopped), 2)
+        self.assertTrue(all(isinstance(v, ChainForker) for v in stopped))
+
+        nested = ReactionForker(FlatForker([FlatForker([1, FlatForker([2, 3])]), 4, forker]))
+        self.assertListEqual(list(nested), [1, 2, 3, 4, (1, 10, 11), (1, 11, 12), (2, 20, 22), (2, 21, 23)])
+
 
 class TestContainerForker(unittest.TestCase):
     def test_list(self):
@@ -491,3 +604,427 @@ class TestGeneratorForker(unittest.TestCase):
 
         for sql in GeneratorForker(_gen):
             print(sql)
+
+    @unittest.skipUnless(GeneratorForker.fork_supported(), 'fork mode is not supported')
+    def test_fork_mode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log_file = os.path.join(tmp, 'log')
+
+            def _log(msg):
+                with open(log_file, 'a') as f:
+                    f.write(msg + '\n')
+
+            def _gen():
+                _log('start')
+                v1 = yield FlatForker([1, 2, 3])
+                _log(f'v1={v1}')
+                v2 = yield FlatForker([10, 20]) if v1 < 3 else FlatForker([])
+                _log(f'v2={v2}')
+                return v1 + v2
+
+            self.assertListEqual(list(GeneratorForker(_gen)), [11, 21, 12, 22])
+            os.remove(log_file)
+            self.assertListEqual(list(GeneratorForker(_gen, mode='fork')), [11, 21, 12, 22])
+            with open(log_file) as f:
+                self.assertListEqual(sorted(f.read().split()), sorted([
+                    'start', 'v1=1', 'v1=2', 'v1=3', 'v2=10', 'v2=20', 'v2=10', 'v2=20'
+                ]))
+
+    @unittest.skipUnless(GeneratorForker.fork_supported(), 'fork mode is not supported')
+    def test_fork_mode_error(self):
+        def _gen():
+            v = yield FlatForker([1, 2, 3])
+            if v == 2:
+                raise KeyError('v2')
+            return v
+
+        result = []
+        with self.assertRaises(KeyError):
+            for v in GeneratorForker(_gen, mode='fork'):
+                result.append(v)
+        self.assertListEqual(result, [1])
+
+        with self.assertRaises(ValueError):
+            GeneratorForker(_gen, mode='unknown')
+
+
+class TestEstimate(unittest.TestCase):
+    def test_exact(self):
+        forkers = [
+            FlatForker([1, 2, 3]),
+            RangeForker(0, 10),
+            SingleValueForker(1),
+            FlatForker([1, 2]).concat(RangeForker(0, 5)),
+            ContainerForker([FlatForker([1, 2]), 3, FlatForker([4, 5, 6])]),
+            ContainerForker(OrderedDict([('a', FlatForker([])), ('b', FlatForker([2, 3])), ('c', 1)])),
+            ContainerForker({}),
+            ReactionForker(ChainForker([FlatForker([1, 2]), FlatForker([4, 5]), FlatForker([6])])),
+            ChainForker([FlatForker([1, 2]), FlatForker([4, 5])]),
+            FlatForker([1, 2]).map_value(lambda v: v + 1).foreach(lambda _: None),
+            FlatForker([1, 2]) + FlatForker([3, 4, 5]),
+            IfConditionForker(True, FlatForker([1, 2]), else_then=FlatForker([3])),
+            IfConditionForker(FlatForker([True, False]), FlatForker([1, 2]), else_then=FlatForker([3, 4])),
+            DefaultValueForker(FlatForker([]), default=1),
+        ]
+        for i, forker in enumerate(forkers):
+            with self.subTest(i=i):
+                self.assertTrue(forker.estimate().is_exact)
+                self.assertEqual(forker.count(), len(list(forker)))
+
+    def test_bounds(self):
+        forker = FlatForker([1, 2, 3, 4]).filter_value(lambda v: v > 2)
+        self.assertEqual(forker.estimate(), ForkSize(0, 4))
+        with self.assertRaises(ValueError):
+            forker.count()
+
+        forker = IfConditionForker(FlatForker([True, False]), FlatForker([1, 2]), else_then=FlatForker([3, 4, 5]))
+        self.assertEqual(forker.estimate(), ForkSize(4, 6))
+
+        forker = ReactionForker(ChainForker([
+            FlatForker([1, 2]),
+            lambda b: FlatForker([3, 4]) if b[0] == 1 else FlatForker([5, 6, 7]),
+        ]))
+        self.assertEqual(forker.estimate(), ForkSize(0, None))
+
+        forker = ContainerForker([FlatForker([1, 2]), FlatForker(iter([1]))])
+        self.assertEqual(forker.estimate(), ForkSize(0, None))
+
+        self.assertEqual(FlatForker([1]).flat_map_value(lambda v: [v, v]).estimate(), ForkSize.unknown())
+        self.assertEqual(GeneratorForker(lambda: (yield FlatForker([1]))).estimate(), ForkSize.unknown())
+
+
+class TestRandomAccess(unittest.TestCase):
+    def test_nth(self):
+        forkers = [
+            FlatForker([1, 2, 3]),
+            RangeForker(0, 10),
+            FlatForker([1, 2]).concat(RangeForker(0, 5)).concat(FlatForker([])),
+            ContainerForker([FlatForker([1, 2]), 3, FlatForker([4, 5, 6])]),
+            ContainerForker((FlatForker([1, 2]), FlatForker([4, 5, 6]))),
+            ContainerForker(OrderedDict([('a', FlatForker([])), ('b', FlatForker([2, 3])), ('c', FlatForker([4, 5]))])),
+            ContainerForker({}),
+            ReactionForker(ChainForker([FlatForker([1, 2]), FlatForker([4, 5]), FlatForker([6]), FlatForker([7, 8])])),
+            FlatForker([1, 2]).map_value(lambda v: v + 1).foreach(lambda _: None),
+            FlatForker([_A(1), _A(2)])(FlatForker([3, 4])),
+            IfConditionForker(False, FlatForker([1, 2]), else_then=FlatForker([3])),
+        ]
+        for i, forker in enumerate(forkers):
+            with self.subTest(i=i):
+                values = list(forker)
+                self.assertTrue(forker.supports_nth())
+                self.assertListEqual([forker.nth(j) for j in range(len(values))], values)
+                self.assertEqual(forker.nth(-1), values[-1])
+                self.assertListEqual(list(forker.slice(1)), values[1:])
+                self.assertListEqual(list(forker.slice(1, -1)), values[1:-1])
+                self.assertEqual(forker.slice(1, -1).count(), len(values[1:-1]))
+                with self.assertRaises(IndexError):
+                    forker.nth(len(values))
+
+    def test_nth_context(self):
+        key1, f1 = FlatForker([1, 2]).record()
+        key2, f2 = FlatForker([3, 4, 5]).record()
+        forker = ReactionForker(ChainForker([f1, f2]))
+        items = list(forker.do_fork(ForkContext()))
+        for i, item in enumerate(items):
+            nth = forker.nth_item(ForkContext(), i)
+            self.assertEqual(nth.value, item.value)
+            self.assertDictEqual(nth.context.vars, item.context.vars)
+
+    def test_not_supported(self):
+        forkers = [
+            FlatForker([1, 2, 3]).filter_value(lambda v: v > 1),
+            FlatForker(iter([1, 2])),
+            FlatForker({1, 2}),
+            ReactionForker(ChainForker([FlatForker([1, 2]), lambda s: FlatForker([s[0]])])),
+            GeneratorForker(lambda: (yield FlatForker([1]))),
+            FlatForker([1]).concat(_Counted([2, 3])),
+        ]
+        for i, forker in enumerate(forkers):
+            with self.subTest(i=i):
+                self.assertFalse(forker.supports_nth())
+                with self.assertRaises(ValueError):
+                    forker.nth(len(list(forker)) - 1)
+
+
+class _Counted(Forker):
+    """
+    A forker with an exact count and no random access
+    """
+
+    def __init__(self, values):
+        self._values = values
+
+    def do_fork(self, context: ForkContext) -> ForkResult:
+        return context.new_fork_result(self._values)
+
+    def estimate(self) -> ForkSize:
+        return ForkSize.exact(len(self._values))
+
+
+class _A:
+    def __init__(self, x):
+        self.x = x
+
+    def __call__(self, y):
+        return self.x + y
+
+
+class TestShard(unittest.TestCase):
+    def test_shard(self):
+        forkers = [
+            RangeForker(0, 10),
+            ContainerForker([FlatForker([1, 2]), 3, FlatForker([4, 5, 6])]),
+            FlatForker(iter(range(10))),
+            FlatForker([1, 2, 3]).filter_value(lambda v: v > 1),
+            FlatForker([1]),
+            # random access to the first child only
+            ConcatForker((FlatForker([1]), _Counted([2, 3, 4]))),
+        ]
+        for i, forker in enumerate(forkers):
+            for total in [1, 2, 3, 4]:
+                with self.subTest(i=i, total=total):
+                    values = list(forker)
+                    if isinstance(forker, FlatForker) and not isinstance(forker._values, list):
+                        forker = FlatForker(list(values))
+                    shards = [list(forker.shard(index, total)) for index in range(total)]
+                    self.assertListEqual(sorted(v for shard in shards for v in shard), sorted(values))
+                    sizes = [len(shard) for shard in shards]
+                    self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+        with self.assertRaises(ValueError):
+            FlatForker([1]).shard(2, 2)
+
+    def test_generator_shard(self):
+        def _gen():
+            a = yield FlatForker([True, False])
+            b = yield FlatForker([True, False])
+            c = yield FlatForker([1, 2, 3]) if a else FlatForker([4])
+            return a, b, c
+
+        values = list(GeneratorForker(_gen))
+        modes = ['replay', 'fork'] if GeneratorForker.fork_supported() else ['replay']
+        for mode in modes:
+            for total in [1, 2, 3, 4, 7, 20]:
+                with self.subTest(mode=mode, total=total):
+                    shards = [list(GeneratorForker(_gen, mode=mode).shard(index, total)) for index in range(total)]
+                    self.assertListEqual(sorted(v for shard in shards for v in shard), sorted(values))
+
+        calls = []
+
+        def _gen2():
+            a = yield FlatForker([1, 2])
+            b = yield FlatForker([1, 2, 3, 4])
+            calls.append((a, b))
+            return a, b
+
+        self.assertListEqual(list(GeneratorForker(_gen2, shard=(1, 4))), [(1, 3), (1, 4)])
+        self.assertListEqual(calls, [(1, 3), (1, 4)])
+
+
+class TestSample(unittest.TestCase):
+    def test_sample(self):
+        forkers = [
+            RangeForker(0, 100),
+            ContainerForker([FlatForker(range(10)), FlatForker(range(10)), FlatForker(range(10))]),
+            FlatForker(range(100)).filter_value(lambda v: v % 2 == 0),
+            ConcatForker((FlatForker([1]), _Counted(range(2, 100)))),
+        ]
+        for i, forker in enumerate(forkers):
+            with self.subTest(i=i):
+                values = list(forker)
+                sampled = list(forker.sample(10, seed=1))
+                self.assertEqual(len(sampled), 10)
+                self.assertEqual(len(set(map(repr, sampled))), 10)
+                self.assertListEqual(sampled, [v for v in values if v in sampled])
+                self.assertListEqual(list(forker.sample(10, seed=1)), sampled)
+                self.assertNotEqual(list(forker.sample(10, seed=2)), sampled)
+                self.assertListEqual(list(forker.sample(len(values) + 1, seed=1)), values)
+
+    def test_generator_sample(self):
+        calls = []
+
+        def _gen():
+            a = yield FlatForker(range(10))
+            b = yield FlatForker(range(10)) if a % 2 == 0 else FlatForker([])
+            c = yield FlatForker(range(5))
+            calls.append((a, b, c))
+            return a, b, c
+
+        sampled = list(GeneratorForker(_gen).sample(20, seed=1))
+        self.assertEqual(len(sampled), 20)
+        self.assertEqual(len(set(sampled)), 20)
+        self.assertListEqual(calls, sampled)
+        self.assertListEqual(list(GeneratorForker(_gen).sample(20, seed=1)), sampled)
+
+        all_values = sorted(GeneratorForker(_gen))
+        self.assertListEqual(sorted(GeneratorForker(_gen).sample(1000, seed=1)), all_values)
+
+
+class TestCoveringArray(unittest.TestCase):
+    def _assert_covered(self, rows, keys, values, strength):
+        for combination in itertools.combinations(keys, strength):
+            for expected in itertools.product(*[values[k] for k in combination]):
+                self.assertTrue(
+                    any(all(row[k] == v for k, v in zip(combination, expected)) for row in rows),
+                    f'{combination}={expected} not covered'
+                )
+
+    def test_pairwise(self):
+        values = {f'k{i}': [True, False] if i % 2 else [1, 2, 3] for i in range(10)}
+        forker = ContainerForker({k: FlatForker(v) for k, v in values.items()}, strength=2)
+        rows = list(forker)
+        self.assertLess(len(rows), 30)
+        self.assertEqual(forker.count(), len(rows))
+        self.assertListEqual([forker.nth(i) for i in range(len(rows))], rows)
+        self._assert_covered(rows, list(values.keys()), values, 2)
+
+        forker = ContainerForker({k: FlatForker(v) for k, v in values.items()}, strength=3)
+        self._assert_covered(list(forker), list(values.keys()), values, 3)
+
+    def test_list(self):
+        forker = ContainerForker([FlatForker([1, 2]), 3, FlatForker([4, 5]), FlatForker([6, 7])], strength=2)
+        rows = list(forker)
+        self.assertLessEqual(len(rows), 5)
+        self._assert_covered(rows, [0, 2, 3], {0: [1, 2], 2: [4, 5], 3: [6, 7]}, 2)
+        self.assertTrue(all(row[1] == 3 for row in rows))
+
+        forker = ContainerForker((FlatForker([1, 2]), FlatForker([4, 5])), strength=2)
+        self.assertListEqual(sorted(forker), sorted(ContainerForker((FlatForker([1, 2]), FlatForker([4, 5])))))
+
+        with self.assertRaises(ValueError):
+            list(ContainerForker([FlatForker([1, 2]), FlatForker([])], strength=2))
+
+    def test_random_access(self):
+        forks = []
+
+        class _CountingForker(FlatForker):
+            def do_fork(self, context):
+                forks.append(self)
+                return super().do_fork(context)
+
+        forker = ContainerForker({f'k{i}': _CountingForker([0, 1, 2, 3]) for i in range(12)}, strength=2)
+        rows = list(forker)
+        self.assertEqual(len(forks), 12)
+        # the rows are built once and the members are forked once for all the items decoded in a context
+        forks.clear()
+        self.assertListEqual(list(forker.shard(1, 2)), rows[len(rows) // 2:])
+        self.assertEqual(len(forks), 12)
+        forks.clear()
+        self.assertEqual(len(list(forker.sample(10, seed=1))), 10)
+        self.assertEqual(len(forks), 12)
+
+    def test_dict_empty_member(self):
+        forker = ContainerForker(OrderedDict([('a', FlatForker([])), ('b', FlatForker([2, 3]))]), strength=2)
+        self.assertListEqual(list(forker), [{'b': 2}, {'b': 3}])
+
+    def test_include(self):
+        bool_forker = FlatForker([True, False])
+        obj = {k: bool_forker for k in ['a', 'b', 'c', 'd']}
+        rows = list(ContainerForker(obj, strength=2, include=[{'a': False, 'b': False, 'c': False, 'd': False}]))
+        self.assertDictEqual(rows[0], {'a': False, 'b': False, 'c': False, 'd': False})
+        self._assert_covered(rows, ['a', 'b', 'c', 'd'], {k: [True, False] for k in obj}, 2)
+
+        rows = list(ContainerForker(obj, strength=2, include=[{'a': False, 'd': True}]))
+        self.assertFalse(rows[0]['a'])
+        self.assertTrue(rows[0]['d'])
+
+        with self.assertRaises(ValueError):
+            list(ContainerForker(obj, strength=2, include=[{'a': 'x'}]))
+        with self.assertRaises(ValueError):
+            ContainerForker(obj, include=[{'a': True}])
+
+    def test_context(self):
+        key, forker = FlatForker([1, 2, 3]).record()
+        items = list(ContainerForker([forker, FlatForker([4, 5])], strength=1).do_fork(ForkContext()))
+        self.assertEqual(len(items), 3)
+        for item in items:
+            self.assertEqual(item.get_var(key), item.value[0])
+
+
+class TestCachedForker(unittest.TestCase):
+    def test_cached(self):
+        calls = []
+
+        class _Forker(Forker[int]):
+            def do_fork(self, context: ForkContext) -> ForkResult[int]:
+                calls.append(1)
+                base = context.get_var('base', default=0)
+                return context.new_fork_result([base + 1, base + 2])
+
+        key, forker = _Forker().record(key='r')
+        forker = forker.cached(maxsize=2)
+        for base in [0, 0, 10, 0, 10, 0, 20, 0, 10]:
+            ctx = ForkContext(variables={'base': base, 'other': object()})
+            items = list(forker.do_fork(ctx))
+            self.assertListEqual([item.value for item in items], [base + 1, base + 2])
+            for item in items:
+                self.assertEqual(item.get_var('r'), item.value)
+                self.assertIs(item.get_var('other'), ctx.get_var('other'))
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(forker.hits, 5)
+        self.assertEqual(forker.misses, 4)
+
+    def test_cached_in_product(self):
+        calls = []
+
+        def _values():
+            calls.append(1)
+            return [1, 2, 3]
+
+        inner = FlatForker([None]).flat_map_value(lambda _: _values()).cached()
+        forker = ContainerForker([FlatForker(range(10)), inner])
+        self.assertEqual(len(list(forker)), 30)
+        self.assertEqual(len(calls), 1)
+
+    def test_not_cacheable(self):
+        calls = []
+
+        class _Forker(Forker[int]):
+            def do_fork(self, context: ForkContext) -> ForkResult[int]:
+                calls.append(1)
+                return context.new_fork_result([len(context.vars)])
+
+        forker = _Forker().cached()
+        self.assertListEqual(list(forker), [0])
+        self.assertListEqual(list(forker), [0])
+        self.assertEqual(len(calls), 2)
+
+
+class TestAsyncGeneratorExplorer(unittest.TestCase):
+    def test_explore(self):
+        running = []
+        max_running = []
+
+        async def _gen():
+            v1 = yield FlatForker([1, 2, 3])
+            v2 = yield FlatForker([10, 20]) if v1 < 3 else FlatForker([])
+            running.append(1)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+            yield v1 + v2
+
+        async def _collect(concurrency):
+            explorer = AsyncGeneratorExplorer(_gen, concurrency=concurrency)
+            return [leaf.value async for leaf in explorer.explore()]
+
+        self.assertListEqual(sorted(asyncio.run(_collect(None))), [11, 12, 21, 22])
+        self.assertEqual(max(max_running), 4)
+        max_running.clear()
+        self.assertListEqual(sorted(asyncio.run(_collect(2))), [11, 12, 21, 22])
+        self.assertEqual(max(max_running), 2)
+
+    def test_explore_error(self):
+        async def _gen():
+            v = yield FlatForker([1, 2, 3])
+            if v == 2:
+                raise KeyError('v2')
+
+        async def _collect():
+            return [leaf async for leaf in AsyncGeneratorExplorer(_gen).explore()]
+
+        with self.assertRaises(KeyError):
+            asyncio.run(_collect())
+
+        with self.assertRaises(ValueError):
+            AsyncGeneratorExplorer(_gen, concurrency=0)
@@ -1,3 +1,8 @@
+import asyncio
+import os
+import re
+import threading
+import time
 import unittest
 
 from arena.core.fork import *
@@ -32,3 +37,323 @@ class ForkTestDemo(unittest.TestCase):
         a = yield tk.pick_enum(DemoObj(1), DemoObj(2))
         b = yield tk.pick(a.next_two)
         self.assertIn(b - a.v, [1, 2])
+
+    @fork_test(mode='fork')
+    def test_add_func_fork_mode(self):
+        tk = testkit()
+        a = yield tk.pick(RangeForker(0, 10))
+        b = yield tk.pick_range(0, 10)
+        self.assertEqual(add_func(a, b), a + b)
+
+
+class ForkModeReportTest(unittest.TestCase):
+    def test_report_failures(self):
+        class _Test(unittest.TestCase):
+            @fork_test(mode='fork')
+            def test_fail(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 4)
+                tk.log_path('pick', f'a={a}')
+                self.assertNotEqual(a, 2)
+                if a == 3:
+                    raise KeyError('a is 3')
+
+        result = unittest.TestResult()
+        _Test('test_fail').run(result)
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn('[3]', result.failures[0][1])
+        self.assertIn('a=2', result.failures[0][1])
+        self.assertIn('[4]', result.errors[0][1])
+
+
+class ShardTest(unittest.TestCase):
+    def test_shard(self):
+        values = []
+
+        class _Test(unittest.TestCase):
+            @fork_test(shard=(1, 3))
+            def test_shard(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 3)
+                b = yield tk.pick_range(0, 3)
+                values.append((a, b))
+
+        result = unittest.TestResult()
+        _Test('test_shard').run(result)
+        self.assertTrue(result.wasSuccessful())
+        self.assertListEqual(values, [(1, 0), (1, 1), (1, 2)])
+
+    def test_shard_env(self):
+        values = []
+
+        class _Test(unittest.TestCase):
+            @fork_test
+            def test_shard(self):
+                tk = testkit()
+                values.append((yield tk.pick_range(0, 4)))
+
+        os.environ[SHARD_ENV] = '0/2'
+        try:
+            _Test('test_shard').run(unittest.TestResult())
+        finally:
+            del os.environ[SHARD_ENV]
+        self.assertListEqual(values, [0, 1])
+
+
+@unittest.skipUnless(GeneratorForker.fork_supported(), 'os.fork is not supported')
+class WorkersTest(unittest.TestCase):
+    def test_workers(self):
+        class _Test(unittest.TestCase):
+            @fork_test(workers=3)
+            def test_workers(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 3)
+                b = yield tk.pick_range(0, 3)
+                tk.log_path('PICK', f'{a} {b}')
+                self.assertNotEqual(a, 1, unique_name(f'tbl_{a}_{b}'))
+
+        result = unittest.TestResult()
+        _Test('test_workers').run(result)
+        self.assertEqual(result.testsRun, 1)
+        self.assertEqual(len(result.failures), 3)
+        msgs = sorted(msg for _, msg in result.failures)
+        for b, msg in enumerate(msgs):
+            self.assertIn(f'tbl_1_{b}_w1', msg)
+            self.assertIn(f'[PICK] 1 {b}', msg)
+        self.assertSetEqual({test._message for test, _ in result.failures}, {f'[w1-{i}]' for i in (1, 2, 3)})
+        self.assertIsNone(worker_id())
+
+    def test_workers_failfast(self):
+        class _Test(unittest.TestCase):
+            @fork_test(workers=2)
+            def test_workers(self):
+                tk = testkit()
+                yield tk.pick_range(0, 100)
+                self.fail('failed')
+
+        result = unittest.TestResult()
+        result.failfast = True
+        _Test('test_workers').run(result)
+        self.assertEqual(len(result.failures), 1)
+
+    def test_workers_shard(self):
+        class _Test(unittest.TestCase):
+            @fork_test(workers=2, shard=(1, 2))
+            def test_workers(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 8)
+                self.fail(f'value={a}')
+
+        result = unittest.TestResult()
+        _Test('test_workers').run(result)
+        values = sorted(int(re.search(r'value=(\d+)', msg).group(1)) for _, msg in result.failures)
+        self.assertListEqual(values, [4, 5, 6, 7])
+
+    def test_workers_fork_mode(self):
+        class _Test(unittest.TestCase):
+            @fork_test(workers=2, mode='fork')
+            def test_workers(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 6)
+                # the last branch of a worker runs in the worker itself, after the outcomes of the others are sent
+                self.fail(f'value={a} threads={threading.active_count()}')
+
+        result = unittest.TestResult()
+        _Test('test_workers').run(result)
+        values = sorted(int(re.search(r'value=(\d+)', msg).group(1)) for _, msg in result.failures)
+        self.assertListEqual(values, list(range(6)))
+        for _, msg in result.failures:
+            self.assertIn('threads=1', msg)
+
+
+class ThreadsTest(unittest.TestCase):
+    def test_threads(self):
+        testkits = set()
+
+        class _Test(unittest.TestCase):
+            @fork_test(threads=3)
+            def test_threads(self):
+                tk = testkit()
+                testkits.add(id(tk))
+                a = yield tk.pick_range(0, 3)
+                b = yield tk.pick_range(0, 3)
+                tk.log_path('PICK', f'{a} {b}')
+                self.assertNotEqual(a, 1, unique_name(f'tbl_{a}_{b}'))
+
+        result = unittest.TestResult()
+        _Test('test_threads').run(result)
+        self.assertEqual(result.testsRun, 1)
+        self.assertEqual(len(result.failures), 3)
+        msgs = sorted(msg for _, msg in result.failures)
+        for b, msg in enumerate(msgs):
+            self.assertIn(f'tbl_1_{b}_w1', msg)
+            self.assertIn(f'[PICK] 1 {b}', msg)
+        self.assertSetEqual({test._message for test, _ in result.failures}, {f'[t1-{i}]' for i in (1, 2, 3)})
+        self.assertGreater(len(testkits), 1)
+        self.assertIsNone(worker_id())
+
+    def test_threads_failfast(self):
+        values = []
+
+        class _Test(unittest.TestCase):
+            @fork_test(threads=2)
+            def test_threads(self):
+                tk = testkit()
+                values.append((yield tk.pick_range(0, 1000)))
+                # gives the runner the time to stop the threads before they run out of branches
+                time.sleep(0.001)
+                self.fail('failed')
+
+        result = unittest.TestResult()
+        result.failfast = True
+        _Test('test_threads').run(result)
+        self.assertEqual(len(result.failures), 1)
+        self.assertLess(len(values), 1000)
+
+    def test_threads_invalid(self):
+        with self.assertRaises(ValueError):
+            fork_test(threads=2, workers=2)
+        with self.assertRaises(ValueError):
+            fork_test(threads=0)
+
+
+class SharedStateTest(unittest.TestCase):
+    def test_shared_state(self):
+        shared = []
+        picks = []
+        closed = []
+
+        class _Test(unittest.TestCase):
+            @fork_test
+            def test_replay(self):
+                tk = testkit()
+                if 'branches' not in tk.shared.state:
+                    tk.shared.state['branches'] = 0
+                    tk.shared.defer(lambda: closed.append(tk.shared.state['branches']))
+                tk.shared.state['branches'] += 1
+                shared.append((tk.sequential, id(tk.shared)))
+                tk.add_pick_listener(lambda index, value: picks.append((index, value)))
+                a = yield tk.pick_range(0, 2)
+                b = yield tk.pick_range(0, 2)
+                self.assertEqual([a, b], tk.picks)
+
+            @fork_test(mode='fork')
+            def test_fork(self):
+                tk = testkit()
+                yield tk.pick_range(0, 2)
+                self.assertFalse(tk.sequential)
+
+        result = unittest.TestResult()
+        _Test('test_replay').run(result)
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(len(shared), 4)
+        self.assertEqual(len(set(shared)), 1)
+        self.assertTrue(shared[0][0])
+        self.assertListEqual(picks, [(0, 0), (1, 0), (0, 0), (1, 1), (0, 1), (1, 0), (0, 1), (1, 1)])
+        self.assertListEqual(closed, [4])
+
+        result = unittest.TestResult()
+        _Test('test_fork').run(result)
+        self.assertTrue(result.wasSuccessful())
+
+    def test_drive_forwards_throw_and_close(self):
+        events = []
+
+        def _case():
+            try:
+                a = yield 'first'
+                try:
+                    yield 'second'
+                except ValueError as e:
+                    events.append(('caught', str(e)))
+                    yield 'after throw'
+                events.append(('picked', a))
+            finally:
+                events.append('finally')
+
+        tk = TestKit('test', ut=self)
+        driven = tk.drive(_case())
+        self.assertEqual(next(driven), 'first')
+        self.assertEqual(driven.send(1), 'second')
+        self.assertEqual(driven.throw(ValueError('aborted')), 'after throw')
+        driven.close()
+        self.assertListEqual(events, [('caught', 'aborted'), 'finally'])
+        # the thrown exception is not a pick
+        self.assertListEqual(tk.picks, [1])
+
+        events.clear()
+        driven = tk.drive(_case())
+        next(driven)
+        with self.assertRaises(KeyError):
+            driven.throw(KeyError('unhandled'))
+        self.assertListEqual(events, ['finally'])
+
+    def test_async_closes_shared_state(self):
+        closed = []
+
+        class _Test(unittest.TestCase):
+            @async_fork_test
+            async def test_async(self):
+                tk = testkit()
+                tk.shared.defer(lambda: closed.append(tk.shared))
+                yield tk.pick_range(0, 3)
+
+        result = unittest.TestResult()
+        _Test('test_async').run(result)
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(len(closed), 3)
+        self.assertEqual(len(set(map(id, closed))), 3)
+
+
+class SampleTest(unittest.TestCase):
+    def test_sample(self):
+        values = []
+
+        class _Test(unittest.TestCase):
+            @fork_test(sample=5, seed=3)
+            def test_sample(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 10)
+                b = yield tk.pick_range(0, 10)
+                values.append((a, b))
+
+        _Test('test_sample').run(unittest.TestResult())
+        self.assertEqual(len(set(values)), 5)
+        first = values.copy()
+        values.clear()
+        _Test('test_sample').run(unittest.TestResult())
+        self.assertListEqual(values, first)
+
+        with self.assertRaises(ValueError):
+            fork_test(sample=5, mode='fork')
+
+
+class AsyncForkTest(unittest.TestCase):
+    def test_async_fork_test(self):
+        closed = []
+
+        async def _close(a, b):
+            await asyncio.sleep(0)
+            closed.append((a, b))
+
+        class _Test(unittest.TestCase):
+            @async_fork_test(concurrency=4)
+            async def test_async(self):
+                tk = testkit()
+                a = yield tk.pick_range(0, 3)
+                b = yield tk.pick_range(0, 3)
+                tk.defer(_close, a, b)
+                await asyncio.sleep(0.01)
+                self.assertIs(testkit(), tk)
+                tk.log_path('PICK', f'{a} {b}')
+                self.assertNotEqual(a, 1)
+
+        result = unittest.TestResult()
+        _Test('test_async').run(result)
+        self.assertEqual(len(result.failures), 3)
+        msgs = sorted(msg for _, msg in result.failures)
+        for b, msg in enumerate(msgs):
+            self.assertIn(f'[PICK] 1 {b}', msg)
+        self.assertEqual(len(closed), 9)
+        self.assertIsNone(testkit())
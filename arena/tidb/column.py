@@ -115,5 +115,8 @@ class TableColumnsForker(Forker[TableColumns]):
             ]),
         ]).do_fork(context)
 
+    def estimate(self) -> ForkSize:
+        return ForkSize.exact(2)
+
     def __str__(self):
         return "TableColumnsForker"
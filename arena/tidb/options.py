@@ -30,3 +30,8 @@ class TemporaryTableTypeForker(Forker[TemporaryTableType]):
             return result
 
         return result.filter_value(lambda tp: tp is None or tp.points <= self._max_points)
+
+    def estimate(self) -> ForkSize:
+        if self._max_points is None:
+            return ForkSize.exact(len(self.TYPES))
+        return ForkSize.exact(len([tp for tp in self.TYPES if tp is None or tp.points <= self._max_points]))
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import os
+import threading
+
+import mysql.connector
+from mysql.connector import MySQLConnection
+
+__all__ = ['ConnectionPool', 'connection_pool']
+
+
+class ConnectionPool:
+    """
+    Keeps the connections closed by the branches, keyed by (host, port, user, database, options), and hands them out
+    again instead of opening new ones. A returned connection gets its session reset with COM_RESET_CONNECTION, or by
+    re-authenticating with COM_CHANGE_USER when the server does not support it, which rolls back the open transaction,
+    deallocates the prepared statements, clears the user variables and restores the session variables such as
+    `autocommit`, `tx_isolation`, `tx_read_ts` and `tidb_read_staleness` to their global values. A connection that
+    cannot be reset is closed. The pool is safe to share between threads and drops the connections inherited by a
+    forked process without closing them, because their sockets still belong to the parent.
+    """
+
+    def __init__(self, *, max_idle=8):
+        self._max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, *, host, port, database, user, password, **kwargs) -> MySQLConnection:
+        key = self.key(host=host, port=port, database=database, user=user, password=password, **kwargs)
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.get(key)
+            if idle:
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+
+        return mysql.connector.connect(host=host, port=port, database=database, user=user, password=password, **kwargs)
+
+    def release(self, key, conn: MySQLConnection):
+        try:
+            self._reset(conn, user=key[2], password=key[4], database=key[3])
+        except mysql.connector.Error:
+            conn.close()
+            return
+
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            self._check_pid()
+            idle = self._idle
+            self._idle = {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    @staticmethod
+    def key(*, host, port, database, user, password, **kwargs):
+        return host, port, user, database, password, tuple(sorted(kwargs.items()))
+
+    @staticmethod
+    def _reset(conn: MySQLConnection, *, user, password, database):
+        conn.consume_results()
+        if not conn.cmd_reset_connection():
+            conn.cmd_change_user(username=user or '', password=password or '', database=database or '')
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = {}
+
+
+_pool = ConnectionPool()
+
+
+def connection_pool() -> ConnectionPool:
+    """
+    :return: the pool used by `TidbTestKit.connect(pooled=True)`
+    """
+    return _pool
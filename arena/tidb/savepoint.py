@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import re
+
+import mysql.connector
+from mysql.connector import MySQLConnection
+
+from arena.core.testkit import TestKit
+
+__all__ = ['SavepointSession']
+
+_DATA_ONLY = re.compile(r'\s*(select|insert|update|delete|replace|do)\b', re.IGNORECASE)
+# the statements that behave differently inside an explicit transaction
+_TXN_SENSITIVE = re.compile(r'@@|\bas\s+of\s+timestamp\b|\btidb_bounded_staleness\b', re.IGNORECASE)
+
+
+def is_data_only(sql):
+    """
+    :return: whether `sql` only reads or changes rows, so it can be undone by rolling back to a savepoint
+    """
+    return bool(_DATA_ONLY.match(sql)) and not _TXN_SENSITIVE.search(sql)
+
+
+class SavepointSession:
+    """
+    One connection kept open across the branches that a runner executes one after another, see `TestKit.sequential`.
+    Everything the branches execute on it runs in a single transaction that is never committed, and a savepoint is
+    set at every pick that follows a statement. The statements of a branch are recorded with their rows, grouped by the
+    picks they follow. While the next branch makes the same picks and executes the same statements as the previous
+    one, the generator replays the shared prefix and its statements are answered from the record without touching the
+    server. At the first difference the session rolls back to the savepoint of the last shared pick, so the rows of the
+    prefix are neither inserted again nor cleaned up by the branch.
+
+    The session only holds while the branches change data. The first statement that is not data-only, such as DDL,
+    `set`, `commit` or a stale read, as well as a failed statement, a multi-statement or a second connection in the
+    same branch, turns it off: the transaction is rolled back, the statements of the branch so far are executed again
+    on the plain connection and the following branches get plain connections.
+    """
+
+    def __init__(self, conn: MySQLConnection, *, key):
+        self._conn = conn
+        self.key = key
+        self.active = True
+        self.reused = 0
+        self.rollbacks = 0
+        self.savepoints = 0
+
+        # the picks and the recorded statements of the previous branch
+        self._prev_picks = []
+        self._prev_segments = [[]]
+        # the savepoint restoring the state before the statements after the n-th pick, None for the start
+        self._savepoint_names = [None]
+
+        self._tk = None
+        self._conn_id = None
+        self._segments = [[]]
+        self._pos = 0
+        self._in_sync = False
+        self._in_branch = False
+        self._branches = 0
+        self._closed = False
+        self._execute_raw('begin pessimistic')
+
+    @property
+    def conn(self) -> MySQLConnection:
+        return self._conn
+
+    @property
+    def in_branch(self):
+        return self._in_branch
+
+    def begin_branch(self, tk: TestKit, conn_id):
+        self._tk = tk
+        self._conn_id = conn_id
+        self._segments = [[]]
+        self._pos = 0
+        self._in_sync = self._branches > 0
+        self._in_branch = True
+        for i, value in enumerate(tk.picks):
+            self._on_pick(i, value)
+        tk.add_pick_listener(self._on_pick)
+
+    def end_branch(self, _conn=None):
+        """
+        Called when the connection of the branch is closed, the connection stays open for the next branch
+        """
+        self._in_branch = False
+        if not self.active:
+            self.close()
+            return
+
+        depth = len(self._segments) - 1
+        if self._in_sync and (self._pos < len(self._prev_segments[depth])
+                              or any(self._prev_segments[depth + 1:])):
+            # the server is still at the end of the previous branch, which went further than this one
+            self._diverge(depth)
+        self._prev_picks = list(self._tk.picks[:depth])
+        self._prev_segments = self._segments
+        self._branches += 1
+
+    def execute(self, sql, *, params=(), prepared=False, msg=None):
+        """
+        Executes a statement of the branch, from the record when it is part of the prefix shared with the previous
+        branch
+
+        :return: the rows, or None when the statement returns no result set
+        """
+        if not self.active:
+            raise RuntimeError('savepoint session is not active')
+
+        if not is_data_only(sql):
+            self.fallback(f'not a data-only statement: {sql}')
+            return self._execute_plain((sql, tuple(params), prepared), msg or sql)
+
+        key = (sql, tuple(params), prepared)
+        depth = len(self._segments) - 1
+        if self._in_sync:
+            prev = self._prev_segments[depth]
+            if self._pos < len(prev) and prev[self._pos][0] == key:
+                rows = prev[self._pos][1]
+                self._segments[depth].append((key, rows))
+                self._pos += 1
+                self.reused += 1
+                self._tk.log_path(f'sql@conn#{self._conn_id}', f'{msg or sql} [savepoint=reused]')
+                return None if rows is None else list(rows)
+            self._diverge(depth)
+
+        self._tk.log_path(f'sql@conn#{self._conn_id}', msg or sql)
+        try:
+            rows = self._execute_key(key)
+        except mysql.connector.Error as e:
+            self.fallback(f'statement failed: {e}')
+            return self._execute_plain(key, msg or sql)
+
+        self._segments[depth].append((key, None if rows is None else tuple(rows)))
+        self._pos += 1
+        return rows
+
+    def fallback(self, reason):
+        """
+        Turns the session off, the rows of the branch so far are committed again on the plain connection
+        """
+        if not self.active:
+            return
+
+        self.active = False
+        statements = [key for segment in self._segments for key, _ in segment]
+        self._tk.log_path(f'sql@conn#{self._conn_id}',
+                          f'savepoint session off, {reason}, executing the {len(statements)} statements again')
+        self._execute_raw('rollback')
+        for key in statements:
+            self._execute_key(key)
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        try:
+            if self.active:
+                self._execute_raw('rollback')
+        finally:
+            self._conn.close()
+
+    def _on_pick(self, index, value):
+        if not self.active:
+            return
+
+        depth = len(self._segments) - 1
+        assert depth == index, f'pick #{index} at depth {depth}'
+        if self._in_sync:
+            if index < len(self._prev_picks) and self._pos == len(self._prev_segments[depth]):
+                if self._prev_picks[index] != value:
+                    # the statements before the pick are all shared, its savepoint is the state to go back to
+                    self._rollback_to(depth + 1)
+                self._segments.append([])
+                self._pos = 0
+                return
+
+            if index >= len(self._prev_picks) and self._pos == len(self._prev_segments[depth]):
+                # the previous branch ended here, the server is already at the state of this one
+                self._in_sync = False
+            else:
+                self._diverge(depth)
+
+        if self._segments[depth]:
+            name = f'arena_sp{depth + 1}'
+            self._execute_raw(f'savepoint {name}')
+            self.savepoints += 1
+        else:
+            name = self._savepoint_names[depth]
+        self._savepoint_names.append(name)
+        self._segments.append([])
+        self._pos = 0
+
+    def _diverge(self, depth):
+        """
+        Brings the server from the end of the previous branch back to the position of this one
+        """
+        self._rollback_to(depth)
+        for key, _ in self._segments[depth][:self._pos]:
+            self._execute_key(key)
+
+    def _rollback_to(self, depth):
+        name = self._savepoint_names[depth]
+        if name is None:
+            self._execute_raw('rollback')
+            self._execute_raw('begin pessimistic')
+        else:
+            self._execute_raw(f'rollback to savepoint {name}')
+        self.rollbacks += 1
+        del self._savepoint_names[depth + 1:]
+        self._in_sync = False
+        self._tk.log_path(f'sql@conn#{self._conn_id}', f'rollback to savepoint {name or "of the start"}')
+
+    def _execute_plain(self, key, msg):
+        self._tk.log_path(f'sql@conn#{self._conn_id}', msg)
+        return self._execute_key(key)
+
+    def _execute_key(self, key):
+        sql, params, prepared = key
+        with self._conn.cursor(prepared=prepared) as cur:
+            cur.execute(sql, params=params)
+            if cur.with_rows:
+                return cur.fetchall()
+            return None
+
+    def _execute_raw(self, sql):
+        with self._conn.cursor() as cur:
+            cur.execute(sql)
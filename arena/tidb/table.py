@@ -1,10 +1,17 @@
 from __future__ import annotations
 
 import io
+import os
+import re
+import threading
+import time
 
 from typing import Optional
 
+import mysql.connector
+
 from arena.core.fork import *
+from arena.core.testkit import testkit, unique_name
 from .column import TableColumnsForker, TableColumns
 from .options import TemporaryTableType, TemporaryTableTypeForker
 from .util import AutoIDAllocator, name_generator
@@ -55,6 +62,164 @@ class Table:
             w.write(self.temp_type.commit)
         return w.getvalue()
 
+    def renamed(self, name) -> Table:
+        return Table(name, columns=self._columns, temp_type=self._temp_type)
+
+    @property
+    def schema_key(self):
+        """
+        The normalized create statement without the table name, equal for the tables that only differ by name
+        """
+        return self.renamed('').normalized_sql_create
+
+
+class TablePool:
+    """
+    Creates the tables of every distinct schema once per worker and hands them out again, emptied, instead of running
+    `DROP TABLE` and `CREATE TABLE` in every branch. A returned table is emptied with DELETE, or TRUNCATE when it has an
+    auto increment column so the ids start again, after rolling back the transaction the branch may have left open. It
+    is dropped instead when it is not empty afterwards, or when its `SHOW CREATE TABLE` no longer matches the one it
+    was created with, because the branch altered it. Local temporary tables only live in their session, so they are
+    always created and dropped. `ddl_time_saved` sums the estimated seconds of DDL saved by the reused tables, which
+    are also logged in the path of the branch.
+    """
+
+    _AUTO_INCREMENT = re.compile(r'\s*AUTO_INCREMENT=\d+')
+
+    class _Entry:
+        def __init__(self, key, table: Table, show_create, create_cost):
+            self.key = key
+            self.table = table
+            self.show_create = show_create
+            self.create_cost = create_cost
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._entries = {}
+        self._pid = os.getpid()
+        self._ids = AutoIDAllocator()
+        self.hits = 0
+        self.misses = 0
+        self.ddl_time_saved = 0.0
+
+    def acquire(self, conn, table: Table, *, database='test') -> Table:
+        """
+        :return: a table with the schema of `table` under another name, which should be given back with `release`
+        """
+        key = self._key(conn, table, database)
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.get(key) if key else None
+            entry = idle.pop() if idle else None
+            if entry:
+                self.hits += 1
+                self.ddl_time_saved += entry.create_cost
+            elif key:
+                self.misses += 1
+
+        if entry:
+            self._log(f'reuse {self._qualified(database, entry.table)}, '
+                      f'~{entry.create_cost * 1000:.0f}ms of DDL saved')
+            return entry.table
+
+        pooled = table.renamed(unique_name(f'tbl_pool_{self._ids.alloc()}'))
+        name = self._qualified(database, pooled)
+        start = time.perf_counter()
+        conn.exec_batch([
+            f'drop table if exists {name}',
+            pooled.sql_create.replace(f'`{pooled.name}`', name, 1),
+        ])
+        create_cost = time.perf_counter() - start
+        if key:
+            entry = self._Entry(key, pooled, self._show_create(conn, name), create_cost)
+            with self._lock:
+                self._entries[pooled.name] = entry
+        return pooled
+
+    def release(self, conn, table: Table, *, database='test'):
+        name = self._qualified(database, table)
+        with self._lock:
+            self._check_pid()
+            entry = self._entries.get(table.name)
+
+        try:
+            altered = entry is None or self._show_create(conn, name) != entry.show_create
+        except mysql.connector.Error:
+            altered = True
+
+        if altered:
+            with self._lock:
+                self._entries.pop(table.name, None)
+            conn.exec_sql(f'drop table if exists {name}')
+            return
+
+        # a failed branch may leave a transaction open or autocommit off, which would roll the DELETE back later
+        conn.exec_sql('rollback')
+        conn.exec_sql('set autocommit = 1')
+        auto_inc = any(c.auto_inc for c in table.columns.columns)
+        conn.exec_sql(f'truncate table {name}' if auto_inc else f'delete from {name}')
+        if conn.query(f'select 1 from {name} limit 1').rows:
+            with self._lock:
+                self._entries.pop(table.name, None)
+            conn.exec_sql(f'drop table if exists {name}')
+            return
+
+        with self._lock:
+            if self._entries.get(table.name) is entry:
+                self._idle.setdefault(entry.key, []).append(entry)
+
+    def clear(self, conn, *, database='test'):
+        """
+        Drops the idle tables in `database` of the server of `conn`, `TidbConnection.create_table` calls it when the
+        runner of the branches ends
+        """
+        with self._lock:
+            self._check_pid()
+            cleared = []
+            for key in [key for key in self._idle if key[:2] == (conn.server, database)]:
+                for entry in self._idle.pop(key):
+                    self._entries.pop(entry.table.name, None)
+                    cleared.append(entry)
+
+        for entry in cleared:
+            conn.exec_sql(f'drop table if exists {self._qualified(database, entry.table)}')
+
+    def _key(self, conn, table: Table, database):
+        if table.temp_type and table.temp_type.type == 'TEMPORARY':
+            return None
+        return conn.server, database, table.schema_key
+
+    def _show_create(self, conn, name):
+        return self._AUTO_INCREMENT.sub('', conn.query(f'show create table {name}').rows[0][1])
+
+    def _check_pid(self):
+        # the tables inherited by a forked worker may be handed out by its siblings too
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = {}
+            self._entries = {}
+
+    @staticmethod
+    def _qualified(database, table: Table):
+        return f'`{database}`.`{table.name}`'
+
+    @staticmethod
+    def _log(msg):
+        tk = testkit()
+        if tk:
+            tk.log_path('table_pool', msg)
+
+
+_table_pool = TablePool()
+
+
+def table_pool() -> TablePool:
+    """
+    :return: the pool used by `TidbConnection.create_table(pooled=True)`
+    """
+    return _table_pool
+
 
 class TableBuilder(Forker):
     def __init__(self, *, forkers=None, max_points=None):
@@ -1,39 +1,217 @@
 from __future__ import annotations
 
-import mysql.connector
+import collections
+import collections.abc
+import functools
+import hashlib
+import re
+import time
 import typing
+
+import mysql.connector
 from mysql.connector import MySQLConnection
 from mysql.connector.cursor import MySQLCursorPrepared
+from mysql.connector.errors import get_mysql_exception
 
-from arena.core.testkit import TestKit, testkit, fork_test
+from arena.core.testkit import TestKit, testkit, fork_test, async_fork_test
+from arena.tidb.pool import ConnectionPool, connection_pool
+from arena.tidb.savepoint import SavepointSession, is_data_only
+from arena.tidb.table import Table, TablePool, table_pool
 
-__all__ = ['tidb_testkit', 'ResultSet', 'TidbConnection', 'PreparedStmt', 'fork_test']
+__all__ = ['tidb_testkit', 'ResultSet', 'TidbConnection', 'PreparedStmt', 'PreparedStmtCache', 'AsyncTidbConnection',
+           'AsyncPreparedStmt', 'ConnectionPool', 'connection_pool', 'TablePool', 'table_pool', 'SavepointSession',
+           'fork_test', 'async_fork_test']
 
 
 class ResultSet:
-    def __init__(self, tk: TestKit, *, rows=None):
+    """
+    The rows of a query. A streamed result set, see `TidbConnection.query(stream=True)`, holds the open cursor and
+    fetches the rows `batch_size` at a time while it is iterated, it can be iterated only once and no other statement
+    can be executed on the connection before. `rows` and `check` fetch all the rows, `check_unordered` does not.
+    """
+
+    def __init__(self, tk: TestKit, *, rows=None, cursor=None, batch_size=1000, requery=None):
         self._tk = tk
         self._rows = rows
+        self._cursor = cursor
+        # fetchmany(1) of the C extension returns the same row again and again
+        self._batch_size = max(batch_size, 2)
+        self._requery = requery
+        self._consumed = False
 
     def check(self, rows):
         self._tk.log_path('rs.check', f'expected: {rows}')
         ut = self._tk.ut
-        ut.assertListEqual(self._rows, rows)
+        ut.assertListEqual(self.rows, rows)
+
+    def check_unordered(self, rows, *, max_diff=10):
+        """
+        Checks the rows in any order, the actual and the expected rows are compared by their count and a multiset
+        hash computed while they are iterated, so neither side is held in memory. Values of different types, such as 1
+        and 1.0, differ. Only on a mismatch the rows are counted to report at most `max_diff` missing and unexpected
+        rows, for a streamed result set this executes the query again.
+
+        :param rows: the expected rows, any iterable, it is iterated again on a mismatch when it is a sequence
+        """
+        self._tk.log_path('rs.check_unordered', f'expected: {_brief(rows)}')
+        actual = _MultisetHash()
+        for row in self:
+            actual.add(row)
+        expected = _MultisetHash()
+        for row in rows:
+            expected.add(row)
+
+        if actual == expected:
+            return
+
+        msg = f'rows differ in any order, actual: {actual.count} rows, expected: {expected.count} rows'
+        diff = self._diff(rows, max_diff=max_diff)
+        if diff:
+            msg += '\n' + diff
+        self._tk.ut.fail(msg)
 
     @property
     def rows(self):
+        if self._rows is None and self._cursor is not None:
+            self._rows = list(self)
         return self._rows
 
     def print(self):
-        print(self._rows)
+        print(self.rows)
+
+    def __iter__(self):
+        if self._cursor is None or self._rows is not None:
+            yield from self._rows or ()
+            return
+
+        if self._consumed:
+            raise RuntimeError('the rows of a streamed result set can only be iterated once')
+        self._consumed = True
+        done = False
+        try:
+            while True:
+                batch = self._cursor.fetchmany(self._batch_size)
+                if not batch:
+                    done = True
+                    break
+                yield from batch
+        finally:
+            # the connection cannot execute anything before the rows left by a stopped iteration are read
+            while not done and self._cursor.fetchmany(self._batch_size):
+                pass
+            self._cursor.close()
+
+    def _diff(self, expected, *, max_diff):
+        if not isinstance(expected, collections.abc.Sequence):
+            return None
+
+        if self._rows is not None or self._cursor is None:
+            actual = self._rows or ()
+        elif self._requery:
+            self._tk.log_path('rs.check_unordered', 'rows differ, query again to report the difference')
+            actual = self._requery()
+        else:
+            return None
+
+        counter = collections.Counter(_row_key(row) for row in expected)
+        counter.subtract(_row_key(row) for row in actual)
+        missing = [tuple(v for _, v in key) for key, n in counter.items() if n > 0 for _ in range(n)]
+        unexpected = [tuple(v for _, v in key) for key, n in counter.items() if n < 0 for _ in range(-n)]
+        lines = []
+        for title, diff_rows in (('missing', missing), ('unexpected', unexpected)):
+            if diff_rows:
+                more = f' ... and {len(diff_rows) - max_diff} more' if len(diff_rows) > max_diff else ''
+                lines.append(f'{title}: {diff_rows[:max_diff]}{more}')
+        return '\n'.join(lines)
+
+
+class _MultisetHash:
+    """
+    A hash of a multiset of rows that does not depend on their order, the sum of the digests of the rows. The digest is
+    computed from the type and the `repr` of every value rather than `hash()`, under which -1 equals -2 and 1 equals
+    1.0 and True.
+    """
+
+    _MASK = (1 << 64) - 1
+
+    def __init__(self):
+        self.count = 0
+        self._sum = 0
+
+    def add(self, row):
+        digest = hashlib.blake2b(repr(_row_key(row)).encode(), digest_size=8).digest()
+        self._sum = (self._sum + int.from_bytes(digest, 'little')) & self._MASK
+        self.count += 1
+
+    def __eq__(self, other):
+        return self.count == other.count and self._sum == other._sum
+
+
+def _row_key(row):
+    """
+    :return: the values of `row` tagged with their types, so that 1, 1.0 and True are different rows
+    """
+    return tuple((type(v).__name__, v) for v in row)
+
+
+def _brief(rows, limit=10):
+    if not isinstance(rows, collections.abc.Sequence):
+        return f'<{type(rows).__name__}>'
+    if len(rows) > limit:
+        return f'{list(rows[:limit])} ... ({len(rows)} rows)'
+    return str(rows)
+
+
+_DDL = re.compile(r'(^|;)\s*(create|alter|drop|truncate|rename)\s', re.IGNORECASE)
+
+
+class PreparedStmtCache:
+    """
+    An LRU cache of the prepared cursors of a connection keyed by the SQL text. A prepared cursor only reuses its
+    server side statement when it executes the very string object it was prepared with, so the cache hands that string
+    back together with the cursor.
+    """
+
+    def __init__(self, *, capacity=32):
+        self._capacity = capacity
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql) -> typing.Optional[typing.Tuple[str, MySQLCursorPrepared]]:
+        entry = self._entries.get(sql)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(sql)
+        return entry
+
+    def put(self, sql, cursor: MySQLCursorPrepared):
+        self._entries[sql] = (sql, cursor)
+        self._entries.move_to_end(sql)
+        while len(self._entries) > self._capacity:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            evicted.close()
+
+    def clear(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for _, cursor in entries:
+            cursor.close()
+
+    def __len__(self):
+        return len(self._entries)
 
 
 class PreparedStmt:
-    def __init__(self, tk, stmt, cursor, conn_id):
+    def __init__(self, tk, stmt, cursor, conn_id, *, cached=False):
         self._tk = tk
         self._stmt = stmt
         self._cursor: MySQLCursorPrepared = cursor
         self._conn_id = conn_id
+        self._cached = cached
 
     def execute(self, *, params=(), multi=False, fetch_rs=False):
         self._tk.log_path(f'exe@conn#{self._conn_id}', self._stmt)
@@ -45,7 +223,9 @@ class PreparedStmt:
         return self.execute(*args, **kwargs, fetch_rs=True)
 
     def close(self):
-        self._cursor.close()
+        # the cursor of a cached statement belongs to the cache of the connection
+        if not self._cached:
+            self._cursor.close()
 
     def __enter__(self):
         return self
@@ -55,28 +235,83 @@ class PreparedStmt:
 
 
 class TidbConnection:
-    def __init__(self, tk: TestKit, *, conn=None, conn_id=None):
+    def __init__(self, tk: TestKit, *, conn=None, conn_id=None, release=None, stmt_cache_size=32,
+                 session: SavepointSession = None, key=None):
         self._tk = tk
         self._conn: MySQLConnection = conn
         self._conn_id = conn_id
+        self._key = key
+        self._release = release
+        self._stmt_cache = PreparedStmtCache(capacity=stmt_cache_size)
+        self._session = session
+
+    @property
+    def server(self):
+        """
+        :return: (host, port) of the server
+        """
+        return self._conn.server_host, self._conn.server_port
+
+    @property
+    def stmt_cache(self) -> PreparedStmtCache:
+        """
+        The prepared statements of `prepare` and `exec_sql(prepared=True)` keyed by their SQL text. It is cleared by
+        DDL statements, which may change the schema the statements were prepared on, and when the connection is closed
+        or given back to the pool, whose session reset deallocates them.
+        """
+        return self._stmt_cache
+
+    @property
+    def session(self) -> typing.Optional[SavepointSession]:
+        """
+        The savepoint session the statements go through, see `TidbTestKit.connect(savepoint=...)`
+        """
+        return self._session
+
+    def exec_sql(self, sql, *, params=(), multi=False, fetch_rs=False, prepared=False, cached=True, stream=False,
+                 batch_size=1000):
+        """
+        :param cached: when `prepared` is set, reuse the statement prepared for the same SQL text on this connection
+                       if any, set it to False to always send a new PREPARE
+        :param stream: with `fetch_rs`, return a `ResultSet` that fetches the rows `batch_size` at a time while it is
+                       iterated instead of fetching them all at once, for the large scans
+        """
+        if multi and prepared:
+            raise ValueError('multi is mutually exclusive with prepared')
+
+        if stream and fetch_rs and not multi and not (self._session and self._session.active):
+            return self._stream(sql, params=params, prepared=prepared, batch_size=batch_size)
 
-    def exec_sql(self, sql, *, params=(), multi=False, fetch_rs=False, prepared=False):
-        sql = sql.strip()
-        if sql[-1] != ';':
-            sql += ';'
-        msg = sql
-        if params:
-            msg = '{} ({})'.format(sql, ', '.join([str(p) for p in params]))
-
-        options = []
-        if prepared:
-            options.append('prepared=True')
-        if multi:
-            options.append('params=True')
-        if options:
-            msg += f" [{','.join(options)}]"
+        sql, msg = _sql_message(sql, params=params, multi=multi, prepared=prepared)
+        if self._session and self._session.active:
+            if not multi:
+                rows = self._session.execute(sql, params=params, prepared=prepared, msg=msg)
+                if fetch_rs:
+                    return ResultSet(self._tk, rows=rows)
+                return
+            self._session.fallback('multi-statement')
 
         self._tk.log_path(f'sql@conn#{self._conn_id}', msg)
+        if _DDL.search(sql):
+            self._stmt_cache.clear()
+
+        if prepared and cached:
+            entry = self._stmt_cache.get(sql)
+            cur = entry[1] if entry else self._conn.cursor(prepared=True)
+            try:
+                cur.execute(entry[0] if entry else sql, params=params)
+                rows = cur.fetchall() if cur.with_rows else None
+            except Exception:
+                if not entry:
+                    cur.close()
+                raise
+
+            if not entry:
+                self._stmt_cache.put(sql, cur)
+            if fetch_rs:
+                return ResultSet(self._tk, rows=rows)
+            return
+
         with self._conn.cursor(prepared=prepared) as cur:
             cur.execute(sql, params=params, multi=multi)
             if fetch_rs:
@@ -85,20 +320,230 @@ class TidbConnection:
     def query(self, *args, **kwargs):
         return self.exec_sql(*args, **kwargs, fetch_rs=True)
 
-    def prepare(self, stmt) -> PreparedStmt:
+    def _stream(self, sql, *, params, prepared, batch_size):
+        stmt, msg = _sql_message(sql, params=params, multi=False, prepared=prepared)
+        self._tk.log_path(f'sql@conn#{self._conn_id}', f'{msg} [stream]')
+        cur = self._conn.cursor(prepared=prepared)
+        try:
+            cur.execute(stmt, params=params)
+        except Exception:
+            cur.close()
+            raise
+
+        def _requery():
+            return self._stream(sql, params=params, prepared=prepared, batch_size=batch_size)
+
+        return ResultSet(self._tk, cursor=cur, batch_size=batch_size, requery=_requery)
+
+    def exec_batch(self, sqls):
+        """
+        Sends the statements in one multi-statement packet, so they cost one round trip instead of one each. Every
+        statement is still logged in the path, and when one of them fails the error of the same type names it, the
+        statements after it are not executed.
+        """
+        stmts = [_sql_message(sql, params=(), multi=False, prepared=False)[0] for sql in sqls]
+        if self._session and self._session.active:
+            if all(is_data_only(stmt) for stmt in stmts):
+                for i, stmt in enumerate(stmts, 1):
+                    self._session.execute(stmt, msg=f'{stmt} [batch={i}/{len(stmts)}]')
+                return
+            self._session.fallback('batch with statements that are not data-only')
+
+        for i, stmt in enumerate(stmts, 1):
+            self._tk.log_path(f'sql@conn#{self._conn_id}', f'{stmt} [batch={i}/{len(stmts)}]')
+        if not stmts:
+            return
+        if any(_DDL.search(stmt) for stmt in stmts):
+            self._stmt_cache.clear()
+
+        done = 0
+        with self._conn.cursor() as cur:
+            try:
+                for result in cur.execute(' '.join(stmts), multi=True):
+                    if result.with_rows:
+                        result.fetchall()
+                    done += 1
+            except Exception as e:
+                # the C extension raises its own MySQLInterfaceError for the statements after the first one
+                if getattr(e, 'errno', None) is None:
+                    raise
+                msg = f'statement {done + 1}/{len(stmts)} of batch failed: {stmts[done]}\n{e.msg}'
+                self._tk.log_path(f'sql@conn#{self._conn_id}', f'batch failed at statement {done + 1}')
+                raise get_mysql_exception(e.errno, msg, getattr(e, 'sqlstate', None)) from e
+
+    def create_table(self, table: Table, *, database='test', pooled=False) -> Table:
+        """
+        Creates `table` in `database` and drops it when the branch ends.
+
+        :param pooled: take a table with the same schema from `table_pool()` and give it back emptied when the branch
+                       ends, the returned table has another name than `table`
+        """
+        if pooled:
+            pool = table_pool()
+            created = pool.acquire(self, table, database=database)
+            self._tk.defer(pool.release, self, created, database=database)
+            # the idle tables are dropped when the runner ends, or with the branch when it does not share its state
+            shared = self._tk.shared
+            if self._key and ('tidb_table_pool', self._key, database) not in shared.state:
+                shared.state['tidb_table_pool', self._key, database] = True
+                shared.defer(_clear_table_pool, pool, self._key, database)
+            return created
+
+        name = f'`{database}`.`{table.name}`'
+        self._tk.defer(self.exec_sql, f'drop table if exists {name}')
+        self.exec_batch([
+            f'drop table if exists {name}',
+            table.sql_create.replace(f'`{table.name}`', name, 1),
+        ])
+        return table
+
+    def current_tso(self):
+        """
+        :return: a TSO allocated by PD now, every transaction committed before has a smaller commit TS. It starts and
+                 rolls back a transaction, so it must not be called in a transaction of the test
+        """
+        if self._session:
+            self._session.fallback('current_tso')
+        with self._conn.cursor() as cur:
+            cur.execute('begin')
+            try:
+                cur.execute('select @@tidb_current_ts')
+                return int(cur.fetchall()[0][0])
+            finally:
+                cur.execute('rollback')
+
+    def as_of_point(self, *, staleness=0, interval=0.005, timeout=10):
+        """
+        Establishes a point for the stale reads, all the transactions committed before the call are visible at it and
+        all the ones committed after the return are not. The point is taken just after the TSO returned by
+        `current_tso`, the call then polls the TSO until its physical time has passed the point by `staleness`
+        seconds, instead of sleeping for a fixed time.
+
+        :param staleness: the seconds that must have passed since the point, e.g. 1 for reading at
+                          `tidb_read_staleness=-1`
+        :return: the point as a datetime literal of the time zone of the session, for `as of timestamp '...'`
+        """
+        tso = self.current_tso()
+        # a datetime has no logical part, it reads at the start of the next millisecond to see the commits of this one
+        point_ms = (tso >> 18) + 1
+        wait_until_ms = point_ms + int(staleness * 1000)
+        deadline = time.monotonic() + timeout
+        polls = 0
+        while (self.current_tso() >> 18) <= wait_until_ms:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'TSO has not passed {wait_until_ms} in {timeout} seconds')
+            polls += 1
+            time.sleep(interval)
+
+        with self._conn.cursor() as cur:
+            cur.execute('select tidb_parse_tso(%s)', params=(point_ms << 18,))
+            point = str(cur.fetchall()[0][0])
+        self._tk.log_path(f'tso@conn#{self._conn_id}', f'as of point: {point}, tso: {tso}, polls: {polls}')
+        return point
+
+    def prepare(self, stmt, *, cached=True) -> PreparedStmt:
+        """
+        :param cached: reuse the statement prepared for the same SQL text on this connection without a round trip,
+                       set it to False for the tests of PREPARE itself, which need the server to prepare it again
+        """
+        if cached:
+            entry = self._stmt_cache.get(stmt)
+            if entry:
+                self._tk.log_path(f'pre@conn#{self._conn_id}', f'{stmt} [cached]')
+                return PreparedStmt(self._tk, entry[0], entry[1], self._conn_id, cached=True)
+
+        if self._session:
+            # the prepared statement is executed outside the record of the session
+            self._session.fallback('prepare')
         cursor = self._conn.cursor(prepared=True)
         try:
             self._tk.log_path(f'pre@conn#{self._conn_id}', stmt)
             cursor.execute(stmt)
             cursor.fetchall()
-            return PreparedStmt(self._tk, stmt, cursor, self._conn_id)
         except Exception:
             cursor.close()
             raise
 
+        if cached:
+            self._stmt_cache.put(stmt, cursor)
+        return PreparedStmt(self._tk, stmt, cursor, self._conn_id, cached=cached)
+
     def close(self):
+        try:
+            self._stmt_cache.clear()
+        finally:
+            if self._session:
+                self._tk.log_path(f'sql@conn#{self._conn_id}', "end branch of savepoint session")
+                self._release(self._conn)
+            elif self._release:
+                self._tk.log_path(f'sql@conn#{self._conn_id}', "release connection to pool")
+                self._release(self._conn)
+            else:
+                self._tk.log_path(f'sql@conn#{self._conn_id}', "close connection")
+                self._conn.close()
+
+
+class AsyncPreparedStmt:
+    def __init__(self, tk, stmt, cursor, conn_id):
+        self._tk = tk
+        self._stmt = stmt
+        self._cursor = cursor
+        self._conn_id = conn_id
+
+    async def execute(self, *, params=(), multi=False, fetch_rs=False):
+        self._tk.log_path(f'exe@conn#{self._conn_id}', self._stmt)
+        await self._cursor.execute(self._stmt, params=params, multi=multi)
+        if fetch_rs:
+            return ResultSet(self._tk, rows=await self._cursor.fetchall())
+
+    async def query(self, *args, **kwargs):
+        return await self.execute(*args, **kwargs, fetch_rs=True)
+
+    async def close(self):
+        await self._cursor.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncTidbConnection:
+    """
+    The async counterpart of `TidbConnection` over `mysql.connector.aio`, for the bodies of `async_fork_test`.
+    """
+
+    def __init__(self, tk: TestKit, *, conn=None, conn_id=None):
+        self._tk = tk
+        self._conn = conn
+        self._conn_id = conn_id
+
+    async def exec_sql(self, sql, *, params=(), multi=False, fetch_rs=False, prepared=False):
+        sql, msg = _sql_message(sql, params=params, multi=multi, prepared=prepared)
+        self._tk.log_path(f'sql@conn#{self._conn_id}', msg)
+        async with await self._conn.cursor(prepared=prepared) as cur:
+            await cur.execute(sql, params=params, multi=multi)
+            if fetch_rs:
+                return ResultSet(self._tk, rows=await cur.fetchall())
+
+    async def query(self, *args, **kwargs):
+        return await self.exec_sql(*args, **kwargs, fetch_rs=True)
+
+    async def prepare(self, stmt) -> AsyncPreparedStmt:
+        cursor = await self._conn.cursor(prepared=True)
+        try:
+            self._tk.log_path(f'pre@conn#{self._conn_id}', stmt)
+            await cursor.execute(stmt)
+            await cursor.fetchall()
+            return AsyncPreparedStmt(self._tk, stmt, cursor, self._conn_id)
+        except Exception:
+            await cursor.close()
+            raise
+
+    async def close(self):
         self._tk.log_path(f'sql@conn#{self._conn_id}', "close connection")
-        self._conn.close()
+        await self._conn.close()
 
 
 class TidbTestKit:
@@ -107,16 +552,95 @@ class TidbTestKit:
         self._last_conn_id = 0
 
     def connect(self, *, host='localhost', port=4000, database='test',
-                user=None, password=None, **kwargs) -> TidbConnection:
+                user=None, password=None, pooled=False, savepoint=False, **kwargs) -> TidbConnection:
+        """
+        :param pooled: take the connection from `connection_pool()` and give it back with its session reset when the
+                       branch ends, instead of opening and closing a connection for every branch
+        :param savepoint: run the statements through a `SavepointSession` shared with the previous branches, which
+                          rolls back to the prefix they share instead of executing it again. It only takes effect when
+                          the branches run one after another, see `TestKit.sequential`, and the rows of the branch are
+                          never committed, so another process cannot read them. It cannot be used with `pooled`
+        """
+        if pooled and savepoint:
+            raise ValueError('savepoint is mutually exclusive with pooled')
+
+        conn_id = self._new_conn_id(host=host, port=port, database=database, user=user, password=password)
+        if savepoint and self._tk.sequential:
+            key = ConnectionPool.key(host=host, port=port, database=database, user=user, password=password, **kwargs)
+            session = self._savepoint_session(key)
+            if session:
+                session.begin_branch(self._tk, conn_id)
+                tidb_conn = TidbConnection(self._tk, conn=session.conn, conn_id=conn_id, release=session.end_branch,
+                                           session=session, key=key)
+                self._tk.defer(lambda: tidb_conn.close())
+                return tidb_conn
+
+        release = None
+        key = ConnectionPool.key(host=host, port=port, database=database, user=user, password=password, **kwargs)
+        if pooled:
+            pool = connection_pool()
+            conn = pool.acquire(host=host, port=port, database=database, user=user, password=password, **kwargs)
+            release = functools.partial(pool.release, key)
+        else:
+            conn = mysql.connector.connect(
+                host=host, port=port, database=database, user=user, password=password, **kwargs)
+        tidb_conn = TidbConnection(self._tk, conn=conn, conn_id=conn_id, release=release, key=key)
+        self._tk.defer(lambda: tidb_conn.close())
+        conn.autocommit = True
+        return tidb_conn
+
+    async def connect_async(self, *, host='localhost', port=4000, database='test',
+                            user=None, password=None, **kwargs) -> AsyncTidbConnection:
+        """
+        Like `connect` but returns an `AsyncTidbConnection`, it can only be used in `async_fork_test` because the
+        connection is closed by an awaitable defer.
+        """
+        # mysql.connector.aio is only shipped by mysql-connector-python>=8.3
+        from mysql.connector import aio
+
+        conn_id = self._new_conn_id(host=host, port=port, database=database, user=user, password=password)
+        conn = await aio.connect(host=host, port=port, database=database, user=user, password=password, **kwargs)
+        tidb_conn = AsyncTidbConnection(self._tk, conn=conn, conn_id=conn_id)
+        self._tk.defer(tidb_conn.close)
+        await conn.set_autocommit(True)
+        return tidb_conn
+
+    def _savepoint_session(self, key) -> typing.Optional[SavepointSession]:
+        shared = self._tk.shared.state
+        session: SavepointSession = shared.get('tidb_savepoint_session')
+        if session is False:
+            return None
+
+        if session and session.in_branch:
+            # the other connections of the branch would not see the rows of the uncommitted transaction
+            session.fallback('a second connection is opened')
+            shared['tidb_savepoint_session'] = False
+            return None
+
+        if session and not session.active:
+            shared['tidb_savepoint_session'] = False
+            return None
+
+        if session and session.key != key:
+            session.close()
+            session = None
+
+        if not session:
+            host, port, user, database, password, kwargs = key
+            conn = mysql.connector.connect(
+                host=host, port=port, database=database, user=user, password=password, **dict(kwargs))
+            conn.autocommit = True
+            session = SavepointSession(conn, key=key)
+            shared['tidb_savepoint_session'] = session
+            self._tk.shared.defer(session.close)
+        return session
+
+    def _new_conn_id(self, *, host, port, database, user, password):
         self._last_conn_id += 1
         self._tk.log_path(f'new_conn#{self._last_conn_id}',
                           f'host: {host}, port: {port}, database: {database}, user: {user}, '
                           f'password: {"*yes*" if password else "N/A"}')
-        conn = mysql.connector.connect(host=host, port=port, database=database, user=user, password=password, **kwargs)
-        tidb_conn = TidbConnection(self._tk, conn=conn, conn_id=self._last_conn_id)
-        self._tk.defer(lambda: tidb_conn.close())
-        conn.autocommit = True
-        return tidb_conn
+        return self._last_conn_id
 
     def __getattr__(self, item):
         if not hasattr(self._tk, item):
@@ -124,6 +648,32 @@ class TidbTestKit:
         return getattr(self._tk, item)
 
 
+def _clear_table_pool(pool: TablePool, key, database):
+    host, port, user, conn_database, password, kwargs = key
+    with TestKit('tidb_table_pool', ut=None):
+        conn = tidb_testkit().connect(
+            host=host, port=port, database=conn_database, user=user, password=password, **dict(kwargs))
+        pool.clear(conn, database=database)
+
+
+def _sql_message(sql, *, params, multi, prepared):
+    sql = sql.strip()
+    if sql[-1] != ';':
+        sql += ';'
+    msg = sql
+    if params:
+        msg = '{} ({})'.format(sql, ', '.join([str(p) for p in params]))
+
+    options = []
+    if prepared:
+        options.append('prepared=True')
+    if multi:
+        options.append('params=True')
+    if options:
+        msg += f" [{','.join(options)}]"
+    return sql, msg
+
+
 def tidb_testkit() -> typing.Union[TestKit, TidbTestKit]:
     tk = testkit()
     tidb_tk = tk.state.get('tidb_tk')
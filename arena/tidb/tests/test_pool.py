@@ -0,0 +1,95 @@
+import unittest
+
+import mysql.connector
+
+from arena.core.testkit import fork_test
+from arena.tidb.pool import ConnectionPool, connection_pool
+from arena.tidb.testkit import tidb_testkit
+from benchmarks.standin_server import StandinServer
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandinServer(latency=0, log=True).start()
+        cls.params = dict(host='127.0.0.1', port=cls.server.port, database='test', user='root', password='',
+                          ssl_disabled=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.clear()
+
+    def test_reuse(self):
+        pool = ConnectionPool()
+        key = pool.key(**self.params)
+        conn = pool.acquire(**self.params)
+        cur = conn.cursor()
+        cur.execute('select 1')
+        # the unread result is consumed before the reset
+        pool.release(key, conn)
+        self.assertIs(pool.acquire(**self.params), conn)
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+        commands = self.server.commands(connection_id=conn.connection_id)
+        self.assertIn('reset', [c[1] for c in commands[commands.index((conn.connection_id, 'query', 'select 1')):]])
+
+        # another key does not share the connection
+        pool.release(key, conn)
+        other = pool.acquire(**dict(self.params, database='other'))
+        self.assertIsNot(other, conn)
+        self.assertEqual((pool.hits, pool.misses), (1, 2))
+        other.close()
+        pool.clear()
+        self.assertFalse(conn.is_connected())
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_idle=2)
+        key = pool.key(**self.params)
+        conns = [pool.acquire(**self.params) for _ in range(3)]
+        for conn in conns:
+            pool.release(key, conn)
+        self.assertEqual([conn.is_connected() for conn in conns], [True, True, False])
+        self.assertEqual({id(pool.acquire(**self.params)) for _ in range(2)}, {id(conn) for conn in conns[:2]})
+        self.assertEqual(pool.hits, 2)
+        for conn in conns[:2]:
+            conn.close()
+
+    def test_discard_broken(self):
+        pool = ConnectionPool()
+        key = pool.key(**self.params)
+        conn = pool.acquire(**self.params)
+        with self.assertRaises(mysql.connector.Error):
+            conn.cursor().execute('select standin_disconnect')
+        pool.release(key, conn)
+
+        fresh = pool.acquire(**self.params)
+        self.assertIsNot(fresh, conn)
+        self.assertEqual((pool.hits, pool.misses), (0, 2))
+        self.assertFalse(conn.is_connected())
+        self.assertTrue(fresh.is_connected())
+        fresh.close()
+
+    def test_pooled_connect(self):
+        params = self.params
+
+        @fork_test
+        def run(_):
+            tk = tidb_testkit()
+            conn = tk.connect(pooled=True, **params)
+            yield tk.pick_range(0, 3)
+            conn.exec_sql('insert into t values (1)')
+
+        pool = connection_pool()
+        pool.clear()
+        hits = pool.hits
+        run(self)
+        self.assertEqual(pool.hits - hits, 2)
+        self.assertEqual(len({c[0] for c in self.server.commands()}), 1)
+        self.assertEqual([c[1] for c in self.server.commands() if c[1] in ('query', 'reset')].count('reset'), 3)
+        pool.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
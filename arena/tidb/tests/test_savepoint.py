@@ -0,0 +1,170 @@
+import unittest
+
+import mysql.connector
+
+from arena.core.testkit import TestKit, fork_test
+from arena.tidb.savepoint import is_data_only
+from arena.tidb.testkit import tidb_testkit
+from benchmarks.standin_server import StandinServer
+
+
+class IsDataOnlyTest(unittest.TestCase):
+    def test_is_data_only(self):
+        for sql in ('select * from t', ' insert into t values (1)', 'UPDATE t set v=1', 'delete from t',
+                    'replace into t values (1)', 'do sleep(1)', '\nselect 1'):
+            self.assertTrue(is_data_only(sql), sql)
+
+        for sql in ('set @a=1', 'create table t (id int)', 'alter table t add column c int', 'drop table t',
+                    'truncate table t', 'begin', 'commit', 'rollback', 'savepoint s', 'selected', 'use test',
+                    # they behave differently inside a transaction
+                    'select @@tidb_current_ts', 'select * from t as of timestamp @a',
+                    'select * from t as of timestamp tidb_bounded_staleness(now() - 1, now())'):
+            self.assertFalse(is_data_only(sql), sql)
+
+
+class SavepointSessionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandinServer(latency=0, log=True).start()
+        cls.params = dict(host='127.0.0.1', port=cls.server.port, database='test', user='root', password='',
+                          ssl_disabled=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.clear()
+
+    def queries(self):
+        """
+        :return: the queries of every connection, without the ones sent by `mysql.connector` itself
+        """
+        return [(conn_id, sql) for conn_id, command, sql in self.server.commands()
+                if command == 'query' and not sql.startswith(('SET NAMES', 'set autocommit'))]
+
+    def test_rollback_to_savepoint(self):
+        params = self.params
+        sessions = []
+
+        @fork_test
+        def run(_):
+            tk = tidb_testkit()
+            conn = tk.connect(savepoint=True, **params)
+            sessions.append(conn.session)
+            conn.exec_sql('insert into t values (1)')
+            a = yield tk.pick_range(0, 2)
+            conn.exec_sql(f'insert into t values ({a})')
+            b = yield tk.pick_range(0, 2)
+            conn.query(f'select {b}').check([('1',)])
+
+        run(self)
+        session = sessions[0]
+        self.assertEqual(sessions, [session] * 4)
+        self.assertEqual([sql for _, sql in self.queries()], [
+            'begin pessimistic',
+            'insert into t values (1);',
+            'savepoint arena_sp1',
+            'insert into t values (0);',
+            'savepoint arena_sp2',
+            'select 0;',
+            # (0, 1) reuses the first two inserts
+            'rollback to savepoint arena_sp2',
+            'select 1;',
+            # (1, 0) only reuses the first insert
+            'rollback to savepoint arena_sp1',
+            'insert into t values (1);',
+            'savepoint arena_sp2',
+            'select 0;',
+            'rollback to savepoint arena_sp2',
+            'select 1;',
+            # nothing is committed
+            'rollback',
+        ])
+        self.assertEqual(len({conn_id for conn_id, _ in self.queries()}), 1)
+        self.assertEqual((session.reused, session.rollbacks, session.savepoints), (5, 3, 3))
+        self.assertFalse(session.conn.is_connected())
+
+    def check_fallback(self, stmt, error=False):
+        """
+        Runs three branches, the second of which executes `stmt` in the middle and turns the savepoint session off
+
+        :return: the queries executed after the first branch
+        """
+        params = self.params
+        sessions = []
+
+        @fork_test
+        def run(ut):
+            tk = tidb_testkit()
+            conn = tk.connect(savepoint=True, **params)
+            sessions.append(conn.session)
+            conn.exec_sql('insert into t values (1)')
+            a = yield tk.pick_range(0, 3)
+            conn.exec_sql(f'insert into t values ({a})')
+            if a == 1:
+                if error:
+                    with ut.assertRaises(mysql.connector.DatabaseError):
+                        conn.exec_sql(stmt)
+                else:
+                    conn.exec_sql(stmt)
+                ut.assertFalse(conn.session.active)
+            conn.exec_sql('insert into t values (3)')
+
+        run(self)
+        self.assertIs(sessions[0], sessions[1])
+        # the third branch gets a plain connection
+        self.assertIsNone(sessions[2])
+        queries = self.queries()
+        return queries[queries.index((queries[0][0], 'insert into t values (3);')) + 1:]
+
+    def test_commit(self):
+        queries = self.check_fallback('commit')
+        session_id = queries[0][0]
+        self.assertEqual(queries[:6], [
+            (session_id, 'rollback to savepoint arena_sp1'),
+            (session_id, 'insert into t values (1);'),
+            # the statements of the branch are executed again outside the transaction
+            (session_id, 'rollback'),
+            (session_id, 'insert into t values (1);'),
+            (session_id, 'insert into t values (1);'),
+            (session_id, 'commit;'),
+        ])
+        self.assertEqual(queries[6:], [
+            (session_id, 'insert into t values (3);'),
+            (session_id + 1, 'insert into t values (1);'),
+            (session_id + 1, 'insert into t values (2);'),
+            (session_id + 1, 'insert into t values (3);'),
+        ])
+
+    def test_ddl(self):
+        queries = self.check_fallback('create table t2 (id int)')
+        self.assertEqual([sql for _, sql in queries[2:6]], [
+            'rollback', 'insert into t values (1);', 'insert into t values (1);', 'create table t2 (id int);'])
+        self.assertEqual(len({conn_id for conn_id, _ in queries[6:]}), 2)
+
+    def test_error(self):
+        queries = self.check_fallback('insert standin_error', error=True)
+        self.assertEqual([sql for _, sql in queries[2:7]], [
+            'insert standin_error;',
+            'rollback',
+            'insert into t values (1);',
+            'insert into t values (1);',
+            # the failed statement is executed again on the plain connection, which raises its error to the branch
+            'insert standin_error;',
+        ])
+        self.assertEqual(len({conn_id for conn_id, _ in queries[7:]}), 2)
+
+    def test_not_sequential(self):
+        with TestKit('test', ut=self):
+            conn = tidb_testkit().connect(savepoint=True, **self.params)
+            self.assertIsNone(conn.session)
+
+    def test_pooled(self):
+        with TestKit('test', ut=self):
+            with self.assertRaises(ValueError):
+                tidb_testkit().connect(savepoint=True, pooled=True, **self.params)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import unittest
+from unittest import mock
+
+from arena.core.testkit import TestKit, fork_test
+from arena.tidb.column import Column, TableColumns
+from arena.tidb.options import TemporaryTableType
+from arena.tidb.table import Table, TableForker, TablePool, table_pool
+from arena.tidb.testkit import TidbConnection, tidb_testkit
+from benchmarks.standin_server import StandinServer
+
+
+def _table(name, *columns, temp_type=None):
+    return Table(name, columns=TableColumns(columns=list(columns)), temp_type=temp_type)
+
+
+class TableTest(unittest.TestCase):
+    def test_renamed(self):
+        table = _table('t1', Column.new('id', 'int'), temp_type=TemporaryTableType('TEMPORARY', None, 1))
+        renamed = table.renamed('t2')
+        self.assertEqual(renamed.name, 't2')
+        self.assertIs(renamed.columns, table.columns)
+        self.assertIs(renamed.temp_type, table.temp_type)
+        self.assertEqual(renamed.sql_create, table.sql_create.replace('`t1`', '`t2`'))
+        self.assertEqual(renamed.schema_key, table.schema_key)
+        # int and int(11) are the same schema
+        self.assertEqual(_table('t3', Column.new('id', 'int', len=11)).schema_key,
+                         _table('t4', Column.new('id', 'int')).schema_key)
+        self.assertNotEqual(_table('t5', Column.new('id', 'bigint')).schema_key,
+                            _table('t6', Column.new('id', 'int')).schema_key)
+
+
+class TablePoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandinServer(latency=0, log=True).start()
+        cls.params = dict(host='127.0.0.1', port=cls.server.port, database='test', user='root', password='',
+                          ssl_disabled=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.clear()
+
+    def run_branch(self, pool: TablePool, table: Table, func=None):
+        """
+        Acquires a table with the schema of `table` from `pool` in a new branch, which runs `func` with the connection
+        and the table and gives the table back when it ends
+
+        :return: the testkit of the branch and the acquired table
+        """
+        with TestKit('test', ut=self) as tk:
+            conn = tidb_testkit().connect(**self.params)
+            acquired = pool.acquire(conn, table)
+            tk.defer(pool.release, conn, acquired)
+            if func:
+                func(conn, acquired)
+        return tk, acquired
+
+    def test_reuse(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int'), Column.new('v', 'varchar', len=16))
+        _, first = self.run_branch(pool, table)
+        self.assertNotEqual(first.name, 't')
+        self.assertEqual(first.schema_key, table.schema_key)
+        self.assertIn(f'delete from `test`.`{first.name}`;', self.server.statements())
+        self.assertEqual((pool.hits, pool.misses), (0, 1))
+
+        self.server.clear()
+        tk, second = self.run_branch(pool, table.renamed('other'))
+        self.assertEqual(second.name, first.name)
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+        self.assertGreater(pool.ddl_time_saved, 0)
+        self.assertTrue(tk.path[1][1].startswith(f'reuse `test`.`{first.name}`'))
+        self.assertFalse([sql for sql in self.server.statements() if sql.lower().startswith(('create', 'drop'))])
+
+        # another schema gets its own table
+        _, third = self.run_branch(pool, _table('t', Column.new('id', 'bigint')))
+        self.assertNotEqual(third.name, first.name)
+        self.assertEqual((pool.hits, pool.misses), (1, 2))
+
+    def test_truncate(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int', auto_inc=True))
+        _, acquired = self.run_branch(pool, table)
+        self.assertIn(f'truncate table `test`.`{acquired.name}`;', self.server.statements())
+        self.assertEqual(self.run_branch(pool, table)[1].name, acquired.name)
+
+    def test_open_transaction(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int'))
+
+        def _begin(conn, acquired):
+            conn.exec_sql('set autocommit = 0')
+            conn.exec_sql(f'insert into `test`.`{acquired.name}` values (1)')
+
+        _, acquired = self.run_branch(pool, table, _begin)
+        name = f'`test`.`{acquired.name}`'
+        statements = self.server.statements()
+        start = statements.index(f'insert into {name} values (1);') + 1
+        # the transaction left open by the branch is rolled back before the table is emptied
+        self.assertEqual(statements[start:start + 5], [
+            f'show create table {name};',
+            'rollback;', 'set autocommit = 1;', f'delete from {name};', f'select 1 from {name} limit 1;'])
+        self.assertEqual(self.run_branch(pool, table)[1].name, acquired.name)
+
+    def test_not_emptied(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int'))
+        query = TidbConnection.query
+
+        def _query(conn, sql, **kwargs):
+            # the rows inserted by another session are still there
+            if sql.startswith('select 1 from'):
+                sql = "select standin_rows('1')"
+            return query(conn, sql, **kwargs)
+
+        with mock.patch.object(TidbConnection, 'query', _query):
+            _, first = self.run_branch(pool, table)
+        self.assertIn(f'drop table if exists `test`.`{first.name}`;', self.server.statements())
+        _, second = self.run_branch(pool, table)
+        self.assertNotEqual(second.name, first.name)
+        self.assertEqual((pool.hits, pool.misses), (0, 2))
+
+    def test_altered(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int'))
+
+        def _alter(conn, acquired):
+            conn.exec_sql(f'alter table `test`.`{acquired.name}` add column c int')
+
+        _, altered = self.run_branch(pool, table, _alter)
+        self.assertIn(f'drop table if exists `test`.`{altered.name}`;', self.server.statements())
+        self.assertNotIn(f'delete from `test`.`{altered.name}`;', self.server.statements())
+
+        _, acquired = self.run_branch(pool, table)
+        self.assertNotEqual(acquired.name, altered.name)
+        self.assertEqual((pool.hits, pool.misses), (0, 2))
+
+    def test_renamed_by_branch(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int'))
+
+        def _rename(conn, acquired):
+            conn.exec_sql(f'rename table `test`.`{acquired.name}` to `test`.`moved`')
+
+        _, renamed = self.run_branch(pool, table, _rename)
+        _, acquired = self.run_branch(pool, table)
+        self.assertNotEqual(acquired.name, renamed.name)
+        self.assertEqual((pool.hits, pool.misses), (0, 2))
+
+    def test_temporary(self):
+        pool = TablePool()
+        table = _table('t', Column.new('id', 'int'), temp_type=TemporaryTableType('TEMPORARY', None, 1))
+        _, first = self.run_branch(pool, table)
+        self.assertIn(f'drop table if exists `test`.`{first.name}`;', self.server.statements())
+        _, second = self.run_branch(pool, table)
+        self.assertNotEqual(second.name, first.name)
+        self.assertEqual((pool.hits, pool.misses), (0, 0))
+
+    def test_table_forker(self):
+        params = self.params
+        names = []
+
+        @fork_test
+        def run(_):
+            tk = tidb_testkit()
+            table = yield TableForker()
+            yield tk.pick_range(0, 2)
+            conn = tk.connect(**params)
+            names.append(conn.create_table(table, pooled=True).name)
+
+        pool = table_pool()
+        hits = pool.hits
+        run(self)
+        # every table is created by the first of the two branches of its schema and reused by the second, except the
+        # local temporary tables of the third and fourth schemas, which only live in their session
+        self.assertEqual(len(names), 12)
+        self.assertEqual(names[:4:2] + names[8::2], names[1:4:2] + names[9::2])
+        self.assertFalse(set(names[4:8:2]) & set(names[5:8:2]))
+        self.assertEqual(pool.hits - hits, 4)
+
+        # the idle tables are dropped when the runner ends
+        statements = self.server.statements()
+        for name in names[:4:2] + names[8::2]:
+            self.assertEqual(statements[-4:].count(f'drop table if exists `test`.`{name}`;'), 1)
+        run(self)
+        self.assertFalse(set(names[12:]) & set(names[:12]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+import datetime
+import decimal
+import re
+import time
+import unittest
+from unittest import mock
+
+import mysql.connector
+
+from arena.core.testkit import TestKit, fork_test
+from arena.tidb.pool import connection_pool
+from arena.tidb.testkit import PreparedStmtCache, ResultSet, tidb_testkit
+from benchmarks.standin_server import StandinServer
+
+
+class _StandinTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandinServer(latency=0, log=True).start()
+        cls.params = dict(host='127.0.0.1', port=cls.server.port, database='test', user='root', password='',
+                          ssl_disabled=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        connection_pool().clear()
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.clear()
+
+    def connect(self, **kwargs):
+        return tidb_testkit().connect(**self.params, **kwargs)
+
+    def commands(self, conn, *names):
+        """
+        :param conn: a `TidbConnection` or a `MySQLConnection`
+        :return: the (command, sql) received from the connection, only the commands in `names`
+        """
+        conn = getattr(conn, '_conn', conn)
+        # close_stmt gets no reply, the round trip of the ping makes sure the server has logged it
+        conn.ping()
+        return [(command, sql) for _, command, sql in self.server.commands(connection_id=conn.connection_id)
+                if command in names]
+
+
+class PreparedStmtCacheTest(_StandinTestCase):
+    def test_hits(self):
+        with TestKit('test', ut=self):
+            conn = self.connect()
+            for _ in range(2):
+                with conn.prepare('select 1') as stmt:
+                    stmt.query().check([('1',)])
+                conn.query('select 2', prepared=True).check([('1',)])
+            self.assertEqual((conn.stmt_cache.hits, conn.stmt_cache.misses), (2, 2))
+            self.assertEqual(self.commands(conn, 'prepare'), [('prepare', 'select 1'), ('prepare', 'select 2;')])
+            self.assertEqual(len(self.commands(conn, 'execute')), 5)
+
+            # not cached, the server prepares them again
+            with conn.prepare('select 1', cached=False) as stmt:
+                stmt.query().check([('1',)])
+            conn.query('select 2', prepared=True, cached=False).check([('1',)])
+            self.assertEqual(len(self.commands(conn, 'prepare')), 4)
+            self.assertEqual(len(conn.stmt_cache), 2)
+
+            # a prepared statement holds a single statement
+            with self.assertRaises(ValueError):
+                conn.exec_sql('insert into t values (1); select 1', prepared=True, multi=True)
+            self.assertEqual(len(self.commands(conn, 'prepare')), 4)
+
+    def test_eviction(self):
+        conn = mysql.connector.connect(**self.params)
+        cache = PreparedStmtCache(capacity=2)
+        for sql in ('select 1', 'select 2', 'select 3'):
+            # 'select 1' is used last, so 'select 2' is evicted
+            cache.get('select 1')
+            cursor = conn.cursor(prepared=True)
+            cursor.execute(sql)
+            cursor.fetchall()
+            cache.put(sql, cursor)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('select 2'))
+        self.assertEqual(self.commands(conn, 'close_stmt'), [('close_stmt', 'select 2')])
+
+        sql, cursor = cache.get('select 1')
+        cursor.execute(sql)
+        self.assertEqual(cursor.fetchall(), [('1',)])
+        self.assertEqual(len(self.commands(conn, 'prepare')), 3)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(self.commands(conn, 'close_stmt')), 3)
+        conn.close()
+
+    def test_invalidated_by_reset(self):
+        connection_pool().clear()
+        connection_ids = []
+
+        @fork_test
+        def run(ut):
+            tk = tidb_testkit()
+            conn = ut.connect(pooled=True)
+            connection_ids.append(conn._conn.connection_id)
+            ut.assertEqual(len(conn.stmt_cache), 0)
+            for _ in range(2):
+                with conn.prepare('select 1') as stmt:
+                    stmt.query().check([('1',)])
+            ut.assertEqual(conn.stmt_cache.hits, 1)
+            yield tk.pick_range(0, 2)
+
+        run(self)
+        # the second branch got the connection back reset and prepared the statement again
+        self.assertEqual(len(set(connection_ids)), 1)
+        self.assertEqual([c for c, _ in self.commands(connection_pool().acquire(**self.params), 'prepare', 'reset')],
+                         ['prepare', 'reset', 'prepare', 'reset'])
+
+    def test_invalidated_by_ddl(self):
+        with TestKit('test', ut=self):
+            conn = self.connect()
+            conn.exec_sql('insert into t values (?)', params=(1,), prepared=True)
+            self.assertEqual(len(conn.stmt_cache), 1)
+            conn.exec_sql('create table if not exists t (id int)')
+            self.assertEqual(len(conn.stmt_cache), 0)
+            self.assertEqual(len(self.commands(conn, 'close_stmt')), 1)
+            conn.exec_sql('insert into t values (?)', params=(1,), prepared=True)
+            self.assertEqual(len(self.commands(conn, 'prepare')), 2)
+
+
+class ExecBatchTest(_StandinTestCase):
+    def test_batch(self):
+        with TestKit('test', ut=self) as tk:
+            conn = self.connect()
+            conn.exec_sql('insert into t values (?)', params=(1,), prepared=True)
+            conn.exec_batch(['insert into t values (1)', 'select 1', 'create table t2 (a int)'])
+            self.assertEqual(self.server.statements(connection_id=conn._conn.connection_id)[-1],
+                             'insert into t values (1); select 1; create table t2 (a int);')
+            self.assertEqual([msg for _, msg in tk.path[-3:]],
+                             ['insert into t values (1); [batch=1/3]', 'select 1; [batch=2/3]',
+                              'create table t2 (a int); [batch=3/3]'])
+            # the DDL of the batch drops the prepared statements
+            self.assertEqual(len(conn.stmt_cache), 0)
+
+            self.server.clear()
+            conn.exec_batch([])
+            self.assertEqual(self.commands(conn, 'query'), [])
+
+    def test_failed_statement(self):
+        with TestKit('test', ut=self) as tk:
+            conn = self.connect()
+            for stmts, failed in ((['insert into t values (1)', 'select standin_error', 'insert into t values (3)'], 2),
+                                  (['select standin_error', 'insert into t values (2)'], 1)):
+                with self.assertRaises(mysql.connector.DatabaseError) as cm:
+                    conn.exec_batch(stmts)
+                self.assertEqual(cm.exception.errno, 1105)
+                self.assertIn(f'statement {failed}/{len(stmts)} of batch failed: select standin_error;',
+                              cm.exception.msg)
+                self.assertIn('standin error: select standin_error', cm.exception.msg)
+                self.assertEqual(tk.path[-1][1], f'batch failed at statement {failed}')
+
+                # the connection can still be used after the failed batch
+                conn.query('select 1').check([('1',)])
+
+
+class AsOfPointTest(_StandinTestCase):
+    def test_current_tso(self):
+        with TestKit('test', ut=self):
+            conn = self.connect()
+            before = int(time.time() * 1000)
+            tso = conn.current_tso()
+            self.assertTrue(before <= tso >> 18 <= time.time() * 1000)
+            self.assertEqual(tso & ((1 << 18) - 1), 0)
+            self.assertEqual([sql for _, sql in self.commands(conn, 'query')][-3:],
+                             ['begin', 'select @@tidb_current_ts', 'rollback'])
+
+    def test_staleness(self):
+        for staleness in (0, 0.05):
+            with TestKit('test', ut=self) as tk:
+                conn = self.connect()
+                self.server.clear()
+                point = conn.as_of_point(staleness=staleness, interval=0.001)
+                returned = time.time()
+
+                topic, msg = tk.path[-1]
+                self.assertEqual(topic, f'tso@conn#{conn._conn_id}')
+                tso, polls = (int(v) for v in re.match(r'as of point: .*, tso: (\d+), polls: (\d+)', msg).groups())
+                # the point is the millisecond after the first TSO, as a datetime of the session
+                point_ms = (tso >> 18) + 1
+                self.assertEqual(point, datetime.datetime.fromtimestamp(point_ms / 1000).strftime(
+                    '%Y-%m-%d %H:%M:%S.%f')[:-3])
+                # it returns once the TSO has passed the point by the staleness, and polls until then
+                self.assertGreater(returned * 1000, point_ms + staleness * 1000)
+                self.assertEqual(self.commands(conn, 'query').count(('query', 'select @@tidb_current_ts')), polls + 2)
+                if staleness:
+                    self.assertGreater(polls, 10)
+
+    def test_timeout(self):
+        with TestKit('test', ut=self):
+            conn = self.connect()
+            tso = conn.current_tso()
+            with mock.patch.object(conn, 'current_tso', return_value=tso):
+                start = time.monotonic()
+                with self.assertRaises(TimeoutError):
+                    conn.as_of_point(interval=0.01, timeout=0.05)
+                self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+
+class ResultSetTest(_StandinTestCase):
+    def test_check_unordered(self):
+        with TestKit('test', ut=self) as tk:
+            rs = ResultSet(tk, rows=[(1, 'a'), (2, 'b'), (2, 'b')])
+            rs.check_unordered([(2, 'b'), (1, 'a'), (2, 'b')])
+            rs.check_unordered(iter([[2, 'b'], [2, 'b'], [1, 'a']]))
+            ResultSet(tk, rows=[]).check_unordered([])
+
+            # the same rows with other duplicates
+            with self.assertRaises(AssertionError) as cm:
+                rs.check_unordered([(1, 'a'), (1, 'a'), (2, 'b')])
+            self.assertEqual(str(cm.exception), 'rows differ in any order, actual: 3 rows, expected: 3 rows\n'
+                                                "missing: [(1, 'a')]\nunexpected: [(2, 'b')]")
+
+            with self.assertRaises(AssertionError) as cm:
+                rs.check_unordered([(1, 'a'), (2, 'b')])
+            self.assertTrue(str(cm.exception).endswith("actual: 3 rows, expected: 2 rows\nunexpected: [(2, 'b')]"))
+
+            # the difference is only reported for a sequence, which can be iterated again
+            with self.assertRaises(AssertionError) as cm:
+                rs.check_unordered(iter([(1, 'a')]))
+            self.assertEqual(str(cm.exception), 'rows differ in any order, actual: 3 rows, expected: 1 rows')
+
+            with self.assertRaises(AssertionError) as cm:
+                ResultSet(tk, rows=[(i,) for i in range(20)]).check_unordered([], max_diff=3)
+            self.assertTrue(str(cm.exception).endswith('unexpected: [(0,), (1,), (2,)] ... and 17 more'))
+
+    def test_check_unordered_equal_hashes(self):
+        with TestKit('test', ut=self) as tk:
+            # hash(-1) == hash(-2)
+            with self.assertRaises(AssertionError) as cm:
+                ResultSet(tk, rows=[(-1, 'a')]).check_unordered([(-2, 'a')])
+            self.assertTrue(str(cm.exception).endswith("missing: [(-2, 'a')]\nunexpected: [(-1, 'a')]"))
+
+            # 1, 1.0, True and Decimal(1) are equal and have the same hash
+            for value in (1.0, True, decimal.Decimal(1)):
+                with self.assertRaises(AssertionError) as cm:
+                    ResultSet(tk, rows=[(1, 'a')]).check_unordered([(value, 'a')])
+                self.assertTrue(str(cm.exception).endswith(f"missing: [({value!r}, 'a')]\nunexpected: [(1, 'a')]"))
+            ResultSet(tk, rows=[(decimal.Decimal('1.0'), True)]).check_unordered([(decimal.Decimal('1.0'), True)])
+
+    def test_stream(self):
+        with TestKit('test', ut=self):
+            conn = self.connect()
+            sql = "select standin_rows('a,b,c,d,e')"
+            rs = conn.query(sql, stream=True, batch_size=2)
+            self.assertEqual(list(rs), [('a',), ('b',), ('c',), ('d',), ('e',)])
+            with self.assertRaises(RuntimeError):
+                list(rs)
+
+            # the rows left by a stopped iteration are read, so the connection can be used again
+            for _ in conn.query(sql, stream=True, batch_size=2):
+                break
+            conn.query('select 1').check([('1',)])
+
+            conn.query(sql, stream=True, batch_size=2).check([('a',), ('b',), ('c',), ('d',), ('e',)])
+            conn.query("select standin_rows('')", stream=True).check_unordered([])
+
+    def test_stream_check_unordered(self):
+        with TestKit('test', ut=self) as tk:
+            conn = self.connect()
+            sql = "select standin_rows('a,b,b')"
+            conn.query(sql, stream=True, batch_size=1).check_unordered([('b',), ('a',), ('b',)])
+            self.assertEqual(self.commands(conn, 'query').count(('query', sql + ';')), 1)
+
+            # the streamed rows are gone, the query is executed again to report the difference
+            with self.assertRaises(AssertionError) as cm:
+                conn.query(sql, stream=True, batch_size=1).check_unordered([('b',), ('a',), ('a',)])
+            self.assertTrue(str(cm.exception).endswith("missing: [('a',)]\nunexpected: [('b',)]"))
+            self.assertEqual(self.commands(conn, 'query').count(('query', sql + ';')), 3)
+            self.assertIn(('rs.check_unordered', 'rows differ, query again to report the difference'), tk.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 from threading import Lock
 
+from arena.core.testkit import unique_name
+
 
 class AutoIDAllocator:
     def __init__(self):
@@ -16,4 +18,4 @@ def name_generator(prefix):
     index = 0
     while True:
         index += 1
-        yield f'{prefix}{index}'
+        yield unique_name(f'{prefix}{index}')
@@ -0,0 +1,60 @@
+"""
+Compares the branches per second of `fork_test` and `async_fork_test` when every branch opens a connection and runs a
+few statements against a MySQL-protocol server that takes `LATENCY` seconds to answer, see `StandinServer`.
+
+    python -m benchmarks.bench_async_fork_test
+"""
+import time
+import unittest
+
+from arena.core.fork import RangeForker
+from arena.tidb.testkit import *
+from benchmarks.standin_server import StandinServer
+
+LATENCY = 0.002
+BRANCHES = (10, 20)
+
+
+def _run(test_case):
+    result = unittest.TestResult()
+    start = time.perf_counter()
+    test_case.run(result)
+    elapsed = time.perf_counter() - start
+    if not result.wasSuccessful():
+        raise RuntimeError((result.errors + result.failures)[0][1])
+    return elapsed
+
+
+def main():
+    branches = BRANCHES[0] * BRANCHES[1]
+    with StandinServer(latency=LATENCY) as server:
+        class _Test(unittest.TestCase):
+            @fork_test
+            def test_sync(self):
+                tk = tidb_testkit()
+                a = yield tk.pick(RangeForker(0, BRANCHES[0]))
+                b = yield tk.pick(RangeForker(0, BRANCHES[1]))
+                conn = tk.connect(host='127.0.0.1', port=server.port, user='root', ssl_disabled=True)
+                conn.exec_sql(f'set @a={a}')
+                conn.exec_sql(f'set @b={b}')
+                conn.query('select @a + @b').check([('1',)])
+
+            @async_fork_test
+            async def test_async(self):
+                tk = tidb_testkit()
+                a = yield tk.pick(RangeForker(0, BRANCHES[0]))
+                b = yield tk.pick(RangeForker(0, BRANCHES[1]))
+                conn = await tk.connect_async(host='127.0.0.1', port=server.port, user='root', ssl_disabled=True)
+                await conn.exec_sql(f'set @a={a}')
+                await conn.exec_sql(f'set @b={b}')
+                (await conn.query('select @a + @b')).check([('1',)])
+
+        print(f'{branches} branches, {LATENCY * 1000:.1f}ms per statement')
+        print(f'{"runner":>16} {"seconds":>10} {"branches/sec":>14}')
+        for name in ('test_sync', 'test_async'):
+            elapsed = _run(_Test(name))
+            print(f'{name:>16} {elapsed:>10.3f} {branches / elapsed:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""
+Measures the per-leaf cost of enumerating `ChainForker(...).reaction()` as the number of children grows. Each child
+forks two values, so a chain of depth d has 2^d leaves and every leaf used to be yielded through d nested generators.
+
+    python -m benchmarks.bench_chain_reaction
+"""
+import timeit
+
+from arena.core.fork import ChainForker, FlatForker
+
+
+def _reaction(depth):
+    return ChainForker([FlatForker([0, 1])] * depth, reduce=lambda state, v: v).reaction()
+
+
+def main():
+    print(f'{"depth":>6} {"leaves":>8} {"us/leaf":>10}')
+    for depth in (2, 4, 8, 12, 14):
+        forker = _reaction(depth)
+        cost = timeit.timeit(lambda: sum(1 for _ in forker), number=3) / 3 / 2 ** depth
+        print(f'{depth:>6} {2 ** depth:>8} {cost * 1e6:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
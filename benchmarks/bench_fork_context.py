@@ -0,0 +1,44 @@
+"""
+Measures the cost of `ForkContext.set_var` and `get_var` as the number of recorded variables grows, against copying a
+dict for every set as the contexts did before. Each run sets `CHAIN` variables on top of a context that already holds
+`vars` variables, like nested `Forker.record` calls do.
+
+    python -m benchmarks.bench_fork_context
+"""
+import timeit
+
+from arena.core.fork import ForkContext
+
+CHAIN = 16
+
+
+def _fork_context_chain(ctx):
+    for i in range(CHAIN):
+        ctx = ctx.set_var(i, i)
+    return ctx
+
+
+def _dict_copy_chain(variables):
+    for i in range(CHAIN):
+        variables = variables.copy()
+        variables[i] = i
+    return variables
+
+
+def main():
+    print(f'{"vars":>7} {"set_var (us)":>13} {"dict copy (us)":>15} {"get_var (us)":>13}')
+    for n in (10, 50, 200, 1000, 10000, 100000):
+        loops = max(5, 50000 // max(n, CHAIN * 10))
+        variables = {f'v{i}': i for i in range(n)}
+        ctx = ForkContext()
+        for name, value in variables.items():
+            ctx = ctx.set_var(name, value)
+        ctx_cost = timeit.timeit(lambda: _fork_context_chain(ctx), number=loops) / loops / CHAIN
+        dict_cost = timeit.timeit(lambda: _dict_copy_chain(variables), number=loops) / loops / CHAIN
+        names = list(variables)[:1000]
+        get_cost = timeit.timeit(lambda: [ctx.get_var(name) for name in names], number=loops) / loops / len(names)
+        print(f'{n:>7} {ctx_cost * 1e6:>13.3f} {dict_cost * 1e6:>15.3f} {get_cost * 1e6:>13.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures the cost per transition of `ParallelSearch` against `DepthFirst` on a grid of `SIZE` x `SIZE` states, where
+every action busy-waits `cost` microseconds to stand for the work of a real action. With free actions the difference
+is the overhead of the workers: forking, claiming the transitions in the shared table, passing the tasks and sending
+the final states back. With expensive actions it shows when the workers pay off.
+
+    python -m benchmarks.bench_parallel_search
+"""
+import os
+import time
+
+from arena.core.event_driven import *
+
+SIZE = 60
+
+
+class GridState(EventDrivenState):
+    cost = 0.0
+
+    def __init__(self):
+        self.x = 0
+        self.y = 0
+
+    def __copy__(self):
+        state = GridState.__new__(GridState)
+        state.x, state.y = self.x, self.y
+        return state
+
+    def signature(self):
+        return self.x, self.y
+
+    @cond
+    def can_right(self):
+        return self.x < SIZE - 1
+
+    @cond
+    def can_down(self):
+        return self.y < SIZE - 1
+
+    @action(cond=can_right)
+    def right(self):
+        self._work()
+        self.x += 1
+
+    @action(cond=can_down)
+    def down(self):
+        self._work()
+        self.y += 1
+
+    def _work(self):
+        deadline = time.perf_counter() + self.cost
+        while time.perf_counter() < deadline:
+            pass
+
+
+def _measure(strategy):
+    start = time.perf_counter()
+    sum(1 for _ in GridState.run(strategy=strategy))
+    return time.perf_counter() - start
+
+
+def main():
+    transitions = 2 * SIZE * (SIZE - 1)
+    workers = [w for w in (1, 2, 4, 8) if w <= (os.cpu_count() or 1)]
+    print(f'{transitions} transitions')
+    print(f'{"cost (us)":>10} {"strategy":>18} {"seconds":>9} {"us/transition":>14}')
+    for cost in (0, 50, 200):
+        GridState.cost = cost / 1e6
+        for name, strategy in [('DepthFirst', DepthFirst())] + [
+                (f'ParallelSearch({w})', ParallelSearch(workers=w)) for w in workers]:
+            elapsed = _measure(strategy)
+            print(f'{cost:>10} {name:>18} {elapsed:>9.3f} {elapsed / transitions * 1e6:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
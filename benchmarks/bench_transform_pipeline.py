@@ -0,0 +1,54 @@
+"""
+Compares items/sec of a `TransformForker` chain of element-wise stages when the stages are fused into one loop
+(built with `Forker.map_value/filter_value/...`) and when each stage wraps the previous iterator (built from opaque
+`transform_result` funcs, which cannot be fused).
+
+    python -m benchmarks.bench_transform_pipeline
+"""
+import timeit
+
+from arena.core.fork import FlatForker, ForkContext, TransformForker
+
+ITEMS = 20000
+
+
+def _inc(v):
+    return v + 1
+
+
+def _positive(v):
+    return v > 0
+
+
+def _fused(length):
+    forker = FlatForker(range(ITEMS))
+    for i in range(length):
+        forker = forker.map_value(_inc) if i % 2 == 0 else forker.filter_value(_positive)
+    return forker
+
+
+def _unfused(length):
+    funcs = []
+    for i in range(length):
+        funcs.append((lambda r: r.map_value(_inc)) if i % 2 == 0 else (lambda r: r.filter_value(_positive)))
+    return TransformForker(FlatForker(range(ITEMS)), funcs)
+
+
+def _items_per_sec(forker):
+    def _run():
+        for _ in forker.do_fork(ForkContext()):
+            pass
+
+    return ITEMS * 3 / timeit.timeit(_run, number=3)
+
+
+def main():
+    print(f'{"stages":>6} {"unfused (items/s)":>18} {"fused (items/s)":>16} {"speedup":>8}')
+    for length in (1, 2, 5, 10, 15, 20):
+        unfused = _items_per_sec(_unfused(length))
+        fused = _items_per_sec(_fused(length))
+        print(f'{length:>6} {unfused:>18,.0f} {fused:>16,.0f} {fused / unfused:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""
+A stand-in MySQL-protocol server for the benchmarks and the tests that talk to TiDB through `mysql.connector`. It
+accepts any user without checking the password, answers every `select` with a single row `('1',)` and every other
+statement with an OK packet, both as text queries and as prepared statements, after waiting `latency` seconds to stand
+for the network and the work of a real server. It does not speak TLS, so connect with `ssl_disabled=True`.
+
+A few statements are answered differently for the tests:
+
+- a statement containing `standin_error` fails with error 1105, the statements after it in a multi-statement are not
+  executed
+- a statement containing `standin_disconnect` closes the connection without an answer
+- `select standin_rows('a,b,b')` returns the rows `('a',)`, `('b',)` and `('b',)`, `standin_rows('')` returns none
+- `select @@tidb_current_ts` returns a TSO of the current time and `select tidb_parse_tso(ts)` its datetime
+- `create table`, `alter table`, `rename table` and `drop table` keep the statements the tables were created and
+  altered with, which `show create table` returns, or error 1146 for a table that does not exist. The tables are
+  shared by the connections and hold no rows, a `select` from one of them returns none
+
+With `log=True` the server records every command it receives, see `StandinServer.commands`.
+"""
+import asyncio
+import datetime
+import multiprocessing
+import re
+import struct
+import time
+
+_CAPABILITIES = (
+        0x00000001  # CLIENT_LONG_PASSWORD
+        | 0x00000008  # CLIENT_CONNECT_WITH_DB
+        | 0x00000200  # CLIENT_PROTOCOL_41
+        | 0x00002000  # CLIENT_TRANSACTIONS
+        | 0x00008000  # CLIENT_SECURE_CONNECTION
+        | 0x00010000  # CLIENT_MULTI_STATEMENTS
+        | 0x00020000  # CLIENT_MULTI_RESULTS
+        | 0x00080000  # CLIENT_PLUGIN_AUTH
+)
+
+_COM_QUIT = 0x01
+_COM_QUERY = 0x03
+_COM_STMT_PREPARE = 0x16
+_COM_STMT_EXECUTE = 0x17
+_COM_STMT_CLOSE = 0x19
+_COM_RESET_CONNECTION = 0x1f
+
+_COMMAND_NAMES = {
+    0x0e: 'ping',
+    0x11: 'change_user',
+    0x1a: 'reset_stmt',
+    _COM_QUERY: 'query',
+    _COM_STMT_PREPARE: 'prepare',
+    _COM_STMT_EXECUTE: 'execute',
+    _COM_STMT_CLOSE: 'close_stmt',
+    _COM_RESET_CONNECTION: 'reset',
+}
+
+_STATUS_AUTOCOMMIT = 0x0002
+_STATUS_MORE_RESULTS = 0x0008
+
+_TYPE_VAR_STRING = 0xfd
+
+_ROWS = re.compile(r"standin_rows\('([^']*)'\)", re.IGNORECASE)
+_PARSE_TSO = re.compile(r'tidb_parse_tso\((\d+)\)', re.IGNORECASE)
+_NAME = r'([\w`.]+)'
+_CREATE_TABLE = re.compile(r'create\s+(?:global\s+)?(?:temporary\s+)?table\s+(?:if\s+not\s+exists\s+)?' + _NAME,
+                           re.IGNORECASE)
+_ALTER_TABLE = re.compile(r'alter\s+table\s+' + _NAME, re.IGNORECASE)
+_RENAME_TABLE = re.compile(r'rename\s+table\s+' + _NAME + r'\s+to\s+' + _NAME, re.IGNORECASE)
+_DROP_TABLE = re.compile(r'drop\s+table\s+(?:if\s+exists\s+)?' + _NAME, re.IGNORECASE)
+_SHOW_CREATE_TABLE = re.compile(r'show\s+create\s+table\s+' + _NAME, re.IGNORECASE)
+_SELECT_FROM = re.compile(r'select\s.*?\sfrom\s+' + _NAME, re.IGNORECASE)
+
+
+def _lenenc_str(value: bytes):
+    if len(value) < 251:
+        return bytes([len(value)]) + value
+    assert len(value) < 1 << 16
+    return b'\xfc' + struct.pack('<H', len(value)) + value
+
+
+def _ok(status=_STATUS_AUTOCOMMIT):
+    return b'\x00\x00\x00' + struct.pack('<HH', status, 0)
+
+
+def _eof(status=_STATUS_AUTOCOMMIT):
+    return b'\xfe' + struct.pack('<HH', 0, status)
+
+
+def _error(msg, errno=1105):
+    return b'\xff' + struct.pack('<H', errno) + b'#HY000' + msg.encode()
+
+
+def _column(name):
+    return (_lenenc_str(b'def') + _lenenc_str(b'') * 3 + _lenenc_str(name.encode()) + _lenenc_str(b'')
+            + b'\x0c' + struct.pack('<HIBHB', 0x21, 255, _TYPE_VAR_STRING, 0, 0) + b'\x00\x00')
+
+
+def _rows(sql):
+    """
+    :return: the values of the rows of a `select`, each a str
+    """
+    match = _ROWS.search(sql)
+    if match:
+        return [v for v in match.group(1).split(',') if v] if match.group(1) else []
+    if '@@tidb_current_ts' in sql.lower():
+        return [str(int(time.time() * 1000) << 18)]
+    match = _PARSE_TSO.search(sql)
+    if match:
+        ms = int(match.group(1)) >> 18
+        return [datetime.datetime.fromtimestamp(ms / 1000).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]]
+    return ['1']
+
+
+class _Disconnect(Exception):
+    pass
+
+
+class _StatementError(Exception):
+    def __init__(self, errno, msg):
+        super().__init__(msg)
+        self.errno = errno
+        self.msg = msg
+
+
+class StandinServer:
+    """
+    Runs in a child process rather than a thread, the C extension of `mysql.connector` holds the GIL while it waits
+    for the server.
+    """
+
+    def __init__(self, *, latency=0.002, log=False):
+        self.latency = latency
+        self.port = None
+        self._process = None
+        self._log = None
+        self._commands = []
+        if log:
+            # written without a feeder thread, so a command is in the pipe before it is answered
+            self._log = multiprocessing.get_context('fork').SimpleQueue()
+
+    def start(self):
+        ctx = multiprocessing.get_context('fork')
+        reader, writer = ctx.Pipe(duplex=False)
+        self._process = ctx.Process(target=self._run, args=(writer,), daemon=True)
+        self._process.start()
+        self.port = reader.recv()
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def commands(self, *, connection_id=None):
+        """
+        :return: the commands received so far with `log=True`, each as (connection id, command, sql), the sql of an
+                 `execute` is the statement it was prepared from
+        """
+        while not self._log.empty():
+            self._commands.append(self._log.get())
+        return [c for c in self._commands if connection_id is None or c[0] == connection_id]
+
+    def statements(self, *, connection_id=None):
+        """
+        :return: the sql of the queries received so far with `log=True`
+        """
+        return [sql for _, command, sql in self.commands(connection_id=connection_id) if command == 'query']
+
+    def clear(self):
+        self.commands()
+        self._commands = []
+
+    def _run(self, writer):
+        self._next_connection_id = 0
+        self._tables = {}
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self._serve, host='127.0.0.1', port=0))
+        writer.send(server.sockets[0].getsockname()[1])
+        loop.run_forever()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._next_connection_id += 1
+        connection_id = self._next_connection_id
+        try:
+            self._write(writer, 0, self._handshake(connection_id))
+            seq, _ = await self._read(reader)
+            self._write(writer, seq + 1, _ok())
+            statements = {}
+            while True:
+                _, payload = await self._read(reader)
+                if not payload or payload[0] == _COM_QUIT:
+                    break
+                self._record(connection_id, payload, statements)
+                if payload[0] == _COM_STMT_CLOSE:
+                    # the client does not wait for a reply
+                    statements.pop(struct.unpack('<I', payload[1:5])[0], None)
+                    continue
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if payload[0] == _COM_QUERY:
+                    self._reply_query(writer, payload[1:].decode())
+                elif payload[0] == _COM_STMT_PREPARE:
+                    self._reply_prepare(writer, statements, payload[1:].decode())
+                elif payload[0] == _COM_STMT_EXECUTE:
+                    self._reply_execute(writer, statements.get(struct.unpack('<I', payload[1:5])[0]))
+                else:
+                    if payload[0] == _COM_RESET_CONNECTION:
+                        statements.clear()
+                    self._write(writer, 1, _ok())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, _Disconnect):
+            pass
+        finally:
+            writer.close()
+
+    def _record(self, connection_id, payload, statements):
+        if self._log is None:
+            return
+
+        command = _COMMAND_NAMES.get(payload[0], f'0x{payload[0]:02x}')
+        if payload[0] in (_COM_QUERY, _COM_STMT_PREPARE):
+            sql = payload[1:].decode()
+        elif payload[0] in (_COM_STMT_EXECUTE, _COM_STMT_CLOSE):
+            sql = statements.get(struct.unpack('<I', payload[1:5])[0], (None,))[0]
+        else:
+            sql = None
+        self._log.put((connection_id, command, sql))
+
+    def _reply_query(self, writer, sql):
+        statements = [s.strip() for s in sql.split(';') if s.strip()]
+        seq = 1
+        for i, stmt in enumerate(statements):
+            if 'standin_disconnect' in stmt.lower():
+                raise _Disconnect()
+            try:
+                if 'standin_error' in stmt.lower():
+                    raise _StatementError(1105, f'standin error: {stmt}')
+                result = self._result(stmt)
+            except _StatementError as e:
+                self._write(writer, seq, _error(e.msg, e.errno))
+                return
+
+            status = _STATUS_AUTOCOMMIT | (_STATUS_MORE_RESULTS if i < len(statements) - 1 else 0)
+            if result:
+                names, rows = result
+                packets = [bytes([len(names)]), *(_column(name) for name in names), _eof()]
+                packets.extend(b''.join(_lenenc_str(v.encode()) for v in row) for row in rows)
+                packets.append(_eof(status))
+                for packet in packets:
+                    self._write(writer, seq, packet)
+                    seq += 1
+            else:
+                self._write(writer, seq, _ok(status))
+                seq += 1
+
+    def _result(self, stmt):
+        """
+        :return: (column names, rows) of the statement, or None when it is answered with an OK packet
+        """
+        if stmt.lower().startswith('select'):
+            match = _SELECT_FROM.match(stmt)
+            if match and match.group(1).replace('`', '') in self._tables:
+                return ['v'], []
+            return ['v'], [(v,) for v in _rows(stmt)]
+
+        match = _SHOW_CREATE_TABLE.match(stmt)
+        if match:
+            name = self._table(match.group(1))
+            return ['Table', 'Create Table'], [(name.split('.')[-1], self._tables[name])]
+
+        match = _CREATE_TABLE.match(stmt)
+        if match:
+            name = match.group(1).replace('`', '')
+            if name in self._tables and not re.search(r'if\s+not\s+exists', stmt, re.IGNORECASE):
+                raise _StatementError(1050, f"Table '{name}' already exists")
+            self._tables.setdefault(name, stmt)
+            return None
+
+        match = _ALTER_TABLE.match(stmt)
+        if match:
+            self._tables[self._table(match.group(1))] += f' /* {stmt} */'
+            return None
+
+        match = _RENAME_TABLE.match(stmt)
+        if match:
+            self._tables[match.group(2).replace('`', '')] = self._tables.pop(self._table(match.group(1)))
+            return None
+
+        match = _DROP_TABLE.match(stmt)
+        if match:
+            name = match.group(1).replace('`', '')
+            if name not in self._tables and not re.search(r'if\s+exists', stmt, re.IGNORECASE):
+                raise _StatementError(1051, f"Unknown table '{name}'")
+            self._tables.pop(name, None)
+        return None
+
+    def _table(self, name):
+        name = name.replace('`', '')
+        if name not in self._tables:
+            raise _StatementError(1146, f"Table '{name}' doesn't exist")
+        return name
+
+    def _reply_prepare(self, writer, statements, sql):
+        if 'standin_error' in sql.lower():
+            self._write(writer, 1, _error(f'standin error: {sql}'))
+            return
+
+        statement_id = max(statements, default=0) + 1
+        is_select = sql.strip().lower().startswith('select')
+        statements[statement_id] = (sql, is_select)
+        columns = ['v'] if is_select else []
+        params = ['?'] * sql.count('?')
+        packets = [b'\x00' + struct.pack('<IHHBH', statement_id, len(columns), len(params), 0, 0)]
+        for names in (params, columns):
+            if names:
+                packets.extend(_column(name) for name in names)
+                packets.append(_eof())
+        for seq, packet in enumerate(packets, 1):
+            self._write(writer, seq, packet)
+
+    def _reply_execute(self, writer, statement):
+        if statement is None:
+            self._write(writer, 1, _error('Unknown prepared statement handler given to mysqld_stmt_execute', 1243))
+            return
+
+        sql, is_select = statement
+        if not is_select:
+            self._write(writer, 1, _ok())
+            return
+
+        # a binary row is a 0x00 header, the NULL bitmap of the columns and the values
+        packets = [b'\x01', _column('v'), _eof()]
+        packets.extend(b'\x00\x00' + _lenenc_str(v.encode()) for v in _rows(sql))
+        packets.append(_eof())
+        for seq, packet in enumerate(packets, 1):
+            self._write(writer, seq, packet)
+
+    @staticmethod
+    def _handshake(connection_id):
+        salt = b'abcdefghijklmnopqrst'
+        return (b'\x0a' + b'5.7.25-standin\x00' + struct.pack('<I', connection_id) + salt[:8] + b'\x00'
+                + struct.pack('<HBHHB', _CAPABILITIES & 0xffff, 0x21, _STATUS_AUTOCOMMIT, _CAPABILITIES >> 16,
+                              len(salt) + 1)
+                + b'\x00' * 10 + salt[8:] + b'\x00' + b'mysql_native_password\x00')
+
+    @staticmethod
+    async def _read(reader):
+        header = await reader.readexactly(4)
+        length = header[0] | header[1] << 8 | header[2] << 16
+        return header[3], await reader.readexactly(length)
+
+    @staticmethod
+    def _write(writer, seq, payload):
+        writer.write(struct.pack('<I', len(payload))[:3] + bytes([seq & 0xff]) + payload)